@@ -1,15 +1,22 @@
-import os
 from pyspark import SparkConf
-from pyspark.sql import SparkSession
+from pyspark.sql import SparkSession, Window
 from pyspark.sql.functions import *
 from pyspark.sql.types import *
 from pyspark.ml.feature import BucketedRandomProjectionLSH
 from pyspark.mllib.feature import Word2Vec
 from pyspark.ml.linalg import Vectors
+import builtins
 import random
-from collections import defaultdict
+import time
+from collections import defaultdict, namedtuple
 import numpy as np
 from pyspark.sql import functions as F
+import RandomWalk
+from RandomWalk import AliasWalker, Node2VecWalker
+from EmbeddingSink import exportVectors, fileSink, RedisSink
+
+redisEndpoint = "localhost"
+redisPort = 6379
 
 
 class UdfFunction:
@@ -30,19 +37,42 @@ class UdfFunction:
         return [x[0] for x in pairs]
 
 
-def processItemSequence(spark, rawSampleDataPath):
+def buildItemSequence(ratingSamples, sessionGapSeconds=None, maxSeqLength=None):
+    """
+    build time ordered positive movie sequences with native spark expressions, no python worker involved
+    sessionGapSeconds: start a new sequence when two positive ratings of a user are further apart than this gap
+    maxSeqLength: keep only the most recent maxSeqLength movies of each sequence
+    """
+    positiveSamples = ratingSamples \
+        .where(F.col("rating") >= 3.5) \
+        .withColumn("timestampLong", F.col("timestamp").cast(LongType()))
+    groupCols = ["userId"]
+    if sessionGapSeconds:
+        userWindow = Window.partitionBy("userId").orderBy("timestampLong")
+        positiveSamples = positiveSamples \
+            .withColumn("newSession", F.when(F.col("timestampLong") - F.lag("timestampLong").over(userWindow)
+                                             > sessionGapSeconds, 1).otherwise(0)) \
+            .withColumn("sessionId", F.sum("newSession").over(userWindow))
+        groupCols.append("sessionId")
+    # sorting an array of (timestamp, movieId) structs orders the movies by time
+    userSeq = positiveSamples \
+        .groupBy(*groupCols) \
+        .agg(F.sort_array(F.collect_list(F.struct("timestampLong", "movieId"))).alias("events")) \
+        .withColumn("movieIds", F.col("events.movieId"))
+    if maxSeqLength:
+        userSeq = userSeq.withColumn("movieIds", F.expr(
+            "slice(movieIds, greatest(size(movieIds) - {0} + 1, 1), {0})".format(int(maxSeqLength))))
+    return userSeq.drop("events")
+
+
+def processItemSequence(spark, rawSampleDataPath, sessionGapSeconds=None, maxSeqLength=None):
     # rating data
     ratingSamples = spark.read.format("csv").option("header", "true").load(rawSampleDataPath)
     # ratingSamples.show(5)
     # ratingSamples.printSchema()
-    sortUdf = udf(UdfFunction.sortF, ArrayType(StringType()))
-    userSeq = ratingSamples \
-        .where(F.col("rating") >= 3.5) \
-        .groupBy("userId") \
-        .agg(sortUdf(F.collect_list("movieId"), F.collect_list("timestamp")).alias('movieIds')) \
-        .withColumn("movieIdStr", array_join(F.col("movieIds"), " "))
-    # userSeq.select("userId", "movieIdStr").show(10, truncate = False)
-    return userSeq.select('movieIdStr').rdd.map(lambda x: x[0].split(' '))
+    userSeq = buildItemSequence(ratingSamples, sessionGapSeconds, maxSeqLength)
+    # userSeq.select("userId", "movieIds").show(10, truncate = False)
+    return userSeq.select('movieIds').rdd.map(lambda x: x[0])
 
 
 def embeddingLSH(spark, movieEmbMap):
@@ -64,20 +94,149 @@ def embeddingLSH(spark, movieEmbMap):
     bucketModel.approxNearestNeighbors(movieEmbDF, sampleEmb, 5).show(truncate=False)
 
 
-def trainItem2vec(spark, samples, embLength, embOutputPath, saveToRedis, redisKeyPrefix):
-    word2vec = Word2Vec().setVectorSize(embLength).setWindowSize(5).setNumIterations(10)
+def movieEmbeddingDF(spark, itemVectors, normalize=True):
+    """
+    movieId, emb dataframe from (movieId, [float]) pairs
+    normalize: l2 normalize the vectors so that euclidean distance of LSH ranks like cosine similarity
+    """
+    movieEmbSeq = []
+    for movieId, embedding in itemVectors:
+        embedding = np.asarray(embedding, dtype=np.float64)
+        norm = np.linalg.norm(embedding)
+        if normalize and norm > 0:
+            embedding = embedding / norm
+        movieEmbSeq.append((movieId, Vectors.dense(embedding.tolist())))
+    return spark.createDataFrame(movieEmbSeq).toDF("movieId", "emb")
+
+
+def exactNeighbors(itemVectors, queryIds, topK, normalize=True):
+    """
+    brute force topK neighbors of a few query movies, the ground truth of the LSH recall check
+    topK is clamped to the number of other movies
+    return: {movieId: (set of neighbor ids, distance of the topK-th neighbor)}
+    """
+    movieIds = np.array([movieId for movieId, _ in itemVectors])
+    matrix = np.array([embedding for _, embedding in itemVectors], dtype=np.float64)
+    if normalize:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms > 0, norms, 1.0)
+    rowIndex = {movieId: i for i, movieId in enumerate(movieIds)}
+    k = builtins.min(topK, len(movieIds) - 1)
+    neighbors = {}
+    for movieId in queryIds:
+        if k <= 0:
+            neighbors[movieId] = (set(), 0.0)
+            continue
+        distances = np.linalg.norm(matrix - matrix[rowIndex[movieId]], axis=1)
+        distances[rowIndex[movieId]] = np.inf
+        nearest = np.argpartition(distances, k - 1)[:k]
+        neighbors[movieId] = (set(movieIds[nearest].tolist()), float(np.max(distances[nearest])))
+    return neighbors
+
+
+def similarityJoinTopK(lshModel, queryDF, movieEmbDF, distanceThreshold, topK):
+    # approximate self join, then a distributed per movie topK by distance
+    pairs = lshModel.approxSimilarityJoin(queryDF, movieEmbDF, distanceThreshold, distCol='distance') \
+        .select(F.col('datasetA.movieId').alias('movieId'), F.col('datasetB.movieId').alias('similarMovieId'),
+                'distance') \
+        .where(F.col('movieId') != F.col('similarMovieId'))
+    return pairs \
+        .withColumn('rank', F.row_number().over(Window.partitionBy('movieId').orderBy('distance', 'similarMovieId'))) \
+        .where(F.col('rank') <= topK)
+
+
+def tuneLSHParams(spark, itemVectors, topK=20, sampleSize=200, targetRecall=0.9,
+                  bucketLengthScales=(0.5, 1.0, 2.0, 4.0), numHashTablesGrid=(1, 2, 4, 8), seed=2020):
+    """
+    pick bucketLength and numHashTables from a sampled recall check
+    exact topK neighbors of sampleSize random movies are the ground truth, every grid point runs the LSH join
+    for those movies only, the fastest setting reaching targetRecall wins (the best recall if none does)
+    return: (bucketLength, numHashTables, distanceThreshold)
+    """
+    movieEmbDF = movieEmbeddingDF(spark, itemVectors).cache()
+    allIds = [movieId for movieId, _ in itemVectors]
+    queryIds = random.Random(seed).sample(allIds, builtins.min(sampleSize, len(allIds)))
+    truth = exactNeighbors(itemVectors, queryIds, topK)
+    # every true neighbor of the sample lies within the largest topK-th distance
+    distanceThreshold = float(np.max([kthDistance for _, kthDistance in truth.values()]))
+    queryDF = movieEmbDF.where(F.col('movieId').isin(queryIds)).cache()
+    results = []
+    for numHashTables in numHashTablesGrid:
+        for scale in bucketLengthScales:
+            bucketLength = distanceThreshold * scale
+            lshModel = BucketedRandomProjectionLSH(inputCol="emb", outputCol="bucketId", bucketLength=bucketLength,
+                                                   numHashTables=numHashTables, seed=seed).fit(movieEmbDF)
+            start = time.time()
+            found = defaultdict(set)
+            for row in similarityJoinTopK(lshModel, queryDF, movieEmbDF, distanceThreshold, topK).collect():
+                found[row['movieId']].add(row['similarMovieId'])
+            cost = time.time() - start
+            recall = float(np.mean([len(found[q] & truth[q][0]) / (len(truth[q][0]) or 1) for q in queryIds]))
+            print("bucketLength {:.4f} numHashTables {} recall@{} {:.3f} time {:.2f}s".format(
+                bucketLength, numHashTables, topK, recall, cost))
+            results.append((recall >= targetRecall, -cost if recall >= targetRecall else recall,
+                            bucketLength, numHashTables))
+    queryDF.unpersist()
+    movieEmbDF.unpersist()
+    _, _, bucketLength, numHashTables = sorted(results, key=lambda x: (x[0], x[1]))[-1]
+    return bucketLength, numHashTables, distanceThreshold
+
+
+def generateSimilarMovies(spark, itemVectors, similarOutputPath, topK=20, bucketLength=None, numHashTables=None,
+                          distanceThreshold=None, numPartitions=None, seed=2020):
+    """
+    all pairs similar movies by an approximate LSH self join, topK neighbors per movie ordered by similarity
+    seed: seed of the LSH hash functions, the tuning recall check runs on the same hash functions as the job
+    output: "movieId:similarId1 similarId2 ..." text partitions for the online similar movie service
+    """
+    if bucketLength is None or numHashTables is None or distanceThreshold is None:
+        bucketLength, numHashTables, distanceThreshold = tuneLSHParams(spark, itemVectors, topK, seed=seed)
+    movieEmbDF = movieEmbeddingDF(spark, itemVectors).cache()
+    lshModel = BucketedRandomProjectionLSH(inputCol="emb", outputCol="bucketId", bucketLength=bucketLength,
+                                           numHashTables=numHashTables, seed=seed).fit(movieEmbDF)
+    similarMovies = similarityJoinTopK(lshModel, movieEmbDF, movieEmbDF, distanceThreshold, topK) \
+        .groupBy('movieId') \
+        .agg(F.sort_array(F.collect_list(F.struct('rank', 'similarMovieId'))).alias('similar')) \
+        .select('movieId', F.col('similar.similarMovieId').alias('similarMovieIds'))
+    if numPartitions:
+        similarMovies = similarMovies.repartition(numPartitions)
+    similarMovies.select(F.concat_ws(':', F.col('movieId'), F.concat_ws(' ', F.col('similarMovieIds')))) \
+        .write.mode('overwrite').text(similarOutputPath)
+    movieEmbDF.unpersist()
+
+
+def buildWord2Vec(embLength, numPartitions=1, numIterations=10, minCount=5, learningRate=0.025, windowSize=5,
+                  seed=None):
+    """
+    numPartitions: partitions trained in parallel, their models are averaged after every iteration
+    learningRate: initial learning rate, mllib decays it linearly towards 0.0001 * learningRate while training,
+                  more partitions usually need more iterations or a larger rate to keep the same quality
+    """
+    word2vec = Word2Vec().setVectorSize(embLength).setWindowSize(windowSize).setNumIterations(numIterations) \
+        .setNumPartitions(numPartitions).setMinCount(minCount).setLearningRate(learningRate)
+    if seed is not None:
+        word2vec = word2vec.setSeed(seed)
+    return word2vec
+
+
+def trainItem2vec(spark, samples, embLength, embOutputPath, saveToRedis, redisKeyPrefix, numPartitions=1,
+                  numIterations=10, minCount=5, learningRate=0.025, redisHost=redisEndpoint, redisPort=redisPort,
+                  redisBatchSize=1000, redisTtlSeconds=60 * 60 * 24):
+    """
+    embOutputPath: "movieId:emb" text file, or an npz file of ids and a float32 matrix for a .npz path
+    saveToRedis: also SET redisKeyPrefix:movieId on the redis server at redisHost:redisPort, in pipelined batches
+                 of redisBatchSize that expire after redisTtlSeconds
+    """
+    word2vec = buildWord2Vec(embLength, numPartitions, numIterations, minCount, learningRate)
     model = word2vec.fit(samples)
     synonyms = model.findSynonyms("158", 20)
     for synonym, cosineSimilarity in synonyms:
         print(synonym, cosineSimilarity)
-    embOutputDir = '/'.join(embOutputPath.split('/')[:-1])
-    if not os.path.exists(embOutputDir):
-        os.makedirs(embOutputDir)
-    with open(embOutputPath, 'w') as f:
-        for movie_id in model.getVectors():
-            vectors = " ".join([str(emb) for emb in model.getVectors()[movie_id]])
-            f.write(movie_id + ":" + vectors + "\n")
-    embeddingLSH(spark, model.getVectors())
+    itemVectors = exportVectors(model)
+    fileSink(embOutputPath).write(itemVectors)
+    if saveToRedis:
+        RedisSink(redisKeyPrefix, redisHost, redisPort, redisTtlSeconds, redisBatchSize).write(itemVectors)
+    embeddingLSH(spark, dict(itemVectors))
     return model
 
 
@@ -117,6 +276,94 @@ def generateTransitionMatrix(samples):
     return transitionMatrix, itemDistribution
 
 
+# CSR form of the item transition graph, row i holds the out edges of itemIds[i]
+TransitionGraph = namedtuple('TransitionGraph', ['itemIds', 'itemProbs', 'indptr', 'indices', 'probs'])
+
+
+def generateTransitionGraph(spark, samples, topN=None):
+    """
+    distributed version of generateTransitionMatrix, pair counting and normalization stay on the executors
+    topN: keep only the topN most frequent out edges of every item, probabilities are normalized after pruning
+    return:
+        nodes: itemIdx, movieId, itemProb (start distribution of the random walk)
+        adjacency: itemIdx, dstIdxs, dstProbs, one compact CSR row per item with out edges
+    """
+    pairSchema = StructType([StructField('src', StringType(), False), StructField('dst', StringType(), False)])
+    pairCounts = spark.createDataFrame(samples.flatMap(lambda x: generate_pair(x)), pairSchema) \
+        .groupBy('src', 'dst').count()
+    itemCounts = pairCounts.groupBy('src').agg(F.sum('count').alias('itemCount'))
+    pairTotalCount = itemCounts.agg(F.sum('itemCount')).head()[0]
+    srcWindow = Window.partitionBy('src')
+    if topN:
+        pairCounts = pairCounts \
+            .withColumn('rank', F.row_number().over(srcWindow.orderBy(F.desc('count'), 'dst'))) \
+            .where(F.col('rank') <= topN).drop('rank')
+    edges = pairCounts.withColumn('prob', F.col('count') / F.sum('count').over(srcWindow))
+    # dense integer index of every item, checkpointed so that the index stays stable across the joins below
+    indexSchema = StructType([StructField('movieId', StringType(), False), StructField('itemIdx', LongType(), False)])
+    itemIndex = spark.createDataFrame(
+        edges.select(F.col('src').alias('movieId')).union(edges.select(F.col('dst').alias('movieId'))).distinct()
+            .rdd.map(lambda x: x[0]).zipWithIndex(), indexSchema) \
+        .withColumn('itemIdx', F.col('itemIdx').cast(IntegerType())) \
+        .localCheckpoint()
+    nodes = itemIndex \
+        .join(itemCounts.withColumnRenamed('src', 'movieId'), on='movieId', how='left') \
+        .withColumn('itemProb', F.coalesce(F.col('itemCount') / pairTotalCount, F.lit(0.0))) \
+        .select('itemIdx', 'movieId', 'itemProb')
+    srcIndex = F.broadcast(itemIndex.withColumnRenamed('movieId', 'src'))
+    dstIndex = F.broadcast(itemIndex.toDF('dst', 'dstIdx'))
+    adjacency = edges.join(srcIndex, on='src').join(dstIndex, on='dst') \
+        .groupBy('itemIdx') \
+        .agg(F.sort_array(F.collect_list(F.struct('dstIdx', 'prob'))).alias('outEdges')) \
+        .select('itemIdx', F.col('outEdges.dstIdx').alias('dstIdxs'), F.col('outEdges.prob').alias('dstProbs'))
+    return nodes, adjacency
+
+
+def saveTransitionGraph(nodes, adjacency, transitionGraphPath):
+    nodes.write.mode('overwrite').parquet(transitionGraphPath + '/nodes')
+    adjacency.write.mode('overwrite').parquet(transitionGraphPath + '/adjacency')
+
+
+def loadTransitionGraph(spark, transitionGraphPath):
+    return collectTransitionGraph(spark.read.parquet(transitionGraphPath + '/nodes'),
+                                  spark.read.parquet(transitionGraphPath + '/adjacency'))
+
+
+def collectTransitionGraph(nodes, adjacency):
+    """
+    pull the graph into numpy CSR arrays, O(edges) numbers instead of nested python dicts
+    """
+    nodeRows = nodes.orderBy('itemIdx').collect()
+    itemIds = np.array([row['movieId'] for row in nodeRows])
+    itemProbs = np.array([row['itemProb'] for row in nodeRows], dtype=np.float64)
+    adjacencyRows = adjacency.collect()
+    degrees = np.zeros(len(itemIds), dtype=np.int64)
+    for row in adjacencyRows:
+        degrees[row['itemIdx']] = len(row['dstIdxs'])
+    indptr = np.concatenate(([0], np.cumsum(degrees)))
+    indices = np.empty(indptr[-1], dtype=np.int32)
+    probs = np.empty(indptr[-1], dtype=np.float64)
+    for row in adjacencyRows:
+        start, end = indptr[row['itemIdx']], indptr[row['itemIdx'] + 1]
+        indices[start:end] = row['dstIdxs']
+        probs[start:end] = row['dstProbs']
+    return TransitionGraph(itemIds, itemProbs, indptr, indices, probs)
+
+
+def transitionGraphToMatrix(graph):
+    # dict form expected by oneRandomWalk, which is kept as the reference implementation of RandomWalk.AliasWalker
+    transitionMatrix = defaultdict(dict)
+    itemDistribution = defaultdict(dict)
+    for i, itemId in enumerate(graph.itemIds):
+        start, end = graph.indptr[i], graph.indptr[i + 1]
+        if start == end:
+            continue
+        itemDistribution[itemId] = graph.itemProbs[i]
+        for dst, prob in zip(graph.indices[start:end], graph.probs[start:end]):
+            transitionMatrix[itemId][graph.itemIds[dst]] = prob
+    return transitionMatrix, itemDistribution
+
+
 def oneRandomWalk(transitionMatrix, itemDistribution, sampleLength):
     sample = []
     # pick the first element
@@ -154,16 +401,61 @@ def randomWalk(transitionMatrix, itemDistribution, sampleCount, sampleLength):
     return samples
 
 
-def graphEmb(samples, spark, embLength, embOutputFilename, saveToRedis, redisKeyPrefix):
-    transitionMatrix, itemDistribution = generateTransitionMatrix(samples)
-    sampleCount = 20000
-    sampleLength = 10
-    newSamples = randomWalk(transitionMatrix, itemDistribution, sampleCount, sampleLength)
-    rddSamples = spark.sparkContext.parallelize(newSamples)
-    trainItem2vec(spark, rddSamples, embLength, embOutputFilename, saveToRedis, redisKeyPrefix)
+def generateWalkSamples(spark, graph, sampleCount, sampleLength, numPartitions=None, seed=None, batchSize=10000,
+                        p=1.0, q=1.0):
+    """
+    generate random walks on the executors, the walker (CSR + alias tables) is broadcast once
+    p, q: node2vec return and in-out parameters, p = q = 1 is the first order DeepWalk walk
+    every partition draws from its own rng seeded by (seed, partition index), so a recomputed partition
+    reproduces exactly the same walks and no walk ever passes through the driver
+    """
+    sc = spark.sparkContext
+    sc.addPyFile(RandomWalk.__file__)
+    numPartitions = numPartitions or sc.defaultParallelism
+    baseSeed = seed if seed is not None else np.random.SeedSequence().entropy
+    walker = AliasWalker(graph) if p == 1.0 and q == 1.0 else Node2VecWalker(graph, p, q)
+    walkerBroadcast = sc.broadcast(walker)
+
+    def walkPartition(partitionIndex, _):
+        walker = walkerBroadcast.value
+        rng = np.random.default_rng([baseSeed, partitionIndex])
+        partitionCount = sampleCount // numPartitions + (1 if partitionIndex < sampleCount % numPartitions else 0)
+        for batchStart in range(0, partitionCount, batchSize):
+            batchCount = builtins.min(batchSize, partitionCount - batchStart)
+            for walk in walker.walkItems(batchCount, sampleLength, rng):
+                yield walk
+
+    return sc.parallelize(range(numPartitions), numPartitions).mapPartitionsWithIndex(walkPartition)
+
+
+def graphEmb(samples, spark, embLength, embOutputFilename, saveToRedis, redisKeyPrefix, topN=None,
+             transitionGraphPath=None, sampleCount=20000, sampleLength=10, numPartitions=None, seed=None,
+             p=1.0, q=1.0, redisHost=redisEndpoint, redisPort=redisPort, redisBatchSize=1000,
+             redisTtlSeconds=60 * 60 * 24):
+    nodes, adjacency = generateTransitionGraph(spark, samples, topN)
+    if transitionGraphPath:
+        saveTransitionGraph(nodes, adjacency, transitionGraphPath)
+        graph = loadTransitionGraph(spark, transitionGraphPath)
+    else:
+        graph = collectTransitionGraph(nodes, adjacency)
+    rddSamples = generateWalkSamples(spark, graph, sampleCount, sampleLength, numPartitions, seed, p=p, q=q)
+    trainItem2vec(spark, rddSamples, embLength, embOutputFilename, saveToRedis, redisKeyPrefix, redisHost=redisHost,
+                  redisPort=redisPort, redisBatchSize=redisBatchSize, redisTtlSeconds=redisTtlSeconds)
 
 
-def generateUserEmb(spark, rawSampleDataPath, model, embLength, embOutputPath, saveToRedis, redisKeyPrefix):
+def generateUserEmb(spark, rawSampleDataPath, model, embLength, embOutputPath, saveToRedis, redisKeyPrefix,
+                    weightByRating=False, decayHalfLifeDays=None, numPartitions=None, partitionedOutput=False,
+                    redisHost=redisEndpoint, redisPort=redisPort, redisBatchSize=1000, redisTtlSeconds=60 * 60 * 24):
+    """
+    user embedding = weighted sum of the embeddings of the movies the user rated
+    weightByRating: weight every movie by its rating
+    decayHalfLifeDays: halve the weight of a movie every decayHalfLifeDays before the user's latest rating
+    partitionedOutput: the executors write "userId:emb" text partitions to the embOutputPath directory,
+                       otherwise the rows are streamed one partition at a time into the single embOutputPath file
+                       the online DataManager loads, or into an npz file for a .npz path
+    saveToRedis: the executors also SET redisKeyPrefix:userId on redisHost:redisPort, see trainItem2vec
+    the small movie vector table is broadcast, vectors are summed per dimension by spark's native aggregation
+    """
     ratingSamples = spark.read.format("csv").option("header", "true").load(rawSampleDataPath)
     Vectors_list = []
     for key, value in model.getVectors().items():
@@ -174,17 +466,36 @@ def generateUserEmb(spark, rawSampleDataPath, model, embLength, embOutputPath, s
     ]
     schema = StructType(fields)
     Vectors_df = spark.createDataFrame(Vectors_list, schema=schema)
-    ratingSamples = ratingSamples.join(Vectors_df, on='movieId', how='inner')
-    result = ratingSamples.select('userId', 'emb').rdd.map(lambda x: (x[0], x[1])) \
-        .reduceByKey(lambda a, b: [a[i] + b[i] for i in range(len(a))]).collect()
-    with open(embOutputPath, 'w') as f:
-        for row in result:
-            vectors = " ".join([str(emb) for emb in row[1]])
-            f.write(row[0] + ":" + vectors + "\n")
+    ratingSamples = ratingSamples.join(F.broadcast(Vectors_df), on='movieId', how='inner')
+    weight = F.lit(1.0)
+    if weightByRating:
+        weight = weight * F.col('rating').cast(DoubleType())
+    if decayHalfLifeDays:
+        ageSeconds = F.max(F.col('timestamp').cast(LongType())).over(Window.partitionBy('userId')) \
+                     - F.col('timestamp').cast(LongType())
+        weight = weight * F.pow(F.lit(0.5), ageSeconds / (decayHalfLifeDays * 24 * 3600.0))
+    userEmb = ratingSamples.withColumn('weight', weight) \
+        .groupBy('userId') \
+        .agg(*[F.sum(F.col('emb')[i] * F.col('weight')).alias('emb{}'.format(i)) for i in range(embLength)]) \
+        .select('userId', F.array(*['emb{}'.format(i) for i in range(embLength)]).alias('emb'))
+    if numPartitions:
+        userEmb = userEmb.repartition(numPartitions)
+    if saveToRedis:
+        userEmb = userEmb.cache()
+    if partitionedOutput:
+        userEmb.select(F.concat_ws(':', F.col('userId'),
+                                   F.concat_ws(' ', F.col('emb').cast(ArrayType(StringType()))))) \
+            .write.mode('overwrite').text(embOutputPath)
+    else:
+        fileSink(embOutputPath).write((row['userId'], row['emb']) for row in userEmb.toLocalIterator())
+    if saveToRedis:
+        RedisSink(redisKeyPrefix, redisHost, redisPort, redisTtlSeconds, redisBatchSize) \
+            .writeDataFrame(userEmb, 'userId', 'emb')
+    return userEmb
 
 
 if __name__ == '__main__':
-    conf = SparkConf().setAppName('ctrModel').setMaster('local')
+    conf = SparkConf().setAppName('ctrModel').setMaster('local[*]')
     spark = SparkSession.builder.config(conf=conf).getOrCreate()
     # Change to your own filepath
     file_path = 'file:///home/hadoop/SparrowRecSys/src/main/resources'
@@ -193,9 +504,11 @@ if __name__ == '__main__':
     samples = processItemSequence(spark, rawSampleDataPath)
     model = trainItem2vec(spark, samples, embLength,
                           embOutputPath=file_path[7:] + "/webroot/modeldata2/item2vecEmb.csv", saveToRedis=False,
-                          redisKeyPrefix="i2vEmb")
+                          redisKeyPrefix="i2vEmb", numPartitions=spark.sparkContext.defaultParallelism)
     graphEmb(samples, spark, embLength, embOutputFilename=file_path[7:] + "/webroot/modeldata2/itemGraphEmb.csv",
-             saveToRedis=True, redisKeyPrefix="graphEmb")
+             saveToRedis=False, redisKeyPrefix="graphEmb",
+             transitionGraphPath=file_path + "/webroot/modeldata2/transitionGraph")
+    generateSimilarMovies(spark, exportVectors(model), file_path + "/webroot/modeldata2/similarMovies")
     generateUserEmb(spark, rawSampleDataPath, model, embLength,
                     embOutputPath=file_path[7:] + "/webroot/modeldata2/userEmb.csv", saveToRedis=False,
                     redisKeyPrefix="uEmb")
@@ -0,0 +1,251 @@
+import csv
+import random
+import select
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+import numpy as np
+from pyspark import SparkConf
+from pyspark.sql import SparkSession
+from pyspark.sql import functions as F
+from pyspark.sql.types import ArrayType, StringType
+from Embedding import UdfFunction, buildItemSequence, processItemSequence, generateTransitionGraph, \
+    collectTransitionGraph, transitionGraphToMatrix, randomWalk, buildWord2Vec, exactNeighbors
+from EmbeddingSink import exportVectors, embeddingToString, RedisSink
+from RandomWalk import AliasWalker, Node2VecWalker
+
+
+def timeAction(action, rounds):
+    # best wall time of several rounds, the first round also warms up the jvm
+    costs = []
+    for _ in range(rounds):
+        start = time.time()
+        action()
+        costs.append(time.time() - start)
+    return min(costs)
+
+
+def udfItemSequence(ratingSamples):
+    # the previous row-at-a-time python udf implementation, kept as the benchmark baseline
+    sortUdf = F.udf(UdfFunction.sortF, ArrayType(StringType()))
+    return ratingSamples \
+        .where(F.col("rating") >= 3.5) \
+        .groupBy("userId") \
+        .agg(sortUdf(F.collect_list("movieId"), F.collect_list("timestamp")).alias('movieIds'))
+
+
+def benchmarkItemSequence(spark, rawSampleDataPath, rounds=3):
+    ratingSamples = spark.read.format("csv").option("header", "true").load(rawSampleDataPath).cache()
+    print("rating count:", ratingSamples.count())
+    candidates = [
+        ("python udf sortF", lambda: udfItemSequence(ratingSamples)),
+        ("native sort_array", lambda: buildItemSequence(ratingSamples)),
+        ("native sort_array + session split 30min", lambda: buildItemSequence(ratingSamples, sessionGapSeconds=1800)),
+        ("native sort_array + max length 50", lambda: buildItemSequence(ratingSamples, maxSeqLength=50)),
+    ]
+    baseline = None
+    for name, buildSeq in candidates:
+        # sum of the sequence sizes forces every sequence to be fully built
+        cost = timeAction(lambda: buildSeq().agg(F.sum(F.size("movieIds"))).collect(), rounds)
+        baseline = baseline or cost
+        print("{:<45s} {:8.2f}s  speedup x{:.2f}".format(name, cost, baseline / cost))
+    ratingSamples.unpersist()
+
+
+def transitionFrequency(walks):
+    # empirical distribution of (item, next item) steps and of walk lengths
+    steps = Counter()
+    lengths = Counter()
+    for walk in walks:
+        lengths[len(walk)] += 1
+        steps.update(zip(walk[:-1], walk[1:]))
+    return steps, lengths
+
+
+def totalVariation(counterA, counterB):
+    totalA, totalB = sum(counterA.values()), sum(counterB.values())
+    return 0.5 * sum(abs(counterA[k] / totalA - counterB[k] / totalB) for k in set(counterA) | set(counterB))
+
+
+def benchmarkRandomWalk(graph, sampleCount=20000, sampleLength=10, seed=2020):
+    transitionMatrix, itemDistribution = transitionGraphToMatrix(graph)
+    walker = AliasWalker(graph)
+    # seeded determinism: same seed gives the same walks, different seed does not
+    walksA = walker.walk(sampleCount, sampleLength, np.random.default_rng(seed))
+    walksB = walker.walk(sampleCount, sampleLength, np.random.default_rng(seed))
+    walksC = walker.walk(sampleCount, sampleLength, np.random.default_rng(seed + 1))
+    assert np.array_equal(walksA, walksB) and not np.array_equal(walksA, walksC), "seeded walks are not deterministic"
+    start = time.time()
+    dictWalks = randomWalk(transitionMatrix, itemDistribution, sampleCount, sampleLength)
+    dictCost = time.time() - start
+    start = time.time()
+    walks = walker.walk(sampleCount, sampleLength, np.random.default_rng(seed))
+    aliasCost = time.time() - start
+    aliasWalks = walker.toSequences(walks)
+    aliasWithIdsCost = time.time() - start
+    print("{:<45s} {:12.0f} walks/sec".format("dict scan oneRandomWalk", sampleCount / dictCost))
+    print("{:<45s} {:12.0f} walks/sec".format("alias lockstep walk", sampleCount / aliasCost))
+    print("{:<45s} {:12.0f} walks/sec".format("alias lockstep walk + movie id lists", sampleCount / aliasWithIdsCost))
+    # both engines sample the same distribution, the distance only reflects sampling noise
+    dictSteps, dictLengths = transitionFrequency(dictWalks)
+    aliasSteps, aliasLengths = transitionFrequency(aliasWalks)
+    print("total variation of step distribution: {:.4f}".format(totalVariation(dictSteps, aliasSteps)))
+    print("total variation of walk length distribution: {:.4f}".format(totalVariation(dictLengths, aliasLengths)))
+
+
+def benchmarkNode2VecWalk(graph, sampleCount=20000, sampleLength=10, seed=2020,
+                          pqSettings=((1.0, 1.0), (0.25, 1.0), (4.0, 1.0), (1.0, 0.25), (1.0, 4.0))):
+    for p, q in pqSettings:
+        walker = Node2VecWalker(graph, p, q)
+        start = time.time()
+        walker.walk(sampleCount, sampleLength, np.random.default_rng(seed))
+        cost = time.time() - start
+        print("{:<45s} {:12.0f} walks/sec".format("node2vec p={} q={}".format(p, q), sampleCount / cost))
+    edgeKeyBytes = Node2VecWalker(graph).edgeKeys.nbytes
+    print("edge key index: {:.1f} MB for {} edges".format(edgeKeyBytes / 1e6, len(graph.indices)))
+
+
+def benchmarkWord2VecPartitions(samples, embLength=10, partitionCounts=(1, 2, 4, 8), numIterations=10,
+                                topK=20, sampleSize=500, resultPath='word2vecPartitionBenchmark.csv', seed=2020):
+    """
+    training time per partition count and a similarity quality check against the single partition model:
+    mean overlap of the topK cosine neighbors of sampleSize random movies
+    the table is also written to resultPath so that runs on different clusters can be compared
+    """
+    samples = samples.cache()
+    samples.count()
+    reference = None
+    rows = []
+    for numPartitions in partitionCounts:
+        word2vec = buildWord2Vec(embLength, numPartitions=numPartitions, numIterations=numIterations, seed=seed)
+        start = time.time()
+        itemVectors = exportVectors(word2vec.fit(samples))
+        cost = time.time() - start
+        if reference is None:
+            queryIds = random.Random(seed).sample([movieId for movieId, _ in itemVectors], sampleSize)
+            reference = exactNeighbors(itemVectors, queryIds, topK)
+        vocabulary = set(movieId for movieId, _ in itemVectors)
+        commonIds = [movieId for movieId in queryIds if movieId in vocabulary]
+        neighbors = exactNeighbors(itemVectors, commonIds, topK)
+        overlap = float(np.mean([len(neighbors[m][0] & reference[m][0]) / topK for m in commonIds]))
+        rows.append((numPartitions, numIterations, round(cost, 2), round(rows[0][2] / cost if rows else 1.0, 2),
+                     round(overlap, 3)))
+        print("partitions {:3d} time {:8.2f}s speedup x{:.2f} top{} neighbor overlap {:.3f}".format(
+            numPartitions, cost, rows[-1][3], topK, overlap))
+    with open(resultPath, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['numPartitions', 'numIterations', 'trainSeconds', 'speedup', 'neighborOverlap'])
+        writer.writerows(rows)
+    samples.unpersist()
+
+
+def parseCommand(buffer):
+    # one RESP array of bulk strings from the start of buffer, (None, 0) until it is complete
+    if not buffer.startswith(b'*') or b'\r\n' not in buffer:
+        return None, 0
+    lineEnd = buffer.index(b'\r\n')
+    position = lineEnd + 2
+    args = []
+    for _ in range(int(buffer[1:lineEnd])):
+        lineEnd = buffer.find(b'\r\n', position)
+        if lineEnd < 0:
+            return None, 0
+        start = lineEnd + 2
+        end = start + int(buffer[position + 1:lineEnd])
+        if len(buffer) < end + 2:
+            return None, 0
+        args.append(buffer[start:end])
+        position = end + 2
+    return args, position
+
+
+class FakeRedisServer:
+    """
+    in-process RESP server on a free local port, answers SET with +OK and keeps key -> (value, ttl seconds)
+    replies are held back until the client stops sending, so rounds records how many commands the client
+    pipelined before it waited for their replies
+    """
+
+    def __init__(self, idleSeconds=0.05):
+        self.store = {}
+        self.rounds = []
+        self.idleSeconds = idleSeconds
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen()
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                connection, _ = self.listener.accept()
+            except OSError:
+                return
+            with connection:
+                self.handle(connection)
+
+    def handle(self, connection):
+        buffer = b''
+        pending = 0
+        while True:
+            readable, _, _ = select.select([connection], [], [], self.idleSeconds)
+            if readable:
+                data = connection.recv(65536)
+                if not data:
+                    return
+                buffer += data
+                command, end = parseCommand(buffer)
+                while command is not None:
+                    self.execute(command)
+                    pending += 1
+                    buffer = buffer[end:]
+                    command, end = parseCommand(buffer)
+            elif pending:
+                self.rounds.append(pending)
+                connection.sendall(b'+OK\r\n' * pending)
+                pending = 0
+
+    def execute(self, args):
+        assert args[0].upper() == b'SET', "unexpected command " + args[0].decode('utf-8')
+        ttl = int(args[4]) if len(args) == 5 and args[3].upper() == b'EX' else None
+        self.store[args[1].decode('utf-8')] = (args[2].decode('utf-8'), ttl)
+
+    def close(self):
+        self.listener.close()
+
+
+def checkRedisSink(count=2500, embLength=10, batchSize=1000, ttlSeconds=3600, seed=2020):
+    # RedisSink against FakeRedisServer: every vector is SET once with EX ttl, in pipelined rounds of batchSize
+    rng = np.random.default_rng(seed)
+    embeddings = [(str(movieId), rng.normal(size=embLength).tolist()) for movieId in range(count)]
+    server = FakeRedisServer()
+    written = RedisSink('i2vEmb', '127.0.0.1', server.port, ttlSeconds, batchSize).write(embeddings)
+    assert written == count, "{} of {} embeddings written".format(written, count)
+    expectedRounds = [batchSize] * (count // batchSize) + ([count % batchSize] if count % batchSize else [])
+    assert server.rounds == expectedRounds, "pipelined rounds {} instead of {}".format(server.rounds, expectedRounds)
+    for movieId, embedding in embeddings:
+        assert server.store['i2vEmb:' + movieId] == (embeddingToString(embedding), ttlSeconds), movieId + " differs"
+    RedisSink('uEmb', '127.0.0.1', server.port, ttlSeconds=None, batchSize=batchSize).write(embeddings[:1])
+    assert server.store['uEmb:0'] == (embeddingToString(embeddings[0][1]), None), "SET without ttl has an expiry"
+    server.close()
+    print("RedisSink wrote {} embeddings in {} pipelined rounds with EX {}".format(count, len(expectedRounds),
+                                                                               ttlSeconds))
+
+
+if __name__ == '__main__':
+    checkRedisSink()
+    conf = SparkConf().setAppName('embeddingBenchmark').setMaster('local[*]')
+    spark = SparkSession.builder.config(conf=conf).getOrCreate()
+    # ml-25m ratings, change to your own filepath
+    rawSampleDataPath = sys.argv[1] if len(sys.argv) > 1 else 'file:///home/hadoop/ml-25m/ratings.csv'
+    benchmarkItemSequence(spark, rawSampleDataPath)
+    samples = processItemSequence(spark, rawSampleDataPath)
+    benchmarkWord2VecPartitions(samples)
+    nodes, adjacency = generateTransitionGraph(spark, samples)
+    graph = collectTransitionGraph(nodes, adjacency)
+    benchmarkRandomWalk(graph)
+    benchmarkNode2VecWalk(graph)
+    spark.stop()
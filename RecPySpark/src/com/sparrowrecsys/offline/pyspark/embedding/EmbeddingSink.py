@@ -0,0 +1,174 @@
+import os
+import socket
+from abc import ABC, abstractmethod
+import numpy as np
+
+
+def exportVectors(model):
+    """
+    bulk export of a word2vec model, getVectors() crosses into the jvm once instead of once per movie
+    return: list of (movieId, [float]) pairs
+    """
+    return [(movieId, list(vector)) for movieId, vector in model.getVectors().items()]
+
+
+def embeddingToString(embedding):
+    return " ".join([str(emb) for emb in embedding])
+
+
+class EmbeddingSink(ABC):
+    """
+    destination of (id, embedding) pairs
+    write() is used for driver side results such as word2vec vectors,
+    writeDataFrame() lets the executors write their own partitions
+    every sink implements writePartition(), it returns the number of embeddings written
+    """
+
+    def write(self, embeddings):
+        return self.writePartition(0, embeddings)
+
+    def writeDataFrame(self, df, idCol, embCol):
+        sink = self
+        rdd = df.select(idCol, embCol).rdd
+        rdd.context.addPyFile(os.path.abspath(__file__))
+        return rdd.mapPartitionsWithIndex(
+            lambda index, rows: [sink.writePartition(index, ((r[0], r[1]) for r in rows))]).sum()
+
+    @abstractmethod
+    def writePartition(self, partitionIndex, embeddings):
+        pass
+
+
+class LocalFileSink(EmbeddingSink):
+    """
+    "id:v1 v2 ..." text lines, the format read by the online DataManager
+    a dataframe is written as one part file per partition under the output directory
+    """
+
+    def __init__(self, outputPath):
+        self.outputPath = outputPath
+
+    def write(self, embeddings):
+        outputDir = os.path.dirname(self.outputPath)
+        if outputDir and not os.path.exists(outputDir):
+            os.makedirs(outputDir)
+        written = 0
+        with open(self.outputPath, 'w') as f:
+            for itemId, embedding in embeddings:
+                f.write(str(itemId) + ":" + embeddingToString(embedding) + "\n")
+                written += 1
+        return written
+
+    def writePartition(self, partitionIndex, embeddings):
+        if not os.path.exists(self.outputPath):
+            os.makedirs(self.outputPath, exist_ok=True)
+        partPath = os.path.join(self.outputPath, 'part-{:05d}.csv'.format(partitionIndex))
+        return LocalFileSink(partPath).write(embeddings)
+
+
+class BinaryFileSink(EmbeddingSink):
+    """
+    npz store of an id array and a float32 embedding matrix, loads with a single np.load
+    a dataframe is written as one part-xxxxx.npz per partition under the output directory
+    """
+
+    def __init__(self, outputPath):
+        self.outputPath = outputPath
+
+    def write(self, embeddings):
+        outputDir = os.path.dirname(self.outputPath)
+        if outputDir and not os.path.exists(outputDir):
+            os.makedirs(outputDir)
+        embeddings = list(embeddings)
+        ids = np.array([str(itemId) for itemId, _ in embeddings])
+        vectors = np.array([embedding for _, embedding in embeddings], dtype=np.float32)
+        with open(self.outputPath, 'wb') as f:
+            np.savez(f, ids=ids, vectors=vectors)
+        return len(ids)
+
+    def writePartition(self, partitionIndex, embeddings):
+        if not os.path.exists(self.outputPath):
+            os.makedirs(self.outputPath, exist_ok=True)
+        partPath = os.path.join(self.outputPath, 'part-{:05d}.npz'.format(partitionIndex))
+        return BinaryFileSink(partPath).write(embeddings)
+
+    @staticmethod
+    def load(path):
+        with np.load(path) as data:
+            return data['ids'], data['vectors']
+
+
+def fileSink(outputPath):
+    # BinaryFileSink for .npz paths, the "id:emb" text format of LocalFileSink otherwise
+    if outputPath.endswith('.npz'):
+        return BinaryFileSink(outputPath)
+    return LocalFileSink(outputPath)
+
+
+class RedisSink(EmbeddingSink):
+    """
+    SET keyPrefix:id "v1 v2 ..." EX ttlSeconds through the redis protocol (RESP)
+    commands are pipelined in batches of batchSize and each batch waits for its replies only once,
+    the sink talks plain sockets so it runs on executors without a redis client library,
+    EmbeddingBenchmark.checkRedisSink runs it against an in-process fake server
+    """
+
+    def __init__(self, keyPrefix, host='localhost', port=6379, ttlSeconds=60 * 60 * 24, batchSize=1000,
+                 timeoutSeconds=30):
+        self.keyPrefix = keyPrefix
+        self.host = host
+        self.port = port
+        self.ttlSeconds = ttlSeconds
+        self.batchSize = batchSize
+        self.timeoutSeconds = timeoutSeconds
+
+    @staticmethod
+    def encodeCommand(*args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            arg = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    @staticmethod
+    def readReply(reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("redis connection closed")
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b'-':
+            raise RuntimeError("redis error: " + payload.decode('utf-8'))
+        if prefix == b'$':
+            length = int(payload)
+            return None if length < 0 else reader.read(length + 2)[:-2]
+        if prefix == b'*':
+            length = int(payload)
+            return None if length < 0 else [RedisSink.readReply(reader) for _ in range(length)]
+        return payload
+
+    def setCommand(self, itemId, embedding):
+        key = self.keyPrefix + ":" + str(itemId)
+        if self.ttlSeconds:
+            return self.encodeCommand('SET', key, embeddingToString(embedding), 'EX', self.ttlSeconds)
+        return self.encodeCommand('SET', key, embeddingToString(embedding))
+
+    def writePartition(self, partitionIndex, embeddings):
+        written = 0
+        with socket.create_connection((self.host, self.port), timeout=self.timeoutSeconds) as connection:
+            reader = connection.makefile('rb')
+            batch = []
+            for itemId, embedding in embeddings:
+                batch.append(self.setCommand(itemId, embedding))
+                if len(batch) >= self.batchSize:
+                    written += self.flush(connection, reader, batch)
+                    batch = []
+            if batch:
+                written += self.flush(connection, reader, batch)
+            reader.close()
+        return written
+
+    def flush(self, connection, reader, batch):
+        connection.sendall(b''.join(batch))
+        for _ in batch:
+            self.readReply(reader)
+        return len(batch)
@@ -0,0 +1,132 @@
+import numpy as np
+
+
+def buildAliasTable(probs):
+    """
+    Vose's alias method, sampling from the returned table costs one uniform index and one coin flip
+    return: (acceptProb, alias), draw column k, keep k with acceptProb[k] otherwise take alias[k]
+    """
+    n = len(probs)
+    scaled = np.asarray(probs, dtype=np.float64) * n / np.sum(probs)
+    acceptProb = np.ones(n, dtype=np.float64)
+    alias = np.arange(n, dtype=np.int32)
+    small = [i for i in range(n) if scaled[i] < 1.0]
+    large = [i for i in range(n) if scaled[i] >= 1.0]
+    while small and large:
+        s = small.pop()
+        l = large.pop()
+        acceptProb[s] = scaled[s]
+        alias[s] = l
+        scaled[l] = scaled[l] + scaled[s] - 1.0
+        if scaled[l] < 1.0:
+            small.append(l)
+        else:
+            large.append(l)
+    # whatever is left only differs from 1 by rounding error
+    return acceptProb, alias
+
+
+def buildCSRAliasTables(indptr, probs):
+    """
+    one alias table per CSR row, alias entries are offsets inside the row
+    """
+    acceptProb = np.ones(len(probs), dtype=np.float64)
+    alias = np.zeros(len(probs), dtype=np.int32)
+    for row in range(len(indptr) - 1):
+        start, end = indptr[row], indptr[row + 1]
+        if end - start > 1:
+            acceptProb[start:end], alias[start:end] = buildAliasTable(probs[start:end])
+    return acceptProb, alias
+
+
+class AliasWalker:
+    """
+    first order random walk over a TransitionGraph (CSR arrays), O(1) per step
+    all walkers advance in lockstep, one vectorized numpy step per position of the walk
+    """
+
+    def __init__(self, graph):
+        self.itemIds = graph.itemIds
+        self.indptr = graph.indptr
+        self.indices = graph.indices
+        self.degrees = np.diff(graph.indptr)
+        self.acceptProb, self.alias = buildCSRAliasTables(graph.indptr, graph.probs)
+        self.startAcceptProb, self.startAlias = buildAliasTable(graph.itemProbs)
+
+    def sampleStart(self, numWalks, rng):
+        column = rng.integers(0, len(self.startAlias), size=numWalks)
+        keep = rng.random(numWalks) < self.startAcceptProb[column]
+        return np.where(keep, column, self.startAlias[column])
+
+    def sampleNext(self, current, rng):
+        # caller guarantees every current node has at least one out edge
+        start = self.indptr[current]
+        position = start + (rng.random(len(current)) * self.degrees[current]).astype(np.int64)
+        keep = rng.random(len(current)) < self.acceptProb[position]
+        return self.indices[np.where(keep, position, start + self.alias[position])]
+
+    def walk(self, numWalks, walkLength, rng):
+        """
+        return an int32 matrix of node indices, shape (numWalks, walkLength)
+        a walk that reaches a node without out edges stops there, the rest of its row is -1
+        """
+        walks = np.full((numWalks, walkLength), -1, dtype=np.int32)
+        walks[:, 0] = self.sampleStart(numWalks, rng)
+        alive = np.arange(numWalks)
+        for step in range(1, walkLength):
+            current = walks[alive, step - 1]
+            hasNext = self.degrees[current] > 0
+            alive, current = alive[hasNext], current[hasNext]
+            if len(alive) == 0:
+                break
+            walks[alive, step] = self.sampleStep(walks, alive, step, current, rng)
+        return walks
+
+    def sampleStep(self, walks, alive, step, current, rng):
+        return self.sampleNext(current, rng)
+
+    def toSequences(self, walks):
+        # map node indices back to movie ids, dropping the -1 padding
+        return [self.itemIds[row[row >= 0]].tolist() for row in walks]
+
+    def walkItems(self, numWalks, walkLength, rng):
+        return self.toSequences(self.walk(numWalks, walkLength, rng))
+
+
+class Node2VecWalker(AliasWalker):
+    """
+    node2vec second order walk with return parameter p and in-out parameter q
+    instead of O(edges * degree) second order alias tables, candidates are drawn from the first order alias
+    tables and accepted with probability bias / maxBias, edge lookups use one sorted array of edge keys,
+    so memory stays O(edges)
+    """
+
+    def __init__(self, graph, p=1.0, q=1.0):
+        super().__init__(graph)
+        self.p = p
+        self.q = q
+        self.maxBias = max(1.0 / p, 1.0, 1.0 / q)
+        nodeCount = len(self.degrees)
+        self.edgeKeys = np.sort(np.repeat(np.arange(nodeCount, dtype=np.int64), self.degrees) * nodeCount
+                                + self.indices)
+
+    def isEdge(self, src, dst):
+        keys = src.astype(np.int64) * len(self.degrees) + dst
+        position = np.minimum(np.searchsorted(self.edgeKeys, keys), len(self.edgeKeys) - 1)
+        return self.edgeKeys[position] == keys
+
+    def sampleStep(self, walks, alive, step, current, rng):
+        if step == 1:
+            return self.sampleNext(current, rng)
+        previous = walks[alive, step - 2]
+        nextNodes = np.empty(len(current), dtype=np.int32)
+        pending = np.arange(len(current))
+        while len(pending):
+            candidate = self.sampleNext(current[pending], rng)
+            # 1/p to go back, 1 to stay at distance one from the previous node, 1/q to move outward
+            bias = np.where(candidate == previous[pending], 1.0 / self.p,
+                            np.where(self.isEdge(previous[pending], candidate), 1.0, 1.0 / self.q))
+            accepted = rng.random(len(pending)) * self.maxBias < bias
+            nextNodes[pending[accepted]] = candidate[accepted]
+            pending = pending[~accepted]
+        return nextNodes
@@ -0,0 +1,273 @@
+import sys
+import time
+from collections import deque
+import numpy as np
+from pyspark import SparkConf
+from pyspark.sql import SparkSession
+from pyspark.sql import functions as F
+from pyspark.sql.types import ArrayType, IntegerType, StringType
+import FeatureEngForRecModel
+from FeatureEngForRecModel import addSampleLabel, addMovieFeatures, addUserFeatures, addUserFeaturesSinglePass, \
+    extractReleaseYearUdf, extractGenres
+from SampleOutput import saveSamples, loadTFRecordDataset
+from FeatureEngineering import multiHotEncodeWithUdf, multiHotEncoder, movieRatingStats, fitRatingFeaturePipeline, \
+    exportFeatureArtifacts
+from FeatureReplay import FeaturePipelineReplay
+from UserHistoryFeatures import RunningStats, windowStats, formatNumber, HISTORY_LENGTH
+
+nativeReleaseYearCol = FeatureEngForRecModel.releaseYearCol
+nativeGenresByCountCol = FeatureEngForRecModel.genresByCountCol
+
+
+def useUdfFeatures(enabled):
+    # swap the native column builders for the previous python udfs, the baseline of the comparison
+    if enabled:
+        FeatureEngForRecModel.releaseYearCol = lambda titleCol: F.udf(extractReleaseYearUdf, IntegerType())(titleCol)
+        FeatureEngForRecModel.genresByCountCol = \
+            lambda genresListCol: F.udf(extractGenres, ArrayType(StringType()))(F.col(genresListCol))
+    else:
+        FeatureEngForRecModel.releaseYearCol = nativeReleaseYearCol
+        FeatureEngForRecModel.genresByCountCol = nativeGenresByCountCol
+
+
+def generateSamples(movieSamples, ratingSamples, outputPath):
+    samplesWithMovieFeatures = addMovieFeatures(movieSamples, addSampleLabel(ratingSamples, debug=False), debug=False)
+    addUserFeatures(samplesWithMovieFeatures, debug=False).write.mode('overwrite').parquet(outputPath)
+
+
+def compareOutputs(spark, baselinePath, candidatePath, baselineName, candidateName, excludedUsers=None,
+                   toleranceColumns=(), tolerance=0.0, keys=('userId', 'timestamp')):
+    """
+    asserts both outputs hold the same rows, toleranceColumns are format_number strings compared by value
+    within tolerance on the rows matched by keys, every other column has to be equal
+    """
+    baseline = spark.read.parquet(baselinePath)
+    candidate = spark.read.parquet(candidatePath).select(baseline.columns)
+    if excludedUsers is not None:
+        baseline = baseline.join(excludedUsers, on='userId', how='left_anti')
+        candidate = candidate.join(excludedUsers, on='userId', how='left_anti')
+    if toleranceColumns:
+        number = lambda column: F.regexp_replace(column, ',', '').cast('double')
+        joined = baseline.alias('b').join(candidate.alias('c'), on=list(keys))
+        for name in toleranceColumns:
+            expected, actual = F.col('b.' + name), F.col('c.' + name)
+            outside = joined.where((expected.isNull() != actual.isNull()) |
+                                   (F.abs(number(expected) - number(actual)) > tolerance + 1e-9)).count()
+            print("{} values differing by more than {}: {}".format(name, tolerance, outside))
+            assert outside == 0, "{} {} differs from {}".format(candidateName, name, baselineName)
+        exactColumns = [name for name in baseline.columns if name not in toleranceColumns]
+        baseline, candidate = baseline.select(exactColumns), candidate.select(exactColumns)
+    onlyBaseline = baseline.exceptAll(candidate).count()
+    onlyCandidate = candidate.exceptAll(baseline).count()
+    print("rows only in {} output: {}, rows only in {} output: {}".format(baselineName, onlyBaseline,
+                                                                          candidateName, onlyCandidate))
+    assert onlyBaseline == 0 and onlyCandidate == 0, "{} features differ from {}".format(candidateName, baselineName)
+
+
+def benchmarkSampleGeneration(spark, movieSamples, ratingSamples, outputPath):
+    """
+    end to end sample generation time with python udfs and with native expressions,
+    then a regression check that both produce exactly the same rows
+    """
+    costs = {}
+    for name, udfEnabled in [('python udf', True), ('native', False)]:
+        useUdfFeatures(udfEnabled)
+        start = time.time()
+        generateSamples(movieSamples, ratingSamples, outputPath + '/' + name.replace(' ', '_'))
+        costs[name] = time.time() - start
+    useUdfFeatures(False)
+    for name, cost in costs.items():
+        print("{:<12s} {:8.2f}s  speedup x{:.2f}".format(name, cost, costs['python udf'] / cost))
+    compareOutputs(spark, outputPath + '/python_udf', outputPath + '/native', 'python udf', 'native')
+
+
+def benchmarkUserFeatures(spark, movieSamples, ratingSamples, outputPath, heavyUserThreshold=1000):
+    """
+    native window expressions (addUserFeatures, the default of the feature jobs) against the O(1) per row python
+    pass (addUserFeaturesSinglePass) the incremental job resumes from saved state, spark evaluates the window
+    expressions of one partitionBy / orderBy spec in a single Window operator already
+    the running stddevs may differ by 0.01 at rounding boundaries, see UserHistoryFeatures.RunningStats
+    """
+    samplesWithMovieFeatures = addMovieFeatures(movieSamples, addSampleLabel(ratingSamples, debug=False),
+                                                debug=False).cache()
+    heavyUsers = ratingSamples.groupBy('userId').count().where(F.col('count') >= heavyUserThreshold).count()
+    print("users with at least {} ratings: {}".format(heavyUserThreshold, heavyUsers))
+    costs = {}
+    for name, addFeatures in [('window', lambda samples: addUserFeatures(samples, debug=False)),
+                              ('single pass', addUserFeaturesSinglePass)]:
+        start = time.time()
+        addFeatures(samplesWithMovieFeatures).write.mode('overwrite').parquet(
+            outputPath + '/' + name.replace(' ', '_'))
+        costs[name] = time.time() - start
+    for name, cost in costs.items():
+        print("{:<12s} {:8.2f}s  speedup x{:.2f}".format(name, cost, costs['window'] / cost))
+    # rows with equal (userId, timestamp) have no defined order in either version, the histories of users
+    # with such ties may legitimately differ, so they are left out of the comparison
+    tiedUsers = ratingSamples.groupBy('userId', 'timestamp').count().where(F.col('count') > 1) \
+        .select('userId').distinct()
+    print("users with tied timestamps left out of the comparison: {}".format(tiedUsers.count()))
+    compareOutputs(spark, outputPath + '/window', outputPath + '/single_pass', 'window', 'single pass', tiedUsers,
+                   toleranceColumns=('userReleaseYearStddev', 'userRatingStddev'), tolerance=0.01)
+    samplesWithMovieFeatures.unpersist()
+
+
+def checkRunningStats(rows=200000, seed=2020):
+    """
+    the O(1) add / remove RunningStats of UserHistoryState against windowStats recomputed over every
+    HISTORY_LENGTH window of random ratings and release years with nulls: count and sum exact, the stddev within
+    1e-9, and how many format_number(stddev, 2) values land on the other side of a rounding boundary
+    """
+    rng = np.random.RandomState(seed)
+    for name, values in [('rating', rng.randint(1, 11, rows) / 2.0), ('releaseYear', rng.randint(1900, 2020, rows))]:
+        values = [None if missing else float(value) for value, missing in zip(values, rng.rand(rows) < 0.05)]
+        running, window = RunningStats(), deque()
+        maxError, formatDiffs = 0.0, 0
+        for value in values:
+            count, valueSum, stddev = windowStats(window)
+            assert (count, valueSum) == (running.count, running.sum), name + " count or sum differs"
+            if stddev is not None:
+                maxError = max(maxError, abs(stddev - running.stddev()))
+                formatDiffs += formatNumber(stddev) != formatNumber(running.stddev())
+            window.append(value)
+            running.add(value)
+            if len(window) > HISTORY_LENGTH:
+                running.remove(window.popleft())
+        print("{:<12s} max stddev error {:.2e}, formatted values off by 0.01: {} of {}".format(
+            name, maxError, formatDiffs, rows))
+        assert maxError < 1e-9, name + " running stddev drifted"
+
+
+def tfRowsPerSecond(dataset):
+    start = time.time()
+    rows = 0
+    for _, labels in dataset:
+        rows += int(labels.shape[0])
+    return rows, rows / (time.time() - start)
+
+
+def benchmarkSampleOutput(spark, samples, outputPath, batchSize=512):
+    """
+    write time of the single file csv against parallel parquet and tfrecord outputs,
+    then read throughput of each through spark and, for csv and tfrecord, through tf.data
+    """
+    import tensorflow as tf
+    samples = samples.cache()
+    print("samples: {}, partitions: {}".format(samples.count(), samples.rdd.getNumPartitions()))
+    for outputFormat in ['csv', 'parquet', 'tfrecord']:
+        start = time.time()
+        saveSamples(samples, outputPath + '/' + outputFormat, outputFormat)
+        print("write {:<10s} {:8.2f}s".format(outputFormat, time.time() - start))
+    for outputFormat in ['csv', 'parquet']:
+        start = time.time()
+        reader = spark.read.option('header', 'true').option('inferSchema', 'true') if outputFormat == 'csv' \
+            else spark.read
+        reader.format(outputFormat).load(outputPath + '/' + outputFormat).agg(F.avg('rating')).collect()
+        print("spark read {:<10s} {:8.2f}s".format(outputFormat, time.time() - start))
+    localPath = (outputPath + '/').replace('file://', '')
+    csvDataset = tf.data.experimental.make_csv_dataset(tf.io.gfile.glob(localPath + 'csv/part-*.csv'),
+                                                       batch_size=batchSize, label_name='label', na_value="0",
+                                                       num_epochs=1, ignore_errors=True)
+    tfrecordDataset = loadTFRecordDataset(tf, localPath + 'tfrecord', batchSize)
+    for name, dataset in [('csv', csvDataset), ('tfrecord', tfrecordDataset)]:
+        rows, throughput = tfRowsPerSecond(dataset)
+        print("tf.data read {:<10s} {:10d} rows {:12.0f} rows/s".format(name, rows, throughput))
+    samples.unpersist()
+
+
+def decodeMultiHot(rows, vocabulary):
+    return {row[0]: sorted(vocabulary[int(i)] for i in row[1].indices) for row in rows}
+
+
+def benchmarkMultiHotEncoder(spark, movieSamples, outputPath, repeat=3):
+    """
+    explode + StringIndexer + collect_list + array2vec udf against the multiHotEncoder pipeline,
+    both encode every movie's genres, then the decoded genre sets of both are compared movie by movie
+    """
+    movieSamples = movieSamples.cache()
+    movieSamples.count()
+    costs = {}
+    for name in ['python udf', 'native']:
+        start = time.time()
+        for _ in range(repeat):
+            if name == 'python udf':
+                encoded, vocabulary = multiHotEncodeWithUdf(movieSamples)
+            else:
+                encoderModel = multiHotEncoder('genres', 'vector').fit(movieSamples)
+                encoded, vocabulary = encoderModel.transform(movieSamples), encoderModel.stages[-1].vocabulary
+            encoded.select('movieId', 'vector').write.mode('overwrite').parquet(
+                outputPath + '/' + name.replace(' ', '_'))
+        costs[name] = (time.time() - start) / repeat
+    for name, cost in costs.items():
+        print("{:<12s} {:8.2f}s  speedup x{:.2f}".format(name, cost, costs['python udf'] / cost))
+    udfEncoded, udfVocabulary = multiHotEncodeWithUdf(movieSamples)
+    udfGenres = decodeMultiHot(udfEncoded.select('movieId', 'vector').collect(), udfVocabulary)
+    encoderModel = multiHotEncoder('genres', 'vector').fit(movieSamples)
+    nativeGenres = decodeMultiHot(encoderModel.transform(movieSamples).select('movieId', 'vector').collect(),
+                                  encoderModel.stages[-1].vocabulary)
+    assert udfGenres == nativeGenres, "multi-hot genres differ between the udf and the native encoder"
+    print("multi-hot genres of {} movies match".format(len(nativeGenres)))
+    movieSamples.unpersist()
+
+
+def replayMicroseconds(replay, batch, batchSize, repeat=100):
+    rows = len(next(iter(batch.values())))
+    batches = [{name: values[start:start + batchSize] for name, values in batch.items()}
+               for start in range(0, rows, batchSize)]
+    start = time.time()
+    for _ in range(repeat):
+        for part in batches:
+            replay.transform(part)
+    return (time.time() - start) * 1e6 / (repeat * len(batches))
+
+
+def checkFeatureReplayParity(spark, movieSamples, ratingSamples, artifactDir, batchSize=256):
+    """
+    export the rating feature pipeline and the genre multi-hot encoder, replay both with FeatureReplay on the
+    same inputs and check the numpy output against the spark output row by row, then time the replay per batch
+    artifactDir: local directory
+    """
+    movieFeatures = movieRatingStats(ratingSamples).cache()
+    ratingModel = fitRatingFeaturePipeline(movieFeatures)
+    exportFeatureArtifacts(ratingModel, artifactDir + '/ratingFeaturePipeline.json')
+    rows = ratingModel.transform(movieFeatures) \
+        .select('ratingCount', 'avgRatingVec', 'ratingCountBucket', 'scaleAvgRating').collect()
+    ratingBatch = {'ratingCount': np.array([row[0] for row in rows], dtype=np.float64),
+                   'avgRatingVec': np.array([row[1].toArray() for row in rows])}
+    ratingReplay = FeaturePipelineReplay.load(artifactDir + '/ratingFeaturePipeline.json')
+    replayed = ratingReplay.transform(ratingBatch)
+    assert np.array_equal(replayed['ratingCountBucket'], np.array([row[2] for row in rows])), \
+        "ratingCountBucket differs from spark"
+    assert np.allclose(replayed['scaleAvgRating'], np.array([row[3].toArray() for row in rows]), atol=1e-12), \
+        "scaleAvgRating differs from spark"
+    print("rating features of {} movies match spark, {:.1f}us per batch of {}".format(
+        len(rows), replayMicroseconds(ratingReplay, ratingBatch, batchSize), batchSize))
+
+    encoderModel = multiHotEncoder('genres', 'genreVector').fit(movieSamples)
+    exportFeatureArtifacts(encoderModel, artifactDir + '/genreMultiHotEncoder.json')
+    rows = encoderModel.transform(movieSamples).select('genres', 'genreVector').collect()
+    genreBatch = {'genres': [row[0] for row in rows]}
+    genreReplay = FeaturePipelineReplay.load(artifactDir + '/genreMultiHotEncoder.json')
+    assert np.array_equal(genreReplay.transform(genreBatch)['genreVector'],
+                          np.array([row[1].toArray() for row in rows])), "genre multi-hot differs from spark"
+    print("genre multi-hot of {} movies matches spark, {:.1f}us per batch of {}".format(
+        len(rows), replayMicroseconds(genreReplay, genreBatch, batchSize), batchSize))
+    movieFeatures.unpersist()
+
+
+if __name__ == '__main__':
+    conf = SparkConf().setAppName('featureEngBenchmark').setMaster('local[*]')
+    spark = SparkSession.builder.config(conf=conf).getOrCreate()
+    file_path = sys.argv[1] if len(sys.argv) > 1 else 'file:///home/hadoop/SparrowRecSys/src/main/resources'
+    movieResourcesPath = file_path + "/webroot/sampledata/movies.csv"
+    ratingsResourcesPath = file_path + "/webroot/sampledata/ratings.csv"
+    movieSamples = spark.read.format('csv').option('header', 'true').load(movieResourcesPath)
+    ratingSamples = spark.read.format('csv').option('header', 'true').load(ratingsResourcesPath)
+    benchmarkMultiHotEncoder(spark, movieSamples, file_path + "/webroot/sampledata/benchmark/multiHot")
+    checkFeatureReplayParity(spark, movieSamples, ratingSamples,
+                             file_path[7:] + "/webroot/sampledata/benchmark/featureArtifacts")
+    benchmarkSampleGeneration(spark, movieSamples, ratingSamples, file_path + "/webroot/sampledata/benchmark")
+    checkRunningStats()
+    benchmarkUserFeatures(spark, movieSamples, ratingSamples, file_path + "/webroot/sampledata/benchmark")
+    benchmarkSampleOutput(spark, spark.read.parquet(file_path + "/webroot/sampledata/benchmark/window"),
+                          file_path + "/webroot/sampledata/benchmark/output")
+    spark.stop()
@@ -1,20 +1,27 @@
-from pyspark import SparkContext, SparkConf
+import sys
+from pyspark import SparkContext, SparkConf, StorageLevel
 from pyspark.sql import SparkSession
 import pyspark.sql as sql
 from pyspark.sql.functions import *
 from pyspark.sql.types import *
 from collections import defaultdict
 from pyspark.sql import functions as F
+import UserHistoryFeatures
+from UserHistoryFeatures import USER_FEATURE_NAMES, userHistoryPartition
+from SampleOutput import saveSamples, saveSamplesAsTFRecord, sampleOutputPath, typedSamples
+from StageTimer import StageTimer
 
 NUMBER_PRECISION = 2
 
 
-def addSampleLabel(ratingSamples):
-    ratingSamples.show(5, truncate=False)
-    ratingSamples.printSchema()
-    sampleCount = ratingSamples.count()
-    ratingSamples.groupBy('rating').count().orderBy('rating').withColumn('percentage',
-                                                                         F.col('count') / sampleCount).show()
+def addSampleLabel(ratingSamples, debug=True):
+    # debug prints the samples and the rating distribution, every one of these actions rescans the ratings
+    if debug:
+        ratingSamples.show(5, truncate=False)
+        ratingSamples.printSchema()
+        sampleCount = ratingSamples.count()
+        ratingSamples.groupBy('rating').count().orderBy('rating').withColumn('percentage',
+                                                                             F.col('count') / sampleCount).show()
     ratingSamples = ratingSamples.withColumn('label', when(F.col('rating') >= 3.5, 1).otherwise(0))
     return ratingSamples
 
@@ -28,30 +35,78 @@ def extractReleaseYearUdf(title):
     return int(yearStr)
 
 
-def addMovieFeatures(movieSamples, ratingSamplesWithLabel):
-    # add movie basic features
-    samplesWithMovies1 = ratingSamplesWithLabel.join(movieSamples, on=['movieId'], how='left')
-    # add releaseYear,title
-    samplesWithMovies2 = samplesWithMovies1.withColumn('releaseYear',
-                                                       udf(extractReleaseYearUdf, IntegerType())('title')) \
-        .withColumn('title', udf(lambda x: x.strip()[:-6].strip(), StringType())('title')) \
+def releaseYearCol(titleCol):
+    # native version of extractReleaseYearUdf: "Toy Story (1995)" -> 1995, 1990 for missing or too short titles
+    trimmedTitle = F.trim(titleCol)
+    return when(trimmedTitle.isNull() | (F.length(trimmedTitle) < 6), F.lit(1990)) \
+        .otherwise(F.substring(trimmedTitle, -5, 4).cast(IntegerType()))
+
+
+def withMovieBasicColumns(samplesWithMovies1):
+    # add releaseYear
+    samplesWithMovies2 = samplesWithMovies1.withColumn('releaseYear', releaseYearCol(F.col('title'))) \
         .drop('title')
     # split genres
-    samplesWithMovies3 = samplesWithMovies2.withColumn('movieGenre1', split(F.col('genres'), "\\|")[0]) \
+    return samplesWithMovies2.withColumn('movieGenre1', split(F.col('genres'), "\\|")[0]) \
         .withColumn('movieGenre2', split(F.col('genres'), "\\|")[1]) \
         .withColumn('movieGenre3', split(F.col('genres'), "\\|")[2])
-    # add rating features
-    movieRatingFeatures = samplesWithMovies3.groupBy('movieId').agg(F.count(F.lit(1)).alias('movieRatingCount'),
-                                                                    format_number(F.avg(F.col('rating')),
-                                                                                  NUMBER_PRECISION).alias(
-                                                                        'movieAvgRating'),
-                                                                    F.stddev(F.col('rating')).alias(
-                                                                        'movieRatingStddev')).fillna(0) \
+
+
+def addMovieBasicFeatures(movieSamples, ratingSamplesWithLabel):
+    # add movie basic features, the movie table is small enough to be broadcast instead of shuffling the ratings
+    return withMovieBasicColumns(ratingSamplesWithLabel.join(F.broadcast(movieSamples), on=['movieId'], how='left'))
+
+
+def movieRatingFeatureTable(ratingSamples):
+    """
+    movieRatingCount, movieAvgRating and movieRatingStddev of every rated movie, aggregated from the narrow
+    (movieId, rating) columns of the ratings instead of the widened samples
+    """
+    return ratingSamples.select('movieId', 'rating').groupBy('movieId') \
+        .agg(F.count(F.lit(1)).alias('movieRatingCount'),
+             format_number(F.avg(F.col('rating')), NUMBER_PRECISION).alias('movieAvgRating'),
+             F.stddev(F.col('rating')).alias('movieRatingStddev')).fillna(0) \
         .withColumn('movieRatingStddev', format_number(F.col('movieRatingStddev'), NUMBER_PRECISION))
+
+
+def movieFeatureTable(movieSamples, ratingSamples):
+    """
+    one row per movie with every movie feature of the samples, computed once and saved by saveMovieFeatureTable
+    so the tf models and the online service read it instead of recomputing it, movies without ratings keep
+    null rating features
+    """
+    return withMovieBasicColumns(movieSamples).join(movieRatingFeatureTable(ratingSamples), on=['movieId'],
+                                                    how='left')
+
+
+def saveMovieFeatureTable(movieFeatures, file_path, outputFormats=('csv', 'parquet')):
+    for outputFormat in outputFormats:
+        savePath = sampleOutputPath(file_path, 'movieFeatures', outputFormat)
+        if outputFormat == 'csv':
+            movieFeatures.repartition(1).write.option("header", "true").mode('overwrite').csv(savePath)
+        else:
+            movieFeatures.write.mode('overwrite').format(outputFormat).save(savePath)
+
+
+def loadMovieFeatureTable(spark, file_path):
+    return spark.read.parquet(sampleOutputPath(file_path, 'movieFeatures', 'parquet'))
+
+
+def addMovieFeatures(movieSamples, ratingSamplesWithLabel, debug=True, movieFeatures=None):
+    """
+    movieFeatures: a precomputed movieFeatureTable / movieRatingFeatureTable, by default the rating features
+    are aggregated from ratingSamplesWithLabel, either way they are attached through a broadcast join
+    """
+    samplesWithMovies3 = addMovieBasicFeatures(movieSamples, ratingSamplesWithLabel)
+    # add rating features
+    if movieFeatures is None:
+        movieFeatures = movieRatingFeatureTable(ratingSamplesWithLabel)
+    movieRatingFeatures = movieFeatures.select('movieId', 'movieRatingCount', 'movieAvgRating', 'movieRatingStddev')
     # join movie rating features
-    samplesWithMovies4 = samplesWithMovies3.join(movieRatingFeatures, on=['movieId'], how='left')
-    samplesWithMovies4.printSchema()
-    samplesWithMovies4.show(5, truncate=False)
+    samplesWithMovies4 = samplesWithMovies3.join(F.broadcast(movieRatingFeatures), on=['movieId'], how='left')
+    if debug:
+        samplesWithMovies4.printSchema()
+        samplesWithMovies4.show(5, truncate=False)
     return samplesWithMovies4
 
 
@@ -71,8 +126,18 @@ def extractGenres(genres_list):
     return [x[0] for x in sortedGenres]
 
 
-def addUserFeatures(samplesWithMovieFeatures):
-    extractGenresUdf = udf(extractGenres, ArrayType(StringType()))
+def genresByCountCol(genresListCol):
+    """
+    native version of extractGenres over a list column of "A|B|C" genre strings
+    genres are ordered by count desc, ties keep the order of first appearance like the stable python sort
+    """
+    allGenres = "flatten(transform({}, g -> split(g, '[|]')))".format(genresListCol)
+    return F.expr("transform(sort_array(transform(array_distinct({0}), (genre, i) -> named_struct("
+                  "'negCount', -size(filter({0}, x -> x = genre)), 'firstIndex', i, 'genre', genre))), "
+                  "s -> s.genre)".format(allGenres))
+
+
+def addUserFeatures(samplesWithMovieFeatures, debug=True):
     samplesWithUserFeatures = samplesWithMovieFeatures \
         .withColumn('userPositiveHistory',
                     F.collect_list(when(F.col('label') == 1, F.col('movieId')).otherwise(F.lit(None))).over(
@@ -94,9 +159,10 @@ def addUserFeatures(samplesWithMovieFeatures):
         NUMBER_PRECISION)) \
         .withColumn("userRatingStddev", F.stddev(F.col("rating")).over(
         sql.Window.partitionBy('userId').orderBy('timestamp').rowsBetween(-100, -1))) \
-        .withColumn("userGenres", extractGenresUdf(
-        F.collect_list(when(F.col('label') == 1, F.col('genres')).otherwise(F.lit(None))).over(
-            sql.Window.partitionBy('userId').orderBy('timestamp').rowsBetween(-100, -1)))) \
+        .withColumn("userGenreHistory",
+                    F.collect_list(when(F.col('label') == 1, F.col('genres')).otherwise(F.lit(None))).over(
+                        sql.Window.partitionBy('userId').orderBy('timestamp').rowsBetween(-100, -1))) \
+        .withColumn("userGenres", genresByCountCol("userGenreHistory")) \
         .withColumn("userRatingStddev", format_number(F.col("userRatingStddev"), NUMBER_PRECISION)) \
         .withColumn("userReleaseYearStddev", format_number(F.col("userReleaseYearStddev"), NUMBER_PRECISION)) \
         .withColumn("userGenre1", F.col("userGenres")[0]) \
@@ -104,52 +170,215 @@ def addUserFeatures(samplesWithMovieFeatures):
         .withColumn("userGenre3", F.col("userGenres")[2]) \
         .withColumn("userGenre4", F.col("userGenres")[3]) \
         .withColumn("userGenre5", F.col("userGenres")[4]) \
-        .drop("genres", "userGenres", "userPositiveHistory") \
+        .drop("genres", "userGenres", "userGenreHistory", "userPositiveHistory") \
         .filter(F.col("userRatingCount") > 1)
-    samplesWithUserFeatures.printSchema()
-    samplesWithUserFeatures.show(10)
-    samplesWithUserFeatures.filter(samplesWithMovieFeatures['userId'] == 1).orderBy(F.col('timestamp').asc()).show(
-        truncate=False)
+    if debug:
+        samplesWithUserFeatures.printSchema()
+        samplesWithUserFeatures.show(10)
+        samplesWithUserFeatures.filter(samplesWithMovieFeatures['userId'] == 1).orderBy(F.col('timestamp').asc()) \
+            .show(truncate=False)
     return samplesWithUserFeatures
 
 
-def splitAndSaveTrainingTestSamples(samplesWithUserFeatures, file_path):
+def withUserFeatureFields(schema):
+    # schema of the rows produced by UserHistoryFeatures, the input fields followed by USER_FEATURE_NAMES
+    featureTypes = {'userRatingCount': LongType(), 'userAvgReleaseYear': IntegerType()}
+    return StructType(schema.fields +
+                      [StructField(name, featureTypes.get(name, StringType()), True) for name in USER_FEATURE_NAMES])
+
+
+def addUserFeaturesSinglePass(samplesWithMovieFeatures, numPartitions=None):
+    """
+    same features as addUserFeatures in one python pass over the samples sorted by (userId, timestamp), every row
+    costs O(1) through the running window of UserHistoryFeatures.UserHistoryState however many ratings the user
+    has, the stddevs may differ from the window version by 0.01 at rounding boundaries
+    the engine IncrementalFeatureEngForRecModel resumes from saved user state, see
+    FeatureEngBenchmark.benchmarkUserFeatures for its speed against the native window expressions
+    """
+    spark = samplesWithMovieFeatures.sql_ctx.sparkSession
+    spark.sparkContext.addPyFile(UserHistoryFeatures.__file__)
+    schema = withUserFeatureFields(samplesWithMovieFeatures.schema)
+    partitionedSamples = samplesWithMovieFeatures.repartition(numPartitions, 'userId') if numPartitions \
+        else samplesWithMovieFeatures.repartition('userId')
+    orderedSamples = partitionedSamples.sortWithinPartitions('userId', 'timestamp')
+    return spark.createDataFrame(orderedSamples.rdd.mapPartitions(userHistoryPartition), schema) \
+        .drop('genres') \
+        .filter(F.col('userRatingCount') > 1)
+
+
+def saveTrainingTestSamples(training, test, file_path, outputFormats):
+    # split samples are reused by every format, so they are only computed once when several are written
+    if len(outputFormats) > 1:
+        training, test = training.persist(StorageLevel.MEMORY_AND_DISK), test.persist(StorageLevel.MEMORY_AND_DISK)
+    for outputFormat in outputFormats:
+        saveSamples(training, sampleOutputPath(file_path, 'trainingSamples', outputFormat), outputFormat)
+        saveSamples(test, sampleOutputPath(file_path, 'testSamples', outputFormat), outputFormat)
+    training.unpersist()
+    test.unpersist()
+
+
+def splitAndSaveTrainingTestSamples(samplesWithUserFeatures, file_path, outputFormats=('csv',)):
+    """
+    outputFormats: any of 'csv' (single file), 'parquet' (typed, partitioned) and 'tfrecord' (one shard per
+    partition), see SampleOutput
+    """
     smallSamples = samplesWithUserFeatures.sample(0.1)
     training, test = smallSamples.randomSplit((0.8, 0.2))
-    trainingSavePath = file_path + '/trainingSamples'
-    testSavePath = file_path + '/testSamples'
-    training.repartition(1).write.option("header", "true").mode('overwrite') \
-        .csv(trainingSavePath)
-    test.repartition(1).write.option("header", "true").mode('overwrite') \
-        .csv(testSavePath)
+    saveTrainingTestSamples(training, test, file_path, outputFormats)
 
 
-def splitAndSaveTrainingTestSamplesByTimeStamp(samplesWithUserFeatures, file_path):
+def splitAndSaveTrainingTestSamplesByTimeStamp(samplesWithUserFeatures, file_path, outputFormats=('csv',)):
     smallSamples = samplesWithUserFeatures.sample(0.1).withColumn("timestampLong", F.col("timestamp").cast(LongType()))
     quantile = smallSamples.stat.approxQuantile("timestampLong", [0.8], 0.05)
     splitTimestamp = quantile[0]
     training = smallSamples.where(F.col("timestampLong") <= splitTimestamp).drop("timestampLong")
     test = smallSamples.where(F.col("timestampLong") > splitTimestamp).drop("timestampLong")
-    trainingSavePath = file_path + '/trainingSamples'
-    testSavePath = file_path + '/testSamples'
-    training.repartition(1).write.option("header", "true").mode('overwrite') \
-        .csv(trainingSavePath)
-    test.repartition(1).write.option("header", "true").mode('overwrite') \
-        .csv(testSavePath)
+    saveTrainingTestSamples(training, test, file_path, outputFormats)
+
+
+def hashSampleCol(sampleRate, columns=('userId', 'movieId', 'timestamp'), buckets=10000):
+    # deterministic replacement of sample(), a sample is kept or dropped the same way on every run and every fold
+    return F.expr("pmod(hash({}), {})".format(', '.join(columns), buckets)) < int(sampleRate * buckets)
+
+
+def rollingWindowBounds(numWindows, trainFraction, testFraction):
+    """
+    quantile probabilities of k rolling windows, window i trains on (start, trainEnd] and tests on
+    (trainEnd, testEnd], the next window slides forward by testFraction
+    return: [(start, trainEnd, testEnd)] probabilities
+    """
+    if (numWindows - 1) * testFraction + trainFraction + testFraction > 1.0 + 1e-9:
+        raise ValueError("{} windows of {} train and {} test do not fit in the samples".format(
+            numWindows, trainFraction, testFraction))
+    return [(round(i * testFraction, 6), round(i * testFraction + trainFraction, 6),
+             round(i * testFraction + trainFraction + testFraction, 6)) for i in range(numWindows)]
+
+
+def splitAndSaveRollingWindowSamples(samplesWithUserFeatures, file_path, numWindows=3, trainFraction=0.7,
+                                     testFraction=0.1, sampleRate=0.1, outputFormat='parquet'):
+    """
+    backtesting folds: every sample is assigned to the train or test side of each of numWindows rolling time
+    windows in one pass, then all folds are written by one job partitioned by fold and split,
+    e.g. rollingWindowSamples/fold=1/split=test, instead of one full job per window
+    one approxQuantile call computes every window boundary
+    outputFormat: 'csv', 'parquet' or 'tfrecord', tfrecord folds are written through SampleOutput one
+                  fold=/split= directory at a time
+    """
+    if outputFormat not in ('csv', 'parquet', 'tfrecord'):
+        raise ValueError("unknown sample output format: " + outputFormat)
+    # the quantiles and the write both read the sampled rows, which are computed once
+    smallSamples = samplesWithUserFeatures.where(hashSampleCol(sampleRate)) \
+        .withColumn("timestampLong", F.col("timestamp").cast(LongType())) \
+        .persist(StorageLevel.MEMORY_AND_DISK)
+    bounds = rollingWindowBounds(numWindows, trainFraction, testFraction)
+    probabilities = sorted(set(p for window in bounds for p in window))
+    quantiles = dict(zip(probabilities, smallSamples.stat.approxQuantile("timestampLong", probabilities, 0.001)))
+    timestampCol = F.col("timestampLong")
+
+    def between(lowerProb, upperProb):
+        # the outermost windows stay open ended, approximate min and max quantiles may miss extreme samples
+        condition = F.lit(True)
+        if lowerProb > 0:
+            condition = condition & (timestampCol > quantiles[lowerProb])
+        if upperProb < 1:
+            condition = condition & (timestampCol <= quantiles[upperProb])
+        return condition
+
+    assignments = [when(between(start, trainEnd), F.struct(F.lit(fold).alias('fold'), F.lit('train').alias('split')))
+                   .when(between(trainEnd, testEnd), F.struct(F.lit(fold).alias('fold'), F.lit('test').alias('split')))
+                   for fold, (start, trainEnd, testEnd) in enumerate(bounds)]
+    foldSamples = smallSamples.withColumn('assignment', F.explode(F.array(*assignments))) \
+        .where(F.col('assignment').isNotNull()) \
+        .withColumn('fold', F.col('assignment.fold')) \
+        .withColumn('split', F.col('assignment.split')) \
+        .drop('assignment', 'timestampLong')
+    savePath = sampleOutputPath(file_path, 'rollingWindowSamples', outputFormat)
+    if outputFormat == 'tfrecord':
+        for fold in range(numWindows):
+            for split in ['train', 'test']:
+                saveSamplesAsTFRecord(foldSamples.where((F.col('fold') == fold) & (F.col('split') == split)),
+                                      '{}/fold={}/split={}'.format(savePath, fold, split))
+    else:
+        if outputFormat == 'parquet':
+            foldSamples = typedSamples(foldSamples, ['fold', 'split'])
+        foldSamples.write.partitionBy('fold', 'split').option("header", "true").mode('overwrite') \
+            .format(outputFormat).save(savePath)
+    smallSamples.unpersist()
+    return quantiles
+
+
+def materializeStage(df, storageLevel, checkpointDir=None):
+    """
+    compute df once and cut its lineage, later stages start from here instead of replaying every transformation
+    back to the ratings csv, with a checkpointDir through a reliable checkpoint retries can restart from, without one
+    through a local checkpoint on the executors
+    the result is kept at storageLevel and unpersisted by the caller once the next stage is materialized
+    """
+    cached = df.persist(storageLevel)
+    checkpointed = cached.checkpoint(eager=True) if checkpointDir else cached.localCheckpoint(eager=True)
+    cached.unpersist()
+    return checkpointed.persist(storageLevel)
+
+
+def generateSamplesForProduction(spark, movieSamples, ratingSamples, file_path, outputFormats=('csv',),
+                                 storageLevel=StorageLevel.MEMORY_AND_DISK, checkpointDir=None, numPartitions=None,
+                                 singlePassUserFeatures=False):
+    """
+    production run mode: no debug show/count actions, the movie and user feature stages are materialized and
+    checkpointed one after the other, and the time, jobs and tasks of every stage are reported at the end
+    checkpointDir: reliable checkpoints on a shared filesystem, None for local checkpoints on the executors, which
+    cut the lineage as well but are lost with an executor
+    singlePassUserFeatures: compute the user stage with addUserFeaturesSinglePass instead of the window expressions
+    """
+    sc = spark.sparkContext
+    if checkpointDir:
+        sc.setCheckpointDir(checkpointDir)
+    timer = StageTimer(sc)
+    # the movie feature table is computed once, saved for the models and the service, then broadcast from cache
+    movieFeatures = movieFeatureTable(movieSamples, ratingSamples).persist(storageLevel)
+    timer.run('movie feature table', lambda: saveMovieFeatureTable(movieFeatures, file_path))
+    samplesWithMovieFeatures = timer.run('movie features', lambda: materializeStage(
+        addMovieFeatures(movieSamples, addSampleLabel(ratingSamples, debug=False), debug=False,
+                         movieFeatures=movieFeatures),
+        storageLevel, checkpointDir))
+    movieFeatures.unpersist()
+    if singlePassUserFeatures:
+        userFeatures = lambda: addUserFeaturesSinglePass(samplesWithMovieFeatures, numPartitions)
+    else:
+        # the window operator reuses a userId partitioning, so numPartitions sets the partitions of the user stage
+        userPartitionedSamples = samplesWithMovieFeatures.repartition(numPartitions, 'userId') if numPartitions \
+            else samplesWithMovieFeatures
+        userFeatures = lambda: addUserFeatures(userPartitionedSamples, debug=False)
+    samplesWithUserFeatures = timer.run('user features', lambda: materializeStage(userFeatures(), storageLevel,
+                                                                                  checkpointDir))
+    samplesWithMovieFeatures.unpersist()
+    timer.run('save samples', lambda: splitAndSaveTrainingTestSamples(samplesWithUserFeatures, file_path,
+                                                                      outputFormats))
+    samplesWithUserFeatures.unpersist()
+    timer.report()
 
 
 if __name__ == '__main__':
-    conf = SparkConf().setAppName('featureEngineering').setMaster('local')
+    # usage: FeatureEngForRecModel.py [debug|production [checkpointDir]]
+    runMode = sys.argv[1] if len(sys.argv) > 1 else 'debug'
+    conf = SparkConf().setAppName('featureEngineering').setMaster('local' if runMode == 'debug' else 'local[*]')
     spark = SparkSession.builder.config(conf=conf).getOrCreate()
     file_path = 'file:///home/hadoop/SparrowRecSys/src/main/resources'
     movieResourcesPath = file_path + "/webroot/sampledata/movies.csv"
     ratingsResourcesPath = file_path + "/webroot/sampledata/ratings.csv"
     movieSamples = spark.read.format('csv').option('header', 'true').load(movieResourcesPath)
     ratingSamples = spark.read.format('csv').option('header', 'true').load(ratingsResourcesPath)
-    ratingSamplesWithLabel = addSampleLabel(ratingSamples)
-    ratingSamplesWithLabel.show(10, truncate=False)
-    samplesWithMovieFeatures = addMovieFeatures(movieSamples, ratingSamplesWithLabel)
-    samplesWithUserFeatures = addUserFeatures(samplesWithMovieFeatures)
-    # save samples as csv format
-    splitAndSaveTrainingTestSamples(samplesWithUserFeatures, file_path + "/webroot/sampledata")
-    # splitAndSaveTrainingTestSamplesByTimeStamp(samplesWithUserFeatures, file_path + "/webroot/sampledata")
+    if runMode == 'production':
+        generateSamplesForProduction(spark, movieSamples, ratingSamples, file_path + "/webroot/sampledata",
+                                     ('csv', 'parquet', 'tfrecord'),
+                                     checkpointDir=sys.argv[2] if len(sys.argv) > 2 else None)
+    else:
+        ratingSamplesWithLabel = addSampleLabel(ratingSamples)
+        ratingSamplesWithLabel.show(10, truncate=False)
+        samplesWithMovieFeatures = addMovieFeatures(movieSamples, ratingSamplesWithLabel)
+        samplesWithUserFeatures = addUserFeatures(samplesWithMovieFeatures)
+        # save samples as csv for the current tf models, plus typed parquet and tfrecord shards
+        splitAndSaveTrainingTestSamples(samplesWithUserFeatures, file_path + "/webroot/sampledata",
+                                        ('csv', 'parquet', 'tfrecord'))
+        # splitAndSaveTrainingTestSamplesByTimeStamp(samplesWithUserFeatures, file_path + "/webroot/sampledata")
+        # splitAndSaveRollingWindowSamples(samplesWithUserFeatures, file_path + "/webroot/sampledata")
@@ -1,6 +1,10 @@
+import os
+import re
+import json
 from pyspark import SparkConf
-from pyspark.ml import Pipeline
-from pyspark.ml.feature import OneHotEncoderEstimator, StringIndexer, QuantileDiscretizer, MinMaxScaler
+from pyspark.ml import Pipeline, PipelineModel
+from pyspark.ml.feature import OneHotEncoderEstimator, StringIndexer, QuantileDiscretizer, MinMaxScaler, \
+    CountVectorizer, SQLTransformer, Bucketizer, MinMaxScalerModel, StringIndexerModel, CountVectorizerModel
 from pyspark.ml.linalg import VectorUDT, Vectors
 from pyspark.sql import SparkSession
 from pyspark.sql.functions import *
@@ -22,7 +26,7 @@ def array2vec(genreIndexes, indexSize):
     return Vectors.sparse(indexSize, genreIndexes, fill_list)
 
 
-def multiHotEncoderExample(movieSamples):
+def multiHotEncodeWithUdf(movieSamples):
     samplesWithGenre = movieSamples.select("movieId", "title", explode(
         split(F.col("genres"), "\\|").cast(ArrayType(StringType()))).alias('genre'))
     genreIndexer = StringIndexer(inputCol="genre", outputCol="genreIndex")
@@ -34,26 +38,142 @@ def multiHotEncoderExample(movieSamples):
         F.collect_list('genreIndexInt').alias('genreIndexes')).withColumn("indexSize", F.lit(indexSize))
     finalSample = processedSamples.withColumn("vector",
                                               udf(array2vec, VectorUDT())(F.col("genreIndexes"), F.col("indexSize")))
+    return finalSample, StringIndexerModel.labels
+
+
+def multiHotEncoderExample(movieSamples):
+    finalSample, _ = multiHotEncodeWithUdf(movieSamples)
     finalSample.printSchema()
     finalSample.show(10)
 
 
-def ratingFeatures(ratingSamples):
-    ratingSamples.printSchema()
-    ratingSamples.show()
+def multiHotEncoder(inputCol, outputCol, delimiter='|'):
+    """
+    multi-hot encoder of a delimited string column such as genres "Action|Adventure|Sci-Fi"
+    the column is split in the jvm and CountVectorizer(binary=True) fits the vocabulary and emits the sparse 0/1
+    vectors row by row, no python udf, no explode and regroup shuffle
+    return: a Pipeline, fit() gives a PipelineModel that can be saved and loaded like any spark ml model,
+    the vocabulary is in stages[-1].vocabulary, the split tokens stay in the outputCol + 'Tokens' column
+    """
+    tokensCol = outputCol + 'Tokens'
+    splitter = SQLTransformer(statement=splitStatement(inputCol, delimiter, tokensCol))
+    vectorizer = CountVectorizer(inputCol=tokensCol, outputCol=outputCol, binary=True, minDF=1.0)
+    return Pipeline(stages=[splitter, vectorizer])
+
+
+def sqlStringLiteral(value):
+    return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+def splitStatement(inputCol, delimiter, outputCol):
+    # split() takes a java regex, the escaped delimiter matches literally, e.g. "|" -> '\\|' in the sql literal
+    return "SELECT *, split({}, {}) AS {} FROM __THIS__".format(inputCol, sqlStringLiteral(re.escape(delimiter)),
+                                                                outputCol)
+
+
+def splitDelimiter(statement):
+    """
+    (inputCol, delimiter, outputCol) of a splitStatement, None for any other statement
+    the '[x]' pattern of models saved before the delimiter was escaped is read as the single character x
+    """
+    match = re.match(r"SELECT \*, split\((\w+), '((?:[^'\\]|\\.)*)'\) AS (\w+) FROM __THIS__$", statement)
+    if not match:
+        return None
+    pattern = re.sub(r"\\(.)", r"\1", match.group(2))
+    legacy = re.match(r"\[(.)\]$", pattern)
+    delimiter = legacy.group(1) if legacy else re.sub(r"\\(.)", r"\1", pattern)
+    if not legacy and re.escape(delimiter) != pattern:
+        return None
+    return match.group(1), delimiter, match.group(3)
+
+
+def nativeMultiHotEncoderExample(movieSamples, modelPath=None, artifactPath=None):
+    encoderModel = multiHotEncoder("genres", "vector").fit(movieSamples)
+    if modelPath:
+        encoderModel.write().overwrite().save(modelPath)
+        encoderModel = PipelineModel.load(modelPath)
+    if artifactPath:
+        exportFeatureArtifacts(encoderModel, artifactPath)
+    finalSample = encoderModel.transform(movieSamples)
+    finalSample.printSchema()
+    finalSample.show(10)
+
+
+def movieRatingStats(ratingSamples):
     # calculate average movie rating score and rating count
-    movieFeatures = ratingSamples.groupBy('movieId').agg(F.count(F.lit(1)).alias('ratingCount'),
-                                                         F.avg("rating").alias("avgRating"),
-                                                         F.variance('rating').alias('ratingVar')) \
+    return ratingSamples.groupBy('movieId').agg(F.count(F.lit(1)).alias('ratingCount'),
+                                                F.avg("rating").alias("avgRating"),
+                                                F.variance('rating').alias('ratingVar')) \
         .withColumn('avgRatingVec', udf(lambda x: Vectors.dense(x), VectorUDT())('avgRating'))
-    movieFeatures.show(10)
+
+
+def fitRatingFeaturePipeline(movieFeatures):
     # bucketing
     ratingCountDiscretizer = QuantileDiscretizer(numBuckets=100, inputCol="ratingCount", outputCol="ratingCountBucket")
     # Normalization
     ratingScaler = MinMaxScaler(inputCol="avgRatingVec", outputCol="scaleAvgRating")
     pipelineStage = [ratingCountDiscretizer, ratingScaler]
     featurePipeline = Pipeline(stages=pipelineStage)
-    movieProcessedFeatures = featurePipeline.fit(movieFeatures).transform(movieFeatures)
+    return featurePipeline.fit(movieFeatures)
+
+
+def javaParam(stage, name):
+    # fitted jvm models such as MinMaxScalerModel do not expose their params on the python side
+    return getattr(stage._java_obj, 'get' + name[0].upper() + name[1:])()
+
+
+def stageArtifacts(stage):
+    if isinstance(stage, Bucketizer):
+        return {'type': 'bucketizer', 'inputCol': stage.getInputCol(), 'outputCol': stage.getOutputCol(),
+                'splits': list(stage.getSplits()), 'handleInvalid': stage.getHandleInvalid()}
+    if isinstance(stage, MinMaxScalerModel):
+        return {'type': 'minMaxScaler', 'inputCol': javaParam(stage, 'inputCol'),
+                'outputCol': javaParam(stage, 'outputCol'), 'originalMin': stage.originalMin.toArray().tolist(),
+                'originalMax': stage.originalMax.toArray().tolist(), 'min': javaParam(stage, 'min'),
+                'max': javaParam(stage, 'max')}
+    if isinstance(stage, StringIndexerModel):
+        return {'type': 'stringIndexer', 'inputCol': javaParam(stage, 'inputCol'),
+                'outputCol': javaParam(stage, 'outputCol'), 'labels': list(stage.labels),
+                'handleInvalid': javaParam(stage, 'handleInvalid')}
+    if isinstance(stage, CountVectorizerModel):
+        return {'type': 'countVectorizer', 'inputCol': javaParam(stage, 'inputCol'),
+                'outputCol': javaParam(stage, 'outputCol'), 'vocabulary': list(stage.vocabulary),
+                'binary': javaParam(stage, 'binary')}
+    if isinstance(stage, SQLTransformer):
+        # only the split statement written by multiHotEncoder can be replayed
+        split = splitDelimiter(stage.getStatement())
+        if split:
+            return {'type': 'split', 'inputCol': split[0], 'delimiter': split[1], 'outputCol': split[2]}
+    raise ValueError("no numpy replay for pipeline stage " + str(stage))
+
+
+def exportFeatureArtifacts(pipelineModel, artifactPath):
+    """
+    save the fitted parameters of a feature PipelineModel (bucket splits, min/max, vocabularies and labels)
+    as one small json file, FeatureReplay.FeaturePipelineReplay applies them to numpy batches without spark
+    artifactPath: local file path
+    """
+    artifacts = {'stages': [stageArtifacts(stage) for stage in pipelineModel.stages]}
+    outputDir = os.path.dirname(artifactPath)
+    if outputDir and not os.path.exists(outputDir):
+        os.makedirs(outputDir)
+    with open(artifactPath, 'w') as f:
+        json.dump(artifacts, f)
+    return artifacts
+
+
+def ratingFeatures(ratingSamples, modelPath=None, artifactPath=None):
+    ratingSamples.printSchema()
+    ratingSamples.show()
+    movieFeatures = movieRatingStats(ratingSamples)
+    movieFeatures.show(10)
+    pipelineModel = fitRatingFeaturePipeline(movieFeatures)
+    # keep the fitted pipeline instead of refitting it, as a spark model and as numpy replay artifacts
+    if modelPath:
+        pipelineModel.write().overwrite().save(modelPath)
+    if artifactPath:
+        exportFeatureArtifacts(pipelineModel, artifactPath)
+    movieProcessedFeatures = pipelineModel.transform(movieFeatures)
     movieProcessedFeatures.show(10)
 
 
@@ -70,7 +190,11 @@ if __name__ == '__main__':
     oneHotEncoderExample(movieSamples)
     print("MultiHotEncoder Example:")
     multiHotEncoderExample(movieSamples)
+    print("Native MultiHotEncoder Example:")
+    nativeMultiHotEncoderExample(movieSamples, file_path + "/webroot/modeldata/genreMultiHotEncoder",
+                                 file_path[7:] + "/webroot/modeldata/genreMultiHotEncoder.json")
     print("Numerical features Example:")
     ratingsResourcesPath = file_path + "/webroot/sampledata/ratings.csv"
     ratingSamples = spark.read.format('csv').option('header', 'true').load(ratingsResourcesPath)
-    ratingFeatures(ratingSamples)
+    ratingFeatures(ratingSamples, file_path + "/webroot/modeldata/ratingFeaturePipeline",
+                   file_path[7:] + "/webroot/modeldata/ratingFeaturePipeline.json")
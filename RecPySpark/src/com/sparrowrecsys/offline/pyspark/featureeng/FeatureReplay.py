@@ -0,0 +1,142 @@
+import json
+import numpy as np
+
+
+class BucketizerReplay:
+    """
+    Bucketizer / fitted QuantileDiscretizer: bucket i holds splits[i] <= x < splits[i + 1],
+    the last bucket also holds its upper bound
+    """
+
+    def __init__(self, stage):
+        self.inputCol = stage['inputCol']
+        self.outputCol = stage['outputCol']
+        self.splits = np.asarray(stage['splits'], dtype=np.float64)
+        self.handleInvalid = stage.get('handleInvalid', 'error')
+
+    def transform(self, columns):
+        values = np.asarray(columns[self.inputCol], dtype=np.float64)
+        buckets = np.searchsorted(self.splits, values, side='right') - 1
+        buckets = np.where(values == self.splits[-1], len(self.splits) - 2, buckets)
+        missing = np.isnan(values)
+        if ((buckets < 0) | (buckets > len(self.splits) - 2))[~missing].any():
+            raise ValueError("{} has values outside of the bucket splits".format(self.inputCol))
+        if missing.any():
+            # like spark, only NaN can be kept, in an extra last bucket
+            if self.handleInvalid != 'keep':
+                raise ValueError("{} has NaN values".format(self.inputCol))
+            buckets = np.where(missing, len(self.splits) - 1, buckets)
+        columns[self.outputCol] = buckets.astype(np.float64)
+
+
+class MinMaxScalerReplay:
+    """
+    MinMaxScalerModel: (x - originalMin) / (originalMax - originalMin) * (max - min) + min per dimension,
+    constant dimensions map to (max + min) / 2
+    """
+
+    def __init__(self, stage):
+        self.inputCol = stage['inputCol']
+        self.outputCol = stage['outputCol']
+        self.originalMin = np.asarray(stage['originalMin'], dtype=np.float64)
+        self.originalMax = np.asarray(stage['originalMax'], dtype=np.float64)
+        self.min = stage['min']
+        self.max = stage['max']
+
+    def transform(self, columns):
+        values = np.asarray(columns[self.inputCol], dtype=np.float64).reshape(-1, len(self.originalMin))
+        originalRange = self.originalMax - self.originalMin
+        scale = np.divide(self.max - self.min, originalRange, out=np.zeros_like(originalRange),
+                          where=originalRange != 0)
+        scaled = (values - self.originalMin) * scale + self.min
+        columns[self.outputCol] = np.where(originalRange != 0, scaled, 0.5 * (self.max - self.min) + self.min)
+
+
+class StringIndexerReplay:
+    """
+    StringIndexerModel: label -> index in the fitted labels, unseen labels follow handleInvalid
+    """
+
+    def __init__(self, stage):
+        self.inputCol = stage['inputCol']
+        self.outputCol = stage['outputCol']
+        self.indexes = {label: index for index, label in enumerate(stage['labels'])}
+        self.handleInvalid = stage.get('handleInvalid', 'error')
+
+    def transform(self, columns):
+        unseenIndex = len(self.indexes)
+        indexes = []
+        for label in columns[self.inputCol]:
+            index = self.indexes.get(label)
+            if index is None:
+                if self.handleInvalid != 'keep':
+                    raise ValueError("unseen label {} in {}".format(label, self.inputCol))
+                index = unseenIndex
+            indexes.append(index)
+        columns[self.outputCol] = np.asarray(indexes, dtype=np.float64)
+
+
+class SplitReplay:
+    """
+    split(inputCol, escaped delimiter) of the multi-hot encoder's SQLTransformer, a literal string split
+    """
+
+    def __init__(self, stage):
+        self.inputCol = stage['inputCol']
+        self.outputCol = stage['outputCol']
+        self.delimiter = stage['delimiter']
+
+    def transform(self, columns):
+        columns[self.outputCol] = [None if value is None else value.split(self.delimiter)
+                                   for value in columns[self.inputCol]]
+
+
+class CountVectorizerReplay:
+    """
+    CountVectorizerModel as a dense (rows, vocabulary) matrix, binary models give 0/1 multi-hot rows
+    """
+
+    def __init__(self, stage):
+        self.inputCol = stage['inputCol']
+        self.outputCol = stage['outputCol']
+        self.vocabulary = {term: index for index, term in enumerate(stage['vocabulary'])}
+        self.binary = stage.get('binary', False)
+
+    def transform(self, columns):
+        tokensList = columns[self.inputCol]
+        counts = np.zeros((len(tokensList), len(self.vocabulary)), dtype=np.float64)
+        rows, indexes = [], []
+        for row, tokens in enumerate(tokensList):
+            for token in tokens or ():
+                index = self.vocabulary.get(token)
+                if index is not None:
+                    rows.append(row)
+                    indexes.append(index)
+        np.add.at(counts, (np.asarray(rows, dtype=np.int64), np.asarray(indexes, dtype=np.int64)), 1.0)
+        columns[self.outputCol] = np.minimum(counts, 1.0) if self.binary else counts
+
+
+STAGE_REPLAYS = {'bucketizer': BucketizerReplay, 'minMaxScaler': MinMaxScalerReplay,
+                 'stringIndexer': StringIndexerReplay, 'split': SplitReplay, 'countVectorizer': CountVectorizerReplay}
+
+
+class FeaturePipelineReplay:
+    """
+    spark free replay of a fitted feature PipelineModel exported by FeatureEngineering.exportFeatureArtifacts,
+    a batch is a dict of column name -> list or numpy array, transform() adds every stage's output column
+    vector columns are 2d arrays with one row per sample
+    """
+
+    def __init__(self, artifacts):
+        self.stages = [STAGE_REPLAYS[stage['type']](stage) for stage in artifacts['stages']]
+
+    @staticmethod
+    def load(path):
+        with open(path) as f:
+            return FeaturePipelineReplay(json.load(f))
+
+    def transform(self, batch):
+        columns = dict(batch)
+        for stage in self.stages:
+            stage.transform(columns)
+        return columns
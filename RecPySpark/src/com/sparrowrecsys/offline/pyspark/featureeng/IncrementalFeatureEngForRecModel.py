@@ -0,0 +1,166 @@
+import sys
+from pyspark import SparkConf, StorageLevel
+from pyspark.sql import SparkSession, Window
+from pyspark.sql import functions as F
+from pyspark.sql.types import *
+import UserHistoryFeatures
+from UserHistoryFeatures import resumeUserHistory
+from FeatureEngForRecModel import NUMBER_PRECISION, addMovieBasicFeatures, withUserFeatureFields
+
+# one saved event per rating, same fields and order as UserHistoryFeatures.toEvent
+EVENT_SCHEMA = StructType([StructField('movieId', StringType(), True),
+                           StructField('label', IntegerType(), True),
+                           StructField('rating', DoubleType(), True),
+                           StructField('releaseYear', IntegerType(), True),
+                           StructField('genres', StringType(), True),
+                           StructField('timestamp', StringType(), True)])
+USER_STATE_SCHEMA = StructType([StructField('userId', StringType(), True),
+                                StructField('events', ArrayType(EVENT_SCHEMA), True)])
+MOVIE_STATS_SCHEMA = StructType([StructField('movieId', StringType(), True),
+                                 StructField('ratingCount', LongType(), True),
+                                 StructField('ratingSum', DoubleType(), True),
+                                 StructField('ratingSquareSum', DoubleType(), True)])
+# column order of the samples written by FeatureEngForRecModel, genres is kept for the user pass
+SAMPLE_COLUMNS = ['movieId', 'userId', 'rating', 'timestamp', 'label', 'releaseYear', 'movieGenre1', 'movieGenre2',
+                  'movieGenre3', 'movieRatingCount', 'movieAvgRating', 'movieRatingStddev', 'genres']
+
+
+def loadFeatureState(spark, stateRootPath, bootstrap=False):
+    """
+    state saved by saveFeatureState under stateRootPath, every run adds a watermark=<timestamp> partition to
+    users/ (only the users it changed) and to movies/ (the running stats of every movie)
+    return: (userDeltas, movieStats, watermark), userDeltas are the saved events of every run up to the watermark
+            with a watermark column, an empty state with watermark -1 when bootstrapping
+    """
+    if bootstrap:
+        return spark.createDataFrame([], USER_STATE_SCHEMA).withColumn('watermark', F.lit(-1).cast(LongType())), \
+               spark.createDataFrame([], MOVIE_STATS_SCHEMA), -1
+    movieStatsVersions = spark.read.parquet(stateRootPath + '/movies')
+    watermark = movieStatsVersions.agg(F.max('watermark')).first()[0]
+    # the partition filters skip the files of a later, failed run that is being repeated
+    userDeltas = spark.read.parquet(stateRootPath + '/users').where(F.col('watermark') <= watermark)
+    movieStats = movieStatsVersions.where(F.col('watermark') == watermark).drop('watermark')
+    return userDeltas, movieStats, watermark
+
+
+def saveFeatureState(changedUserState, movieStats, watermark, stateRootPath):
+    changedUserState.write.mode('overwrite').parquet('{}/users/watermark={}'.format(stateRootPath, watermark))
+    movieStats.write.mode('overwrite').parquet('{}/movies/watermark={}'.format(stateRootPath, watermark))
+
+
+def compactFeatureState(spark, stateRootPath, compactedRootPath):
+    """
+    the latest saved events of every user as a single partition under compactedRootPath, later runs on the
+    compacted root read one file set instead of every daily delta
+    """
+    userDeltas, movieStats, watermark = loadFeatureState(spark, stateRootPath)
+    latest = F.row_number().over(Window.partitionBy('userId').orderBy(F.desc('watermark')))
+    userState = userDeltas.withColumn('latest', latest).where(F.col('latest') == 1).select('userId', 'events')
+    saveFeatureState(userState, movieStats, watermark, compactedRootPath)
+
+
+def updateMovieStats(movieStats, newRatings):
+    # running count, sum and sum of squares per movie, enough to rebuild count, avg and stddev
+    rating = F.col('rating').cast(DoubleType())
+    newStats = newRatings.groupBy('movieId').agg(F.count(F.lit(1)).alias('ratingCount'),
+                                                 F.sum(rating).alias('ratingSum'),
+                                                 F.sum(rating * rating).alias('ratingSquareSum'))
+    return movieStats.unionByName(newStats).groupBy('movieId').agg(F.sum('ratingCount').alias('ratingCount'),
+                                                                   F.sum('ratingSum').alias('ratingSum'),
+                                                                   F.sum('ratingSquareSum').alias('ratingSquareSum'))
+
+
+def movieRatingFeatures(movieStats):
+    # same columns and formatting as the rating features of FeatureEngForRecModel.addMovieFeatures
+    count = F.col('ratingCount')
+    variance = (F.col('ratingSquareSum') - F.col('ratingSum') * F.col('ratingSum') / count) / (count - 1)
+    return movieStats.select('movieId', count.alias('movieRatingCount'),
+                             F.format_number(F.col('ratingSum') / count, NUMBER_PRECISION).alias('movieAvgRating'),
+                             F.format_number(F.when(count > 1, F.sqrt(F.greatest(variance, F.lit(0.0))))
+                                             .otherwise(F.lit(0.0)), NUMBER_PRECISION).alias('movieRatingStddev'))
+
+
+def addIncrementalSamples(movieSamples, newRatings, userDeltas, movieStats, numPartitions=None):
+    """
+    samples of the new ratings only, with the same columns as FeatureEngForRecModel
+    movie rating features are the running stats up to and including this run, user features continue from
+    the saved last 100 events of every user, so each sample sees the same history as in a full rebuild
+    only the users with new ratings are read from userDeltas and shuffled, the others are left where they are
+    return: (samples, changed user state, updated movieStats, resumed), both dataframes are read from the
+            persisted resumed rdd, unpersist it once they are written
+    """
+    spark = newRatings.sql_ctx.sparkSession
+    spark.sparkContext.addPyFile(UserHistoryFeatures.__file__)
+    newMovieStats = updateMovieStats(movieStats, newRatings)
+    newSamples = addMovieBasicFeatures(movieSamples,
+                                       newRatings.withColumn('label', F.when(F.col('rating') >= 3.5, 1).otherwise(0))) \
+        .join(F.broadcast(movieRatingFeatures(newMovieStats)), on=['movieId'], how='left') \
+        .select(*SAMPLE_COLUMNS)
+    # the new users are few enough to broadcast, so the semi join filters the saved state without a shuffle,
+    # then one shuffle brings every new user's rows and saved events of every run together
+    newUsers = F.broadcast(newRatings.select('userId').distinct())
+    samplesByUser = newSamples.rdd.map(lambda row: (row['userId'], row))
+    eventsByUser = userDeltas.join(newUsers, on='userId', how='left_semi') \
+        .rdd.map(lambda row: (row['userId'], (row['watermark'], row['events'])))
+    resumed = samplesByUser.cogroup(eventsByUser, numPartitions) \
+        .mapValues(lambda grouped: resumeUserHistory(latestEvents(grouped[1]), grouped[0])) \
+        .persist(StorageLevel.MEMORY_AND_DISK)
+    samples = spark.createDataFrame(resumed.flatMap(lambda kv: kv[1][0]), withUserFeatureFields(newSamples.schema)) \
+        .drop('genres') \
+        .filter(F.col('userRatingCount') > 1)
+    changedUserState = spark.createDataFrame(resumed.map(lambda kv: (kv[0], kv[1][1])), USER_STATE_SCHEMA)
+    return samples, changedUserState, newMovieStats, resumed
+
+
+def latestEvents(versions):
+    # events of the latest run among the (watermark, events) saved for one user, None for a new user
+    latest = None
+    for watermark, events in versions:
+        if latest is None or watermark > latest[0]:
+            latest = (watermark, events)
+    return None if latest is None else latest[1]
+
+
+def materializeIncrementalSamples(spark, movieSamples, newRatings, stateRootPath, samplesOutputPath,
+                                  numPartitions=None, bootstrap=False):
+    """
+    one daily run over newRatings, the ratings that arrived since the last run, not the whole history,
+    ratings at or before the state watermark were already processed and are skipped
+    the changed users and the movie stats are added to stateRootPath as a new watermark partition
+    bootstrap: start from an empty state, newRatings is then the whole ratings history
+    return: the new watermark
+    """
+    userDeltas, movieStats, watermark = loadFeatureState(spark, stateRootPath, bootstrap)
+    newRatings = newRatings.where(F.col('timestamp').cast(LongType()) > watermark) \
+        .persist(StorageLevel.MEMORY_AND_DISK)
+    newWatermark = newRatings.agg(F.max(F.col('timestamp').cast(LongType()))).first()[0]
+    if newWatermark is None:
+        # nothing new, the state stays at its watermark
+        newRatings.unpersist()
+        return watermark
+    samples, changedUserState, newMovieStats, resumed = addIncrementalSamples(movieSamples, newRatings, userDeltas,
+                                                                              movieStats, numPartitions)
+    samples.write.option("header", "true").mode('overwrite').csv(samplesOutputPath)
+    saveFeatureState(changedUserState, newMovieStats, newWatermark, stateRootPath)
+    resumed.unpersist()
+    newRatings.unpersist()
+    return newWatermark
+
+
+if __name__ == '__main__':
+    # usage: IncrementalFeatureEngForRecModel.py runId [newRatingsPath], e.g. 20201019 .../newRatings/20201019.csv
+    # without newRatingsPath the state is bootstrapped from the whole ratings history
+    conf = SparkConf().setAppName('incrementalFeatureEngineering').setMaster('local[*]')
+    spark = SparkSession.builder.config(conf=conf).getOrCreate()
+    file_path = 'file:///home/hadoop/SparrowRecSys/src/main/resources'
+    movieResourcesPath = file_path + "/webroot/sampledata/movies.csv"
+    runId = sys.argv[1] if len(sys.argv) > 1 else 'initial'
+    bootstrap = len(sys.argv) < 3
+    ratingsPath = file_path + "/webroot/sampledata/ratings.csv" if bootstrap else sys.argv[2]
+    movieSamples = spark.read.format('csv').option('header', 'true').load(movieResourcesPath)
+    newRatings = spark.read.format('csv').option('header', 'true').load(ratingsPath)
+    watermark = materializeIncrementalSamples(spark, movieSamples, newRatings,
+                                              file_path + "/webroot/sampledata/featureState",
+                                              file_path + "/webroot/sampledata/incrementalSamples/" + runId,
+                                              bootstrap=bootstrap)
+    print("samples materialized up to timestamp", watermark)
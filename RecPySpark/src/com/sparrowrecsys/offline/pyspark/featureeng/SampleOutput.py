@@ -0,0 +1,156 @@
+import os
+import json
+from pyspark.sql import functions as F
+from pyspark.sql.types import LongType, FloatType, StringType
+
+# typed sample schema of every output, (name, type) in FeatureEngForRecModel column order, written next to the samples
+# as _schema.json which the tf models read instead of keeping their own copy
+# int and float columns become int64 and float tf.train.Feature lists, string columns bytes lists
+SAMPLE_FIELDS = [('movieId', 'int'), ('userId', 'int'), ('rating', 'float'), ('timestamp', 'int'), ('label', 'int'),
+                 ('releaseYear', 'int'), ('movieGenre1', 'string'), ('movieGenre2', 'string'),
+                 ('movieGenre3', 'string'), ('movieRatingCount', 'int'), ('movieAvgRating', 'float'),
+                 ('movieRatingStddev', 'float'), ('userRatedMovie1', 'int'), ('userRatedMovie2', 'int'),
+                 ('userRatedMovie3', 'int'), ('userRatedMovie4', 'int'), ('userRatedMovie5', 'int'),
+                 ('userRatingCount', 'int'), ('userAvgReleaseYear', 'int'), ('userReleaseYearStddev', 'float'),
+                 ('userAvgRating', 'float'), ('userRatingStddev', 'float'), ('userGenre1', 'string'),
+                 ('userGenre2', 'string'), ('userGenre3', 'string'), ('userGenre4', 'string'),
+                 ('userGenre5', 'string')]
+SPARK_TYPES = {'int': LongType(), 'float': FloatType(), 'string': StringType()}
+# what a missing value is written as in a tfrecord, the same defaults the csv reader of the tf models falls back to
+MISSING_VALUES = {'int': 0, 'float': 0.0, 'string': ''}
+SCHEMA_FILE = '_schema.json'
+
+
+def typedSamples(samples, extraColumns=()):
+    # format_number strings such as "1,024.50" lose their grouping commas before the cast
+    # extraColumns are passed through unchanged after the sample fields
+    columns = []
+    for name, fieldType in SAMPLE_FIELDS:
+        column = F.col(name)
+        if fieldType == 'float':
+            column = F.regexp_replace(column.cast(StringType()), ',', '')
+        columns.append(column.cast(SPARK_TYPES[fieldType]).alias(name))
+    return samples.select(*(columns + list(extraColumns)))
+
+
+def saveSchemaFile(samples, savePath, compression=None):
+    # SAMPLE_FIELDS as savePath/_schema.json through the hadoop filesystem of savePath, so csv and parquet outputs
+    # don't need tensorflow, spark's own readers skip files starting with '_'
+    sc = samples.sql_ctx.sparkSession.sparkContext
+    path = sc._jvm.org.apache.hadoop.fs.Path(savePath + '/' + SCHEMA_FILE)
+    stream = path.getFileSystem(sc._jsc.hadoopConfiguration()).create(path, True)
+    try:
+        stream.write(bytearray(json.dumps({'fields': SAMPLE_FIELDS, 'compression': compression or ''}), 'utf-8'))
+    finally:
+        stream.close()
+
+
+def saveSamplesAsCsv(samples, savePath):
+    # single csv file, the format read by the tf models through SampleDataset.get_dataset
+    samples.repartition(1).write.option("header", "true").mode('overwrite').csv(savePath)
+    saveSchemaFile(samples, savePath)
+
+
+def saveSamplesAsParquet(samples, savePath, numPartitions=None):
+    typed = typedSamples(samples)
+    if numPartitions:
+        typed = typed.repartition(numPartitions)
+    typed.write.mode('overwrite').parquet(savePath)
+    saveSchemaFile(samples, savePath)
+
+
+def encodeExample(tf, row):
+    features = {}
+    for name, fieldType in SAMPLE_FIELDS:
+        value = row[name]
+        if value is None:
+            value = MISSING_VALUES[fieldType]
+        if fieldType == 'int':
+            features[name] = tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
+        elif fieldType == 'float':
+            features[name] = tf.train.Feature(float_list=tf.train.FloatList(value=[value]))
+        else:
+            features[name] = tf.train.Feature(bytes_list=tf.train.BytesList(value=[value.encode('utf-8')]))
+    return tf.train.Example(features=tf.train.Features(feature=features)).SerializeToString()
+
+
+def writeTFRecordPartition(savePath, compression, partitionIndex, rows):
+    # tensorflow is only imported on the executors that actually write shards
+    import tensorflow as tf
+    suffix = '.gz' if compression == 'GZIP' else ''
+    shardPath = savePath + '/part-{:05d}.tfrecord{}'.format(partitionIndex, suffix)
+    written = 0
+    with tf.io.TFRecordWriter(shardPath, options=compression) as writer:
+        for row in rows:
+            writer.write(encodeExample(tf, row))
+            written += 1
+    if written == 0:
+        tf.io.gfile.remove(shardPath)
+    return written
+
+
+def saveSamplesAsTFRecord(samples, savePath, numPartitions=None, compression=None):
+    """
+    one tf.train.Example shard per partition, written in parallel by the executors through tf.io,
+    so savePath may be any filesystem tensorflow supports (file://, hdfs://, gs://)
+    SAMPLE_FIELDS is stored next to the shards as _schema.json, readers build parse_example specs from it
+    return: number of written examples
+    """
+    import tensorflow as tf
+    typed = typedSamples(samples)
+    if numPartitions:
+        typed = typed.repartition(numPartitions)
+    if tf.io.gfile.exists(savePath):
+        tf.io.gfile.rmtree(savePath)
+    tf.io.gfile.makedirs(savePath)
+    saveSchemaFile(samples, savePath, compression)
+    sc = samples.sql_ctx.sparkSession.sparkContext
+    sc.addPyFile(os.path.abspath(__file__))
+    return typed.rdd.mapPartitionsWithIndex(
+        lambda index, rows: [writeTFRecordPartition(savePath, compression, index, rows)]).sum()
+
+
+def saveSamples(samples, savePath, outputFormat='csv', numPartitions=None):
+    if outputFormat == 'csv':
+        saveSamplesAsCsv(samples, savePath)
+    elif outputFormat == 'parquet':
+        saveSamplesAsParquet(samples, savePath, numPartitions)
+    elif outputFormat == 'tfrecord':
+        saveSamplesAsTFRecord(samples, savePath, numPartitions)
+    else:
+        raise ValueError("unknown sample output format: " + outputFormat)
+
+
+def sampleOutputPath(basePath, name, outputFormat):
+    # csv keeps the old trainingSamples / testSamples locations, other formats get their own directory
+    return basePath + '/' + name if outputFormat == 'csv' else basePath + '/' + outputFormat + '/' + name
+
+
+def tfrecordFeatureDescription(tf, fields=SAMPLE_FIELDS):
+    # tf.io.parse_example spec of the shards written by saveSamplesAsTFRecord
+    dtypes = {'int': tf.int64, 'float': tf.float32, 'string': tf.string}
+    return {name: tf.io.FixedLenFeature([], dtypes[fieldType], default_value=MISSING_VALUES[fieldType])
+            for name, fieldType in fields}
+
+
+def loadTFRecordDataset(tf, savePath, batchSize=12, labelName='label'):
+    """
+    tf.data reader of a saveSamplesAsTFRecord directory, shards are read in parallel and parsed per batch
+    yields (features dict, label) batches like make_csv_dataset(label_name='label')
+    """
+    with tf.io.gfile.GFile(savePath + '/' + SCHEMA_FILE) as f:
+        schema = json.loads(f.read())
+    description = tfrecordFeatureDescription(tf, [tuple(field) for field in schema['fields']])
+    shards = tf.data.Dataset.list_files(savePath + '/part-*', shuffle=False)
+
+    def splitLabel(features):
+        label = features.pop(labelName)
+        return features, label
+
+    dataset = shards.interleave(lambda shard: tf.data.TFRecordDataset(shard, compression_type=schema['compression']),
+                                num_parallel_calls=tf.data.experimental.AUTOTUNE)
+    return dataset.batch(batchSize) \
+        .map(lambda examples: tf.io.parse_example(examples, description),
+             num_parallel_calls=tf.data.experimental.AUTOTUNE) \
+        .map(splitLabel) \
+        .prefetch(tf.data.experimental.AUTOTUNE)
@@ -0,0 +1,39 @@
+import time
+
+
+class StageTimer:
+    """
+    wall time of every named stage of a spark job plus the jobs, stages and tasks spark ran for it,
+    each run gets its own job group so its jobs can be read back from the status tracker, the group is cleared
+    afterwards so later jobs and reruns of a stage name are not counted again
+    """
+
+    def __init__(self, sc):
+        self.sc = sc
+        self.records = []
+
+    def run(self, name, action):
+        groupId = '{}-{}'.format(name, len(self.records))
+        self.sc.setJobGroup(groupId, name)
+        try:
+            start = time.time()
+            result = action()
+            cost = time.time() - start
+        finally:
+            self.sc.setLocalProperty('spark.jobGroup.id', None)
+            self.sc.setLocalProperty('spark.job.description', None)
+        tracker = self.sc.statusTracker()
+        jobIds = tracker.getJobIdsForGroup(groupId)
+        jobInfos = [tracker.getJobInfo(jobId) for jobId in jobIds]
+        stageIds = [stageId for info in jobInfos if info is not None for stageId in info.stageIds]
+        stageInfos = [tracker.getStageInfo(stageId) for stageId in stageIds]
+        # stages skipped thanks to cached or shuffled data report no info
+        stageInfos = [info for info in stageInfos if info is not None]
+        self.records.append((name, cost, len(jobIds), len(stageInfos), sum(info.numTasks for info in stageInfos)))
+        return result
+
+    def report(self):
+        print("{:<24s} {:>10s} {:>6s} {:>7s} {:>7s}".format('stage', 'seconds', 'jobs', 'stages', 'tasks'))
+        for name, cost, jobs, stages, tasks in self.records:
+            print("{:<24s} {:10.2f} {:6d} {:7d} {:7d}".format(name, cost, jobs, stages, tasks))
+        print("{:<24s} {:10.2f}".format('total', sum(record[1] for record in self.records)))
@@ -0,0 +1,175 @@
+import math
+from collections import deque
+from itertools import islice
+
+HISTORY_LENGTH = 100
+POSITIVE_HISTORY_SIZE = 5
+TOP_GENRE_SIZE = 5
+NUMBER_PRECISION = 2
+
+# features appended to every sample, same names and order as FeatureEngForRecModel.addUserFeatures
+USER_FEATURE_NAMES = ['userRatedMovie{}'.format(i + 1) for i in range(POSITIVE_HISTORY_SIZE)] + \
+                     ['userRatingCount', 'userAvgReleaseYear', 'userReleaseYearStddev', 'userAvgRating',
+                      'userRatingStddev'] + \
+                     ['userGenre{}'.format(i + 1) for i in range(TOP_GENRE_SIZE)]
+
+
+def formatNumber(value):
+    # same output as spark format_number(value, 2): grouping commas, half even rounding, null stays null
+    return None if value is None else '{:,.{}f}'.format(value, NUMBER_PRECISION)
+
+
+def windowStats(values):
+    """
+    count, sum and sample stddev of the non null values in window order, recomputed from scratch like spark's
+    avg / stddev over every rowsBetween frame, the reference RunningStats is checked against in
+    FeatureEngBenchmark.checkRunningStats
+    """
+    stats = RunningStats()
+    for value in values:
+        stats.add(value)
+    return stats.count, stats.sum, stats.stddev()
+
+
+class RunningStats:
+    """
+    count, sum and Welford mean / m2 of a sliding window of values, add() and remove() are O(1) and skip nulls
+    ratings (multiples of 0.5) and release years are exact in floating point, so count, sum and the averages match
+    the window version exactly, the stddev removal drifts in the last bits of the double only, which can move a
+    format_number(stddev, 2) value by 0.01 when it sits on a rounding boundary
+    """
+
+    def __init__(self):
+        self.count, self.sum, self.mean, self.m2 = 0, 0.0, 0.0, 0.0
+
+    def add(self, value):
+        if value is None:
+            return
+        self.count += 1
+        self.sum += value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def remove(self, value):
+        if value is None:
+            return
+        self.count -= 1
+        self.sum -= value
+        if self.count == 0:
+            self.sum, self.mean, self.m2 = 0.0, 0.0, 0.0
+            return
+        delta = value - self.mean
+        self.mean -= delta / self.count
+        self.m2 = max(self.m2 - delta * (value - self.mean), 0.0)
+
+    def stddev(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else None
+
+
+def releaseYear(event):
+    return None if event[3] is None else float(event[3])
+
+
+class UserHistoryState:
+    """
+    the last HISTORY_LENGTH events of one user plus the positive movies and genres among them
+    push() adds the newest event and evicts the oldest one in O(1), features() describes the events
+    before the current one, i.e. the rowsBetween(-100, -1) window of addUserFeatures, from running
+    RunningStats of the ratings and release years, so a row costs the same for light and heavy users
+    an event is a tuple (movieId, label, rating, releaseYear, genres, timestamp)
+    """
+
+    def __init__(self, events=()):
+        self.events = deque()
+        self.sequence = 0
+        # positive movies in window order, and for every genre the (sequence, offset) of its positive occurrences
+        self.positiveMovies = deque()
+        self.genrePositions = {}
+        self.ratingStats = RunningStats()
+        self.yearStats = RunningStats()
+        for event in events:
+            self.push(event)
+
+    def push(self, event):
+        movieId, label, _, _, genres, _ = event
+        self.events.append(event)
+        self.sequence += 1
+        self.ratingStats.add(event[2])
+        self.yearStats.add(releaseYear(event))
+        if label == 1 and movieId is not None:
+            self.positiveMovies.append(movieId)
+        if label == 1 and genres is not None:
+            for offset, genre in enumerate(genres.split('|')):
+                self.genrePositions.setdefault(genre, deque()).append((self.sequence, offset))
+        if len(self.events) > HISTORY_LENGTH:
+            self.evict()
+
+    def evict(self):
+        event = self.events.popleft()
+        movieId, label, _, _, genres, _ = event
+        self.ratingStats.remove(event[2])
+        self.yearStats.remove(releaseYear(event))
+        if label == 1 and movieId is not None:
+            self.positiveMovies.popleft()
+        if label == 1 and genres is not None:
+            for genre in genres.split('|'):
+                positions = self.genrePositions[genre]
+                positions.popleft()
+                if not positions:
+                    del self.genrePositions[genre]
+
+    def topGenres(self):
+        # count desc, ties by first appearance in the window like the stable sort of extractGenres
+        ranked = sorted(self.genrePositions.items(), key=lambda x: (-len(x[1]), x[1][0]))
+        return [genre for genre, _ in ranked[:TOP_GENRE_SIZE]]
+
+    def features(self):
+        recentPositive = list(islice(reversed(self.positiveMovies), POSITIVE_HISTORY_SIZE))
+        genres = self.topGenres()
+        years, ratings = self.yearStats, self.ratingStats
+        avgYear = int(years.sum / years.count) if years.count else None
+        avgRating = ratings.sum / ratings.count if ratings.count else None
+        return recentPositive + [None] * (POSITIVE_HISTORY_SIZE - len(recentPositive)) + \
+            [len(self.events), avgYear, formatNumber(years.stddev()), formatNumber(avgRating),
+             formatNumber(ratings.stddev())] + \
+            genres + [None] * (TOP_GENRE_SIZE - len(genres))
+
+
+def toEvent(row):
+    rating = row['rating']
+    label = row['label']
+    return (row['movieId'], None if label is None else int(label), None if rating is None else float(rating),
+            row['releaseYear'], row['genres'], row['timestamp'])
+
+
+def userHistoryPartition(rows):
+    """
+    one incremental pass over a partition sorted by (userId, timestamp)
+    yields every input row as a tuple extended with USER_FEATURE_NAMES values
+    """
+    currentUser = None
+    state = None
+    for row in rows:
+        if row['userId'] != currentUser:
+            currentUser = row['userId']
+            state = UserHistoryState()
+        yield tuple(row) + tuple(state.features())
+        state.push(toEvent(row))
+
+
+def resumeUserHistory(events, rows):
+    """
+    continue one user's pass from his saved events (oldest first) over his new rows
+    return: (new rows extended with USER_FEATURE_NAMES values, the last HISTORY_LENGTH events to save)
+    """
+    rows = sorted(rows, key=lambda r: r['timestamp'])
+    if not rows:
+        # untouched users keep their saved events without replaying them
+        return [], list(events or ())
+    state = UserHistoryState(events or ())
+    samples = []
+    for row in rows:
+        samples.append(tuple(row) + tuple(state.features()))
+        state.push(toEvent(row))
+    return samples, list(state.events)
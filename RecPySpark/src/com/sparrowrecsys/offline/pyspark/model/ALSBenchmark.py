@@ -0,0 +1,106 @@
+import sys
+import time
+import numpy as np
+from pyspark import SparkConf
+from pyspark.ml.evaluation import RegressionEvaluator
+from pyspark.ml.recommendation import ALS
+from pyspark.sql import SparkSession
+from CollaborativeFiltering import loadRatingSamples, recommendTopK, recommendTopUsers
+from LocalALS import LocalALS
+
+
+def timeAction(action):
+    start = time.time()
+    action()
+    return time.time() - start
+
+
+def topScores(recommendations, userCol='userIdInt'):
+    return {row[userCol]: np.array([rec['rating'] for rec in row['recommendations']])
+            for row in recommendations.collect()}
+
+
+def benchmarkTopK(spark, model, ratingSamples, outputPath, k=10):
+    """
+    users/sec of the built-in recommendForAllUsers against recommendTopK and movies/sec of recommendForAllItems
+    against recommendTopUsers, with and without norm bound pruning, then a check that both blocked searches
+    without seen exclusion return the built-in top k scores
+    """
+    sides = [('users', model.userFactors.count(), 'userIdInt', lambda: model.recommendForAllUsers(k), recommendTopK),
+             ('movies', model.itemFactors.count(), 'movieIdInt', lambda: model.recommendForAllItems(k),
+              recommendTopUsers)]
+    for side, queryCount, queryCol, builtInRecommend, blockedRecommend in sides:
+        candidates = [('built-in', builtInRecommend),
+                      ('blocked', lambda: blockedRecommend(spark, model, ratingSamples, k, prune=False)),
+                      ('blocked pruned', lambda: blockedRecommend(spark, model, ratingSamples, k, prune=True))]
+        for name, recommend in candidates:
+            cost = timeAction(lambda: recommend().write.mode('overwrite').parquet(
+                outputPath + '/' + side + '_' + name.replace(' ', '_')))
+            print("{:<8s} {:<16s} {:8.2f}s {:12.0f} {}/s".format(side, name, cost, queryCount / cost, side))
+        builtIn = topScores(builtInRecommend(), queryCol)
+        blocked = topScores(blockedRecommend(spark, model, ratingSamples, k, prune=True, excludeSeen=False), queryCol)
+        mismatches = [queryId for queryId, scores in builtIn.items()
+                      if not np.allclose(scores, blocked[queryId], rtol=1e-4, atol=1e-4)]
+        print("{} whose top {} scores differ from the built-in search: {}".format(side, k, len(mismatches)))
+        assert not mismatches, "blocked top k of {} differs from the built-in search".format(side)
+
+
+def ratingArrays(ratingSamples):
+    rows = ratingSamples.select('userIdInt', 'movieIdInt', 'ratingFloat').collect()
+    return np.array([row[0] for row in rows]), np.array([row[1] for row in rows]), \
+        np.array([row[2] for row in rows], dtype=np.float32)
+
+
+def benchmarkLocalALS(spark, ratingSamples, outputPath, rank=10, regParam=0.01, maxIter=5, alpha=1.0):
+    """
+    wall time and test rmse of spark ALS against LocalALS on the same split, explicit and implicit,
+    the local factors then go through recommendTopK to show they plug into the spark jobs unchanged
+    """
+    training, test = ratingSamples.randomSplit((0.8, 0.2), seed=42)
+    training, test = training.cache(), test.cache()
+    start = time.time()
+    trainUsers, trainItems, trainRatings = ratingArrays(training)
+    testUsers, testItems, testRatings = ratingArrays(test)
+    print("collect ratings to numpy {:8.2f}s, {} training ratings".format(time.time() - start, len(trainRatings)))
+    evaluator = RegressionEvaluator(predictionCol="prediction", labelCol='ratingFloat', metricName='rmse')
+    localModel = None
+    for implicitPrefs in [False, True]:
+        als = ALS(rank=rank, regParam=regParam, maxIter=maxIter, implicitPrefs=implicitPrefs, alpha=alpha,
+                  userCol='userIdInt', itemCol='movieIdInt', ratingCol='ratingFloat', coldStartStrategy='drop')
+        start = time.time()
+        sparkModel = als.fit(training)
+        sparkModel.userFactors.count()
+        sparkCost = time.time() - start
+        results = [('spark', sparkCost, evaluator.evaluate(sparkModel.transform(test)))]
+        for solver in ['cg', 'exact']:
+            start = time.time()
+            model = LocalALS(rank=rank, regParam=regParam, maxIter=maxIter, implicitPrefs=implicitPrefs, alpha=alpha,
+                             solver=solver).fit(trainUsers, trainItems, trainRatings)
+            cost = time.time() - start
+            predictions = model.predict(testUsers, testItems)
+            known = ~np.isnan(predictions)
+            results.append(('local ' + solver, cost,
+                            float(np.sqrt(np.mean((predictions[known] - testRatings[known]) ** 2)))))
+            if not implicitPrefs and solver == 'cg':
+                localModel = model
+        for name, cost, rmse in results:
+            # rmse of implicit models is not comparable to the ratings, it only tracks that both behave alike
+            print("{:<10s} {:<12s} {:8.2f}s  speedup x{:.2f}  rmse {:.4f}".format(
+                'implicit' if implicitPrefs else 'explicit', name, cost, sparkCost / cost, rmse))
+    recommendTopK(spark, localModel.toDataFrames(spark), ratingSamples, 10) \
+        .write.mode('overwrite').parquet(outputPath + '/localALSRecs')
+    training.unpersist()
+    test.unpersist()
+
+
+if __name__ == '__main__':
+    conf = SparkConf().setAppName('alsBenchmark').setMaster('local[*]')
+    spark = SparkSession.builder.config(conf=conf).getOrCreate()
+    file_path = sys.argv[1] if len(sys.argv) > 1 else 'file:///home/hadoop/SparrowRecSys/src/main/resources'
+    ratingSamples = loadRatingSamples(spark, file_path + '/webroot/sampledata/ratings.csv').cache()
+    als = ALS(regParam=0.01, maxIter=5, userCol='userIdInt', itemCol='movieIdInt', ratingCol='ratingFloat',
+              coldStartStrategy='drop')
+    model = als.fit(ratingSamples)
+    benchmarkTopK(spark, model, ratingSamples, file_path + '/webroot/sampledata/benchmark/als')
+    benchmarkLocalALS(spark, ratingSamples, file_path + '/webroot/sampledata/benchmark/als')
+    spark.stop()
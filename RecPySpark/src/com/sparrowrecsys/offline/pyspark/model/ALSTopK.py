@@ -0,0 +1,104 @@
+import numpy as np
+
+
+def topKOfRows(scores, indices, k):
+    """
+    partial selection of the k best scores of every row, only the k candidates are sorted
+    return: (indices, scores) sorted by score desc, shape (rows, min(k, columns))
+    """
+    k = min(k, scores.shape[1])
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    candidateScores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidateScores, axis=1, kind='stable')
+    return np.take_along_axis(indices, np.take_along_axis(candidates, order, axis=1), axis=1), \
+        np.take_along_axis(candidateScores, order, axis=1)
+
+
+class FactorTopK:
+    """
+    exact top-K items by dot product of ALS user and item factors
+    users are scored in blocks of userBlockSize with one matrix product per block, items already seen by a user
+    are masked out before the partial selection
+    prune=True visits items by decreasing norm in chunks of itemBlockSize and stops a user block as soon as
+    |user| * |item| (Cauchy-Schwarz bound of every remaining score) can no longer beat the current k-th score
+    """
+
+    def __init__(self, itemIds, itemFactors, userBlockSize=256, itemBlockSize=2048):
+        self.itemIds = np.asarray(itemIds)
+        self.itemFactors = np.asarray(itemFactors, dtype=np.float32)
+        self.itemIndex = {itemId: index for index, itemId in enumerate(self.itemIds.tolist())}
+        self.userBlockSize = userBlockSize
+        self.itemBlockSize = itemBlockSize
+        norms = np.linalg.norm(self.itemFactors, axis=1)
+        self.normOrder = np.argsort(-norms, kind='stable')
+        self.sortedFactors = self.itemFactors[self.normOrder]
+        self.sortedNorms = norms[self.normOrder]
+        # position of every item in the norm order
+        self.sortedPosition = np.empty(len(norms), dtype=np.int64)
+        self.sortedPosition[self.normOrder] = np.arange(len(norms))
+
+    def seenPairs(self, seen, positions=None):
+        # (row, item index) pairs of the seen items, unknown item ids are ignored
+        rows, items = [], []
+        for row, seenIds in enumerate(seen):
+            for itemId in seenIds or ():
+                index = self.itemIndex.get(itemId)
+                if index is not None:
+                    rows.append(row)
+                    items.append(index)
+        rows, items = np.asarray(rows, dtype=np.int64), np.asarray(items, dtype=np.int64)
+        return rows, items if positions is None else positions[items]
+
+    def recommend(self, userFactors, k, seen=None, prune=False):
+        """
+        userFactors: (users, rank) matrix, seen: optional list of seen item ids per user
+        return: (item index matrix, score matrix) of shape (users, k), rows with fewer than k unseen items are
+        padded with index -1 and score -inf
+        """
+        userFactors = np.asarray(userFactors, dtype=np.float32)
+        indices = np.full((len(userFactors), k), -1, dtype=np.int64)
+        scores = np.full((len(userFactors), k), -np.inf, dtype=np.float32)
+        for start in range(0, len(userFactors), self.userBlockSize):
+            end = start + self.userBlockSize
+            blockSeen = None if seen is None else seen[start:end]
+            blockIndices, blockScores = self.prunedBlock(userFactors[start:end], k, blockSeen) if prune \
+                else self.fullBlock(userFactors[start:end], k, blockSeen)
+            indices[start:end, :blockIndices.shape[1]] = blockIndices
+            scores[start:end, :blockScores.shape[1]] = blockScores
+        indices[np.isneginf(scores)] = -1
+        return indices, scores
+
+    def fullBlock(self, users, k, seen):
+        scores = users @ self.itemFactors.T
+        if seen is not None:
+            scores[self.seenPairs(seen)] = -np.inf
+        itemIndices = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+        return topKOfRows(scores, itemIndices, k)
+
+    def prunedBlock(self, users, k, seen):
+        bestIndices = np.full((len(users), k), -1, dtype=np.int64)
+        bestScores = np.full((len(users), k), -np.inf, dtype=np.float32)
+        userNorms = np.linalg.norm(users, axis=1)
+        seenRows, seenPositions = (np.empty(0, dtype=np.int64),) * 2 if seen is None \
+            else self.seenPairs(seen, self.sortedPosition)
+        for start in range(0, len(self.sortedFactors), self.itemBlockSize):
+            end = min(start + self.itemBlockSize, len(self.sortedFactors))
+            # items are sorted by norm, so the first norm of the chunk bounds every score that is left
+            active = np.flatnonzero(userNorms * self.sortedNorms[start] > bestScores[:, -1])
+            if len(active) == 0:
+                break
+            chunkScores = users[active] @ self.sortedFactors[start:end].T
+            inChunk = (seenPositions >= start) & (seenPositions < end) & np.isin(seenRows, active)
+            if inChunk.any():
+                chunkScores[np.searchsorted(active, seenRows[inChunk]), seenPositions[inChunk] - start] = -np.inf
+            chunkIndices = np.broadcast_to(self.normOrder[start:end], chunkScores.shape)
+            bestIndices[active], bestScores[active] = topKOfRows(
+                np.concatenate([bestScores[active], chunkScores], axis=1),
+                np.concatenate([bestIndices[active], chunkIndices], axis=1), k)
+        return bestIndices, bestScores
+
+    def recommendIds(self, userFactors, k, seen=None, prune=False):
+        # per user list of (itemId, score) pairs
+        indices, scores = self.recommend(userFactors, k, seen, prune)
+        return [[(self.itemIds[index].item(), float(score)) for index, score in zip(rowIndices, rowScores)
+                 if index >= 0] for rowIndices, rowScores in zip(indices, scores)]
@@ -0,0 +1,109 @@
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from pyspark import SparkConf, StorageLevel
+from pyspark.ml.evaluation import RegressionEvaluator
+from pyspark.ml.recommendation import ALS
+from pyspark.ml.tuning import ParamGridBuilder
+from pyspark.sql import SparkSession
+from pyspark.sql import functions as F
+from CollaborativeFiltering import loadRatingSamples
+
+
+def assignFolds(ratingSamples, numFolds, storageLevel=StorageLevel.MEMORY_AND_DISK):
+    """
+    the prepared ratings with a deterministic fold column, persisted once so no fold re-reads or re-casts the csv
+    """
+    folded = ratingSamples.select('userIdInt', 'movieIdInt', 'ratingFloat') \
+        .withColumn('fold', F.expr("pmod(hash(userIdInt, movieIdInt), {})".format(numFolds))) \
+        .persist(storageLevel)
+    folded.count()
+    return folded
+
+
+def paramDescription(paramMap):
+    return ", ".join("{}={}".format(param.name, value) for param, value in sorted(paramMap.items(),
+                                                                                   key=lambda x: x[0].name))
+
+
+class ALSTuning:
+    """
+    grid search of ALS over k folds of cached ratings
+    every (param map, fold) pair of a round is fitted concurrently on a thread pool, spark schedules their jobs
+    side by side, the first round only evaluates warmupFolds folds and configurations whose mean rmse is worse
+    than pruneRatio times the best one are terminated before the remaining folds run
+    """
+
+    def __init__(self, als, paramGrid, numFolds=3, parallelism=4, warmupFolds=1, pruneRatio=1.05):
+        self.als = als
+        self.paramGrid = paramGrid
+        self.numFolds = numFolds
+        self.parallelism = parallelism
+        self.warmupFolds = min(warmupFolds, numFolds)
+        self.pruneRatio = pruneRatio
+        self.evaluator = RegressionEvaluator(predictionCol="prediction", labelCol=als.getRatingCol(),
+                                             metricName='rmse')
+
+    def evaluateFold(self, folded, paramIndex, fold):
+        start = time.time()
+        model = self.als.fit(folded.where(F.col('fold') != fold), self.paramGrid[paramIndex])
+        rmse = self.evaluator.evaluate(model.transform(folded.where(F.col('fold') == fold)))
+        return paramIndex, fold, rmse, time.time() - start
+
+    def runRound(self, pool, folded, paramIndexes, folds, metrics, costs):
+        tasks = [pool.submit(self.evaluateFold, folded, paramIndex, fold) for paramIndex in paramIndexes
+                 for fold in folds]
+        for task in tasks:
+            paramIndex, fold, rmse, cost = task.result()
+            metrics[paramIndex].append(rmse)
+            costs[paramIndex] += cost
+
+    def fit(self, ratingSamples):
+        """
+        return: result rows sorted by mean rmse, (params, folds evaluated, mean rmse, rmse stddev,
+        fit and evaluation seconds summed over folds, seconds per fold, pruned)
+        """
+        folded = assignFolds(ratingSamples, self.numFolds)
+        metrics = [[] for _ in self.paramGrid]
+        costs = [0.0] * len(self.paramGrid)
+        active = list(range(len(self.paramGrid)))
+        with ThreadPoolExecutor(self.parallelism) as pool:
+            self.runRound(pool, folded, active, range(self.warmupFolds), metrics, costs)
+            if self.warmupFolds < self.numFolds:
+                best = min(np.mean(metrics[paramIndex]) for paramIndex in active)
+                active = [paramIndex for paramIndex in active
+                          if np.mean(metrics[paramIndex]) <= best * self.pruneRatio]
+                self.runRound(pool, folded, active, range(self.warmupFolds, self.numFolds), metrics, costs)
+        folded.unpersist()
+        results = [(paramDescription(self.paramGrid[paramIndex]), len(metrics[paramIndex]),
+                    float(np.mean(metrics[paramIndex])), float(np.std(metrics[paramIndex])), costs[paramIndex],
+                    costs[paramIndex] / len(metrics[paramIndex]), paramIndex not in active)
+                   for paramIndex in range(len(self.paramGrid))]
+        return sorted(results, key=lambda result: result[2])
+
+
+def printResults(results):
+    print("{:<48s} {:>5s} {:>8s} {:>8s} {:>9s} {:>9s} {:>7s}".format(
+        'params', 'folds', 'rmse', 'stddev', 'seconds', 's/fold', 'pruned'))
+    for params, folds, rmse, stddev, cost, foldCost, pruned in results:
+        print("{:<48s} {:5d} {:8.4f} {:8.4f} {:9.2f} {:9.2f} {:>7s}".format(
+            params, folds, rmse, stddev, cost, foldCost, 'yes' if pruned else 'no'))
+
+
+if __name__ == '__main__':
+    conf = SparkConf().setAppName('alsTuning').setMaster('local[*]')
+    spark = SparkSession.builder.config(conf=conf).getOrCreate()
+    file_path = sys.argv[1] if len(sys.argv) > 1 else 'file:///home/hadoop/SparrowRecSys/src/main/resources'
+    ratingSamples = loadRatingSamples(spark, file_path + '/webroot/sampledata/ratings.csv')
+    als = ALS(maxIter=5, userCol='userIdInt', itemCol='movieIdInt', ratingCol='ratingFloat', coldStartStrategy='drop')
+    paramGrid = ParamGridBuilder().addGrid(als.rank, [10, 20]).addGrid(als.regParam, [0.01, 0.05, 0.1, 0.5]).build()
+    start = time.time()
+    results = ALSTuning(als, paramGrid, numFolds=3).fit(ratingSamples)
+    printResults(results)
+    print("total tuning time {:.2f}s".format(time.time() - start))
+    spark.createDataFrame(results, "params string, folds int, rmse double, stddev double, seconds double, "
+                                   "secondsPerFold double, pruned boolean") \
+        .coalesce(1).write.option("header", "true").mode('overwrite') \
+        .csv(file_path + '/webroot/modeldata/alsTuningResults')
+    spark.stop()
@@ -1,3 +1,6 @@
+import os
+from itertools import islice
+import numpy as np
 from pyspark import SparkConf
 from pyspark.ml.evaluation import RegressionEvaluator
 from pyspark.ml.recommendation import ALS
@@ -5,6 +8,76 @@ from pyspark.ml.tuning import CrossValidator, ParamGridBuilder
 from pyspark.sql import SparkSession
 from pyspark.sql.types import *
 from pyspark.sql import functions as F
+import ALSTopK
+from ALSTopK import FactorTopK
+from LocalALS import ALSFoldIn
+
+
+def loadRatingSamples(spark, ratingResourcesPath):
+    return spark.read.format('csv').option('header', 'true').load(ratingResourcesPath) \
+        .withColumn("userIdInt", F.col("userId").cast(IntegerType())) \
+        .withColumn("movieIdInt", F.col("movieId").cast(IntegerType())) \
+        .withColumn("ratingFloat", F.col("rating").cast(FloatType()))
+
+
+def factorTopK(spark, queryFactors, candidateFactors, seenCandidates, k, prune, queryCol, candidateCol, chunkSize):
+    """
+    top k candidates of every query by the dot product of their ALS factors
+    candidate factors are collected once and broadcast, every partition of query factors is scored in blocks by
+    FactorTopK (matrix product per block and partial selection, optional norm bound pruning), chunkSize queries
+    are held in memory at a time
+    seenCandidates: queryCol, seen dataframe of candidate ids excluded per query, None to keep every candidate
+    """
+    candidateRows = candidateFactors.collect()
+    searcher = FactorTopK(np.array([row['id'] for row in candidateRows]),
+                          np.array([row['features'] for row in candidateRows]))
+    searcherBroadcast = spark.sparkContext.broadcast(searcher)
+    spark.sparkContext.addPyFile(os.path.abspath(ALSTopK.__file__))
+    queries = queryFactors.withColumnRenamed('id', queryCol)
+    excludeSeen = seenCandidates is not None
+    if excludeSeen:
+        queries = queries.join(seenCandidates, on=queryCol, how='left')
+    else:
+        queries = queries.withColumn('seen', F.lit(None).cast(ArrayType(IntegerType())))
+
+    def recommendPartition(rows):
+        topK = searcherBroadcast.value
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, chunkSize))
+            if not chunk:
+                break
+            recommendations = topK.recommendIds(np.array([row['features'] for row in chunk]), k,
+                                                [row['seen'] for row in chunk] if excludeSeen else None, prune)
+            for row, recs in zip(chunk, recommendations):
+                yield row[queryCol], recs
+
+    schema = StructType([StructField(queryCol, IntegerType(), False),
+                         StructField('recommendations', ArrayType(StructType([
+                             StructField(candidateCol, IntegerType(), True),
+                             StructField('rating', FloatType(), True)])), True)])
+    return spark.createDataFrame(queries.rdd.mapPartitions(recommendPartition), schema)
+
+
+def recommendTopK(spark, model, ratingSamples, k=10, prune=True, excludeSeen=True, userCol='userIdInt',
+                  itemCol='movieIdInt', chunkSize=4096):
+    """
+    top k movies of every user from the ALS factors, same output schema as model.recommendForAllUsers(k),
+    movies the user already rated are excluded when excludeSeen, see factorTopK
+    """
+    seenItems = ratingSamples.groupBy(userCol).agg(F.collect_list(itemCol).alias('seen')) if excludeSeen else None
+    return factorTopK(spark, model.userFactors, model.itemFactors, seenItems, k, prune, userCol, itemCol, chunkSize)
+
+
+def recommendTopUsers(spark, model, ratingSamples, k=10, prune=True, excludeSeen=True, userCol='userIdInt',
+                      itemCol='movieIdInt', chunkSize=4096):
+    """
+    top k users of every movie from the ALS factors, same output schema as model.recommendForAllItems(k),
+    users who already rated the movie are excluded when excludeSeen, see factorTopK
+    """
+    seenUsers = ratingSamples.groupBy(itemCol).agg(F.collect_list(userCol).alias('seen')) if excludeSeen else None
+    return factorTopK(spark, model.itemFactors, model.userFactors, seenUsers, k, prune, itemCol, userCol, chunkSize)
+
 
 if __name__ == '__main__':
     conf = SparkConf().setAppName('collaborativeFiltering').setMaster('local')
@@ -12,10 +85,7 @@ if __name__ == '__main__':
     #/Users/zhewang/Workspace/SparrowRecSys/src/main/resources/webroot/modeldata
     file_path = 'file:///Users/zhewang/Workspace/SparrowRecSys/src/main/resources'
     ratingResourcesPath = file_path + '/webroot/sampledata/ratings.csv'
-    ratingSamples = spark.read.format('csv').option('header', 'true').load(ratingResourcesPath) \
-        .withColumn("userIdInt", F.col("userId").cast(IntegerType())) \
-        .withColumn("movieIdInt", F.col("movieId").cast(IntegerType())) \
-        .withColumn("ratingFloat", F.col("rating").cast(FloatType()))
+    ratingSamples = loadRatingSamples(spark, ratingResourcesPath)
     training, test = ratingSamples.randomSplit((0.8, 0.2))
     # Build the recommendation model using ALS on the training data
     # Note we set cold start strategy to 'drop' to ensure we don't get NaN evaluation metrics
@@ -31,8 +101,10 @@ if __name__ == '__main__':
     print("Root-mean-square error = {}".format(rmse))
     # Generate top 10 movie recommendations for each user
     userRecs = model.recommendForAllUsers(10)
-    # Generate top 10 user recommendations for each movie
-    movieRecs = model.recommendForAllItems(10)
+    # Generate top 10 unseen movie recommendations for each user with the blocked, pruned search
+    unseenUserRecs = recommendTopK(spark, model, ratingSamples, 10)
+    # Generate top 10 user recommendations for each movie with the same blocked search, like recommendForAllItems
+    movieRecs = recommendTopUsers(spark, model, ratingSamples, 10, excludeSeen=False)
     # Generate top 10 movie recommendations for a specified set of users
     users = ratingSamples.select(als.getUserCol()).distinct().limit(3)
     userSubsetRecs = model.recommendForUserSubset(users, 10)
@@ -40,6 +112,11 @@ if __name__ == '__main__':
     movies = ratingSamples.select(als.getItemCol()).distinct().limit(3)
     movieSubSetRecs = model.recommendForItemSubset(movies, 10)
     userRecs.show(5, False)
+    unseenUserRecs.show(5, False)
+    # Fold in a new user from his first ratings without refitting, the vector can be served right away
+    foldIn = ALSFoldIn.fromFactorRows(model.itemFactors.collect(), regParam=0.01)
+    newUserFactors = foldIn.foldInUser([(1, 5.0), (260, 4.5), (1196, 4.0), (2571, 2.0)])
+    print("new user factors: {}".format(newUserFactors))
     movieRecs.show(5, False)
     userSubsetRecs.show(5, False)
     movieSubSetRecs.show(5, False)
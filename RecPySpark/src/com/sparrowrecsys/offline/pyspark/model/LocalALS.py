@@ -0,0 +1,235 @@
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import scipy.sparse as sp
+
+# the factor dataframes of a spark ALSModel, accepted wherever model.userFactors / model.itemFactors are read
+FactorDataFrames = namedtuple('FactorDataFrames', ['userFactors', 'itemFactors'])
+
+
+def initialFactors(count, rank, rng):
+    # unit norm gaussian rows, the same initialization as spark ALS
+    factors = rng.standard_normal((count, rank))
+    return factors / np.linalg.norm(factors, axis=1, keepdims=True)
+
+
+class LocalALS:
+    """
+    single node ALS on numpy/scipy for catalogues that fit in memory, no spark session, no shuffle
+    explicit: least squares on the observed ratings, implicit: Hu-Koren-Volinsky confidence 1 + alpha * |r| on
+    every item with preference r > 0, both regularized with regParam * (ratings of the row) like spark ALS
+    rows are updated in chunks of rowsPerChunk on numThreads threads, each chunk either runs cgSteps of
+    conjugate gradient warm started from the current factors (solver='cg') or builds and solves its normal
+    equations exactly (solver='exact'), both vectorized over the whole chunk, the exact solver sums the outer
+    products y_i y_i^T of at most exactBlockBytes at a time
+    """
+
+    def __init__(self, rank=10, regParam=0.1, maxIter=10, implicitPrefs=False, alpha=1.0, solver='cg', cgSteps=3,
+                 numThreads=None, rowsPerChunk=2048, exactBlockBytes=64 * 1024 * 1024, seed=None):
+        if solver not in ('cg', 'exact'):
+            raise ValueError("unknown solver: " + solver)
+        self.rank = rank
+        self.regParam = regParam
+        self.maxIter = maxIter
+        self.implicitPrefs = implicitPrefs
+        self.alpha = alpha
+        self.solver = solver
+        self.cgSteps = cgSteps
+        self.numThreads = numThreads or os.cpu_count() or 1
+        self.rowsPerChunk = rowsPerChunk
+        self.exactBlockBytes = exactBlockBytes
+        self.seed = seed
+        self.userIds = self.itemIds = None
+        self.userFactors = self.itemFactors = None
+
+    def fit(self, userIds, itemIds, ratings):
+        self.userIds, userIndex = np.unique(np.asarray(userIds), return_inverse=True)
+        self.itemIds, itemIndex = np.unique(np.asarray(itemIds), return_inverse=True)
+        ratings = np.asarray(ratings, dtype=np.float64)
+        userItems = sp.csr_matrix((ratings, (userIndex, itemIndex)), shape=(len(self.userIds), len(self.itemIds)))
+        userItems.sum_duplicates()
+        itemUsers = userItems.T.tocsr()
+        rng = np.random.default_rng(self.seed)
+        self.userFactors = initialFactors(len(self.userIds), self.rank, rng)
+        self.itemFactors = initialFactors(len(self.itemIds), self.rank, rng)
+        with ThreadPoolExecutor(self.numThreads) as pool:
+            for _ in range(self.maxIter):
+                self.userFactors = self.updateFactors(pool, userItems, self.userFactors, self.itemFactors)
+                self.itemFactors = self.updateFactors(pool, itemUsers, self.itemFactors, self.userFactors)
+        return self
+
+    def updateFactors(self, pool, ratings, factors, fixedFactors):
+        # the shared gram matrix of the implicit model covers the unobserved entries with confidence 1
+        gram = fixedFactors.T @ fixedFactors if self.implicitPrefs else None
+        chunks = [(start, min(start + self.rowsPerChunk, ratings.shape[0]))
+                  for start in range(0, ratings.shape[0], self.rowsPerChunk)]
+        solved = pool.map(lambda chunk: self.solveChunk(ratings[chunk[0]:chunk[1]], factors[chunk[0]:chunk[1]],
+                                                        fixedFactors, gram), chunks)
+        return np.concatenate(list(solved), axis=0)
+
+    def chunkSystem(self, ratings, fixedFactors):
+        """
+        normal equations of a chunk of rows: A_u = gram + sum_i w_ui y_i y_i^T + reg_u I, b_u = sum_i v_ui y_i
+        return: (row of every rating, gathered y_i, w, reg, b)
+        """
+        counts = np.diff(ratings.indptr)
+        rows = np.repeat(np.arange(ratings.shape[0]), counts)
+        gathered = fixedFactors[ratings.indices]
+        values = ratings.data
+        if self.implicitPrefs:
+            confidence = self.alpha * np.abs(values)
+            weights = confidence
+            targets = np.where(values > 0, 1.0 + confidence, 0.0)
+        else:
+            weights = np.ones_like(values)
+            targets = values
+        b = sp.csr_matrix((targets, ratings.indices, ratings.indptr), shape=ratings.shape) @ fixedFactors
+        # spark scales the regularization by the explicit ratings, the positive ones in the implicit model
+        if self.implicitPrefs:
+            counts = np.bincount(rows, weights=values > 0, minlength=ratings.shape[0])
+        return rows, gathered, weights, self.regParam * counts, b
+
+    def solveChunk(self, ratings, factors, fixedFactors, gram):
+        rows, gathered, weights, reg, b = self.chunkSystem(ratings, fixedFactors)
+        if self.solver == 'exact':
+            systems = self.weightedGrams(ratings.indptr, gathered, weights) + reg[:, None, None] * np.eye(self.rank)
+            if gram is not None:
+                systems += gram
+            return np.linalg.solve(systems, b[:, :, None])[:, :, 0]
+
+        def multiply(x):
+            # A x for every row of the chunk without building A
+            dots = np.einsum('ij,ij->i', gathered, x[rows])
+            product = sp.csr_matrix((weights * dots, ratings.indices, ratings.indptr), shape=ratings.shape) \
+                @ fixedFactors + reg[:, None] * x
+            return product if gram is None else product + x @ gram
+
+        x = factors.copy()
+        residual = b - multiply(x)
+        direction = residual.copy()
+        residualSquare = np.einsum('ij,ij->i', residual, residual)
+        for _ in range(self.cgSteps):
+            product = multiply(direction)
+            curvature = np.einsum('ij,ij->i', direction, product)
+            step = np.divide(residualSquare, curvature, out=np.zeros_like(curvature), where=curvature > 0)
+            x += step[:, None] * direction
+            residual -= step[:, None] * product
+            newResidualSquare = np.einsum('ij,ij->i', residual, residual)
+            beta = np.divide(newResidualSquare, residualSquare, out=np.zeros_like(residualSquare),
+                             where=residualSquare > 0)
+            direction = residual + beta[:, None] * direction
+            residualSquare = newResidualSquare
+        return x
+
+    def weightedGrams(self, indptr, gathered, weights):
+        """
+        sum_i w_ui y_i y_i^T of every row
+        consecutive rows are reduced together while their (ratings x rank x rank) outer products fit in
+        exactBlockBytes, as one sparse product of weighted row sums, a row with more ratings than that, such as
+        a popular movie, is reduced on its own by a matrix product that never builds the outer products
+        """
+        rowCount = len(indptr) - 1
+        blockRatings = self.exactBlockBytes // (self.rank * self.rank * gathered.itemsize) or 1
+        grams = np.empty((rowCount, self.rank, self.rank))
+        row = 0
+        while row < rowCount:
+            start = indptr[row]
+            if indptr[row + 1] - start > blockRatings:
+                end = indptr[row + 1]
+                grams[row] = (gathered[start:end] * weights[start:end, None]).T @ gathered[start:end]
+                row += 1
+                continue
+            # rows [row, blockEnd) hold at most blockRatings ratings
+            blockEnd = np.searchsorted(indptr, start + blockRatings, side='right') - 1
+            end = indptr[blockEnd]
+            rowSums = sp.csr_matrix((weights[start:end], np.arange(end - start), indptr[row:blockEnd + 1] - start),
+                                    shape=(blockEnd - row, end - start))
+            block = gathered[start:end]
+            outer = (block[:, :, None] * block[:, None, :]).reshape(end - start, -1)
+            grams[row:blockEnd] = (rowSums @ outer).reshape(-1, self.rank, self.rank)
+            row = blockEnd
+        return grams
+
+    def predict(self, userIds, itemIds):
+        # NaN for users or items that were not in the training data, like coldStartStrategy='nan'
+        userPositions = np.searchsorted(self.userIds, userIds)
+        itemPositions = np.searchsorted(self.itemIds, itemIds)
+        userPositions = np.minimum(userPositions, len(self.userIds) - 1)
+        itemPositions = np.minimum(itemPositions, len(self.itemIds) - 1)
+        known = (self.userIds[userPositions] == userIds) & (self.itemIds[itemPositions] == itemIds)
+        predictions = np.einsum('ij,ij->i', self.userFactors[userPositions], self.itemFactors[itemPositions])
+        return np.where(known, predictions, np.nan)
+
+    def factorRows(self, ids, factors):
+        # (id, features) rows, the schema of ALSModel.userFactors / itemFactors
+        return [(int(factorId), [float(value) for value in row]) for factorId, row in
+                zip(ids, factors.astype(np.float32))]
+
+    def userFactorRows(self):
+        return self.factorRows(self.userIds, self.userFactors)
+
+    def itemFactorRows(self):
+        return self.factorRows(self.itemIds, self.itemFactors)
+
+    def toDataFrames(self, spark):
+        """
+        userFactors and itemFactors dataframes with the id / features columns of a spark ALSModel,
+        so the spark top k and serving jobs can consume either model
+        """
+        schema = "id int, features array<float>"
+        return FactorDataFrames(spark.createDataFrame(self.userFactorRows(), schema),
+                                spark.createDataFrame(self.itemFactorRows(), schema))
+
+
+class ALSFoldIn:
+    """
+    factors of users that were not part of the last ALS fit, from their ratings and the fixed item factors
+    each user is one regularized least squares problem of size rank, the same normal equations as a LocalALS
+    user update (solver='exact'), a batch of users is built and solved with one vectorized np.linalg.solve
+    the item factors can come from LocalALS or from a saved spark ALSModel (fromFactorRows)
+    """
+
+    def __init__(self, itemIds, itemFactors, regParam=0.1, implicitPrefs=False, alpha=1.0):
+        itemIds = np.asarray(itemIds)
+        order = np.argsort(itemIds, kind='stable')
+        self.itemIds = itemIds[order]
+        self.itemFactors = np.asarray(itemFactors, dtype=np.float64)[order]
+        self.solver = LocalALS(rank=self.itemFactors.shape[1], regParam=regParam, implicitPrefs=implicitPrefs,
+                               alpha=alpha, solver='exact')
+        self.gram = self.itemFactors.T @ self.itemFactors if implicitPrefs else None
+
+    @staticmethod
+    def fromFactorRows(rows, regParam=0.1, implicitPrefs=False, alpha=1.0):
+        # rows of (id, features), e.g. ALSModel.itemFactors.collect() or LocalALS.itemFactorRows()
+        return ALSFoldIn(np.array([row[0] for row in rows]), np.array([row[1] for row in rows]), regParam,
+                         implicitPrefs, alpha)
+
+    def ratingMatrix(self, userRatings):
+        # csr of the (itemId, rating) lists, items missing from the factors are ignored
+        rows, items, values = [], [], []
+        for row, ratings in enumerate(userRatings):
+            for itemId, rating in ratings:
+                rows.append(row)
+                items.append(itemId)
+                values.append(rating)
+        positions = np.minimum(np.searchsorted(self.itemIds, items), len(self.itemIds) - 1)
+        known = self.itemIds[positions] == np.asarray(items, dtype=self.itemIds.dtype)
+        return sp.csr_matrix((np.asarray(values, dtype=np.float64)[known],
+                              (np.asarray(rows, dtype=np.int64)[known], positions[known])),
+                             shape=(len(userRatings), len(self.itemIds)))
+
+    def foldIn(self, userRatings):
+        """
+        userRatings: one list of (itemId, rating) per user, at most one rating per item
+        return: (users, rank) factor matrix, users without any known item get a zero vector
+        """
+        ratings = self.ratingMatrix(userRatings)
+        factors = np.zeros((ratings.shape[0], self.itemFactors.shape[1]))
+        rated = np.flatnonzero(np.diff(ratings.indptr) > 0)
+        if len(rated):
+            factors[rated] = self.solver.solveChunk(ratings[rated], None, self.itemFactors, self.gram)
+        return factors
+
+    def foldInUser(self, ratings):
+        return self.foldIn([ratings])[0]
@@ -9,30 +9,29 @@ Diff with DIN:
 Reference:
     [1] Zhou G ,  Mou N ,  Fan Y , et al. Deep Interest Evolution Network for Click-Through Rate Prediction[J].  2018.
 '''
+import sys
 import pandas as pd
 import tensorflow as tf
 from tensorflow.python.ops import math_ops
 import numpy as np
 import random
+from SampleDataset import sample_files
+from FeatureLayers import sample_inputs, numeric_features, stack_columns, MOVIE_ID_BUCKETS, EMBEDDING_SIZE, \
+    RATED_MOVIES, USER_GENRES, MOVIE_GENRES, MOVIE_NUMERIC, USER_NUMERIC
+from DIN import profile_and_context
 
-
-# Training samples path, change to your local path
-training_samples_file_path = tf.keras.utils.get_file("trainingSamples.csv",
-                                                     "file:///Users/zhewang/Workspace/SparrowRecSys/src/main"
-                                                     "/resources/webroot/sampledata/trainingSamples.csv")
-# Test samples path, change to your local path
-test_samples_file_path = tf.keras.utils.get_file("testSamples.csv",
-                                                 "file:///Users/zhewang/Workspace/SparrowRecSys/src/main"
-                                                 "/resources/webroot/sampledata/testSamples.csv")
-
+# one sampled negative movie for every rated movie after the first, the targets of the auxiliary loss
+NEGATIVE_MOVIES = ['negtive_' + name for name in RATED_MOVIES[1:]]
 
 
 def get_dataset_with_negtive_movie(path,batch_size,seed_num):
-    tmp_df = pd.read_csv(path)
+    # a csv file, a glob or the part files of a spark csv sample directory
+    _, files = sample_files(path)
+    tmp_df = pd.concat([pd.read_csv(csv_file) for csv_file in files], ignore_index=True)
     tmp_df.fillna(0,inplace=True)
     random.seed(seed_num)
-    negtive_movie_df=tmp_df.loc[:,'userRatedMovie2':'userRatedMovie5'].applymap( lambda x: random.sample( set(range(0, 1001))-set([int(x)]), 1)[0]  )
-    negtive_movie_df.columns = ['negtive_userRatedMovie2','negtive_userRatedMovie3','negtive_userRatedMovie4','negtive_userRatedMovie5']
+    negtive_movie_df=tmp_df.loc[:,RATED_MOVIES[1:]].applymap( lambda x: random.sample( set(range(0, MOVIE_ID_BUCKETS))-set([int(x)]), 1)[0]  )
+    negtive_movie_df.columns = NEGATIVE_MOVIES
     tmp_df=pd.concat([tmp_df,negtive_movie_df],axis=1)
 
     for i in tmp_df.select_dtypes('O').columns:
@@ -46,130 +45,14 @@ def get_dataset_with_negtive_movie(path,batch_size,seed_num):
     dataset = dataset.batch(batch_size)
     return dataset
 
-train_dataset = get_dataset_with_negtive_movie(training_samples_file_path,12,seed_num=2020)
-test_dataset = get_dataset_with_negtive_movie(test_samples_file_path,12,seed_num=2021)
-
-# Config
-RECENT_MOVIES = 5  # userRatedMovie{1-5}
-EMBEDDING_SIZE = 10
-
-# define input for keras model
-inputs = {
-    'movieAvgRating': tf.keras.layers.Input(name='movieAvgRating', shape=(), dtype='float32'),
-    'movieRatingStddev': tf.keras.layers.Input(name='movieRatingStddev', shape=(), dtype='float32'),
-    'movieRatingCount': tf.keras.layers.Input(name='movieRatingCount', shape=(), dtype='int32'),
-    'userAvgRating': tf.keras.layers.Input(name='userAvgRating', shape=(), dtype='float32'),
-    'userRatingStddev': tf.keras.layers.Input(name='userRatingStddev', shape=(), dtype='float32'),
-    'userRatingCount': tf.keras.layers.Input(name='userRatingCount', shape=(), dtype='int32'),
-    'releaseYear': tf.keras.layers.Input(name='releaseYear', shape=(), dtype='int32'),
-
-    'movieId': tf.keras.layers.Input(name='movieId', shape=(), dtype='int32'),
-    'userId': tf.keras.layers.Input(name='userId', shape=(), dtype='int32'),
-    'userRatedMovie1': tf.keras.layers.Input(name='userRatedMovie1', shape=(), dtype='int32'),
-    'userRatedMovie2': tf.keras.layers.Input(name='userRatedMovie2', shape=(), dtype='int32'),
-    'userRatedMovie3': tf.keras.layers.Input(name='userRatedMovie3', shape=(), dtype='int32'),
-    'userRatedMovie4': tf.keras.layers.Input(name='userRatedMovie4', shape=(), dtype='int32'),
-    'userRatedMovie5': tf.keras.layers.Input(name='userRatedMovie5', shape=(), dtype='int32'),
-
-    'userGenre1': tf.keras.layers.Input(name='userGenre1', shape=(), dtype='string'),
-    'userGenre2': tf.keras.layers.Input(name='userGenre2', shape=(), dtype='string'),
-    'userGenre3': tf.keras.layers.Input(name='userGenre3', shape=(), dtype='string'),
-    'userGenre4': tf.keras.layers.Input(name='userGenre4', shape=(), dtype='string'),
-    'userGenre5': tf.keras.layers.Input(name='userGenre5', shape=(), dtype='string'),
-    'movieGenre1': tf.keras.layers.Input(name='movieGenre1', shape=(), dtype='string'),
-    'movieGenre2': tf.keras.layers.Input(name='movieGenre2', shape=(), dtype='string'),
-    'movieGenre3': tf.keras.layers.Input(name='movieGenre3', shape=(), dtype='string'),
-    
-    'negtive_userRatedMovie2': tf.keras.layers.Input(name='negtive_userRatedMovie2', shape=(), dtype='int32'),
-    'negtive_userRatedMovie3': tf.keras.layers.Input(name='negtive_userRatedMovie3', shape=(), dtype='int32'),
-    'negtive_userRatedMovie4': tf.keras.layers.Input(name='negtive_userRatedMovie4', shape=(), dtype='int32'),
-    'negtive_userRatedMovie5': tf.keras.layers.Input(name='negtive_userRatedMovie5', shape=(), dtype='int32'), 
-    
-    'label':tf.keras.layers.Input(name='label', shape=(), dtype='int32')
-}
-
-
-# user id embedding feature
-user_col = tf.feature_column.categorical_column_with_identity(key='userId', num_buckets=30001)
-user_emb_col = tf.feature_column.embedding_column(user_col, EMBEDDING_SIZE)
-
-# genre features vocabulary
-genre_vocab = ['Film-Noir', 'Action', 'Adventure', 'Horror', 'Romance', 'War', 'Comedy', 'Western', 'Documentary',
-               'Sci-Fi', 'Drama', 'Thriller',
-               'Crime', 'Fantasy', 'Animation', 'IMAX', 'Mystery', 'Children', 'Musical']
-# user genre embedding feature
-user_genre_col = tf.feature_column.categorical_column_with_vocabulary_list(key="userGenre1",
-                                                                           vocabulary_list=genre_vocab)
-user_genre_emb_col = tf.feature_column.embedding_column(user_genre_col, EMBEDDING_SIZE)
-# item genre embedding feature
-item_genre_col = tf.feature_column.categorical_column_with_vocabulary_list(key="movieGenre1",
-                                                                           vocabulary_list=genre_vocab)
-item_genre_emb_col = tf.feature_column.embedding_column(item_genre_col, EMBEDDING_SIZE)
-
-
-
-candidate_movie_col = [ tf.feature_column.numeric_column(key='movieId', default_value=0),   ]
-
-# user behaviors
-recent_rate_col = [
-    tf.feature_column.numeric_column(key='userRatedMovie1', default_value=0),
-    tf.feature_column.numeric_column(key='userRatedMovie2', default_value=0),
-    tf.feature_column.numeric_column(key='userRatedMovie3', default_value=0),
-    tf.feature_column.numeric_column(key='userRatedMovie4', default_value=0),
-    tf.feature_column.numeric_column(key='userRatedMovie5', default_value=0),
-]
-
-
-negtive_movie_col = [
-    tf.feature_column.numeric_column(key='negtive_userRatedMovie2', default_value=0),
-    tf.feature_column.numeric_column(key='negtive_userRatedMovie3', default_value=0),
-    tf.feature_column.numeric_column(key='negtive_userRatedMovie4', default_value=0),
-    tf.feature_column.numeric_column(key='negtive_userRatedMovie5', default_value=0),
-]
-
-
-
-# user profile
-user_profile = [
-    user_emb_col,
-    user_genre_emb_col,
-    tf.feature_column.numeric_column('userRatingCount'),
-    tf.feature_column.numeric_column('userAvgRating'),
-    tf.feature_column.numeric_column('userRatingStddev'),
-]
-
-# context features
-context_features = [
-    item_genre_emb_col,
-    tf.feature_column.numeric_column('releaseYear'),
-    tf.feature_column.numeric_column('movieRatingCount'),
-    tf.feature_column.numeric_column('movieAvgRating'),
-    tf.feature_column.numeric_column('movieRatingStddev'),
-]
-
-label =[ tf.feature_column.numeric_column(key='label', default_value=0),   ]
-
 
-candidate_layer = tf.keras.layers.DenseFeatures(candidate_movie_col)(inputs)
-user_behaviors_layer = tf.keras.layers.DenseFeatures(recent_rate_col)(inputs)
-negtive_movie_layer = tf.keras.layers.DenseFeatures(negtive_movie_col)(inputs)
-user_profile_layer = tf.keras.layers.DenseFeatures(user_profile)(inputs)
-context_features_layer = tf.keras.layers.DenseFeatures(context_features)(inputs)
-y_true = tf.keras.layers.DenseFeatures(label)(inputs)
+def load_dataset(file_path, batch_size=12, training=True):
+    # samples with sampled negative movies, the fixed seeds of the original training and test sets
+    return get_dataset_with_negtive_movie(file_path, batch_size, seed_num=2020 if training else 2021)
 
-# Activation Unit
-movie_emb_layer = tf.keras.layers.Embedding(input_dim=1001,output_dim=EMBEDDING_SIZE,mask_zero=True)# mask zero
-
-user_behaviors_emb_layer = movie_emb_layer(user_behaviors_layer) 
-candidate_emb_layer = movie_emb_layer(candidate_layer) 
-negtive_movie_emb_layer = movie_emb_layer(negtive_movie_layer) 
-
-candidate_emb_layer = tf.squeeze(candidate_emb_layer,axis=1)
-
-user_behaviors_hidden_state=tf.keras.layers.GRU(EMBEDDING_SIZE, return_sequences=True)(user_behaviors_emb_layer)
 
 class attention(tf.keras.layers.Layer):
-    def __init__(self, embedding_size=EMBEDDING_SIZE, time_length=5, ):
+    def __init__(self, embedding_size=EMBEDDING_SIZE, time_length=len(RATED_MOVIES), ):
         super().__init__()
         self.time_length = time_length  
         self.embedding_size = embedding_size
@@ -196,9 +79,6 @@ class attention(tf.keras.layers.Layer):
 
         return Repeat_attention_s
 
-attention_score=attention()( [candidate_emb_layer, user_behaviors_hidden_state])
-
-
 
 class GRU_gate_parameter(tf.keras.layers.Layer):
     def __init__(self,embedding_size=EMBEDDING_SIZE):
@@ -221,7 +101,7 @@ class GRU_gate_parameter(tf.keras.layers.Layer):
 
                                                                                                                                                                 
 class AUGRU(tf.keras.layers.Layer):
-    def __init__(self,embedding_size=EMBEDDING_SIZE,  time_length=5):
+    def __init__(self,embedding_size=EMBEDDING_SIZE,  time_length=len(RATED_MOVIES)):
         super().__init__()
         self.time_length = time_length
         self.embedding_size = embedding_size      
@@ -247,19 +127,9 @@ class AUGRU(tf.keras.layers.Layer):
 
         return AUGRU_hidden_state
 
-augru_emb=AUGRU()(  [ user_behaviors_hidden_state   ,attention_score  ]  )
-
-concat_layer = tf.keras.layers.concatenate([ augru_emb,  candidate_emb_layer,user_profile_layer,context_features_layer])
-
-output_layer = tf.keras.layers.Dense(128)(concat_layer)
-output_layer = tf.keras.layers.PReLU()(output_layer)
-output_layer = tf.keras.layers.Dense(64)(output_layer)
-output_layer = tf.keras.layers.PReLU()(output_layer)
-y_pred = tf.keras.layers.Dense(1, activation='sigmoid')(output_layer)
-
 
 class auxiliary_loss_layer(tf.keras.layers.Layer):
-    def __init__(self,time_length=5 ):
+    def __init__(self,time_length=len(RATED_MOVIES) ):
         super().__init__()
         self.time_len = time_length-1        
         self.Dense_sigmoid_positive32 =   tf.keras.layers.Dense(32,activation='sigmoid')
@@ -291,26 +161,62 @@ class auxiliary_loss_layer(tf.keras.layers.Layer):
         
         return  final_loss
 
-auxiliary_loss_value=auxiliary_loss_layer()(  [ negtive_movie_emb_layer,user_behaviors_emb_layer,user_behaviors_hidden_state,y_true,y_pred]  )
 
-model = tf.keras.Model(inputs=inputs, outputs=[y_pred,auxiliary_loss_value])
+def build_model(profile_features=profile_and_context):
+    """
+    deep interest evolution network: a GRU over the recent rated movies, an attentional update gate GRU (AUGRU)
+    driven by the candidate movie, and an auxiliary loss against sampled negative movies
+    the model takes the label as an input for the auxiliary loss, its outputs are (prediction, loss)
+    profile_features: inputs -> (user profile, context features), see DIN.build_model
+    """
+    # define input for keras model
+    inputs = sample_inputs(MOVIE_NUMERIC + USER_NUMERIC + ['movieId', 'userId'] + RATED_MOVIES + USER_GENRES +
+                           MOVIE_GENRES + ['label'])
+    inputs.update({name: tf.keras.layers.Input(name=name, shape=(), dtype='int32') for name in NEGATIVE_MOVIES})
+
+
+    # candidate movie, user behaviors and sampled negative movies as ids of the movie embedding table below
+    candidate_layer = stack_columns(inputs, ['movieId'])
+    user_behaviors_layer = stack_columns(inputs, RATED_MOVIES)
+    negtive_movie_layer = stack_columns(inputs, NEGATIVE_MOVIES)
+
+    # user profile and context features, the same as DIN's
+    user_profile_layer, context_features_layer = profile_features(inputs)
+
+    y_true = numeric_features(inputs, ['label'])
+
+    # Activation Unit
+    movie_emb_layer = tf.keras.layers.Embedding(input_dim=MOVIE_ID_BUCKETS,output_dim=EMBEDDING_SIZE,mask_zero=True)# mask zero
+
+    user_behaviors_emb_layer = movie_emb_layer(user_behaviors_layer) 
+    candidate_emb_layer = movie_emb_layer(candidate_layer) 
+    negtive_movie_emb_layer = movie_emb_layer(negtive_movie_layer) 
+
+    candidate_emb_layer = tf.squeeze(candidate_emb_layer,axis=1)
+
+    user_behaviors_hidden_state=tf.keras.layers.GRU(EMBEDDING_SIZE, return_sequences=True)(user_behaviors_emb_layer)
+
+    attention_score=attention()( [candidate_emb_layer, user_behaviors_hidden_state])
+
+    augru_emb=AUGRU()(  [ user_behaviors_hidden_state   ,attention_score  ]  )
 
-model.compile(optimizer="adam")
+    concat_layer = tf.keras.layers.concatenate([ augru_emb,  candidate_emb_layer,user_profile_layer,context_features_layer])
 
-# train the model
-model.fit(train_dataset, epochs=5)
+    output_layer = tf.keras.layers.Dense(128)(concat_layer)
+    output_layer = tf.keras.layers.PReLU()(output_layer)
+    output_layer = tf.keras.layers.Dense(64)(output_layer)
+    output_layer = tf.keras.layers.PReLU()(output_layer)
+    y_pred = tf.keras.layers.Dense(1, activation='sigmoid')(output_layer)
 
-# evaluate the model
-test_loss,  test_roc_auc = model.evaluate(test_dataset)
-print('\n\nTest Loss {},  Test ROC AUC {},'.format(test_loss, test_roc_auc))
+    auxiliary_loss_value=auxiliary_loss_layer()(  [ negtive_movie_emb_layer,user_behaviors_emb_layer,user_behaviors_hidden_state,y_true,y_pred]  )
 
+    model = tf.keras.Model(inputs=inputs, outputs=[y_pred,auxiliary_loss_value])
 
+    model.compile(optimizer="adam")
+    return model
 
-model.summary()
 
-# print some predict results
-predictions = model.predict(test_dataset)
-for prediction, goodRating in zip(predictions[0][:12], list(test_dataset)[0]):
-    print("Predicted good rating: {:.2%}".format(prediction[0]),
-          " | Actual rating label: ",
-          ("Good Rating" if bool(goodRating) else "Bad Rating"))
+if __name__ == '__main__':
+    # usage: DIEN.py [--train samples] [--test samples] [--epochs n] ..., see ModelZoo.py
+    from ModelZoo import main
+    main(['train', 'DIEN'] + sys.argv[1:])
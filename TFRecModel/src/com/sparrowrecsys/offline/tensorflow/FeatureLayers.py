@@ -0,0 +1,80 @@
+import tensorflow as tf
+from SampleDataset import FIELD_DTYPES, SAMPLE_SCHEMA_PATH, load_schema
+
+# the preprocessing layers moved out of experimental in tf 2.6
+try:
+    StringLookup = tf.keras.layers.StringLookup
+    Hashing = tf.keras.layers.Hashing
+except AttributeError:
+    StringLookup = tf.keras.layers.experimental.preprocessing.StringLookup
+    Hashing = tf.keras.layers.experimental.preprocessing.Hashing
+
+# genre features vocabulary
+GENRE_VOCAB = ['Film-Noir', 'Action', 'Adventure', 'Horror', 'Romance', 'War', 'Comedy', 'Western', 'Documentary',
+               'Sci-Fi', 'Drama', 'Thriller',
+               'Crime', 'Fantasy', 'Animation', 'IMAX', 'Mystery', 'Children', 'Musical']
+USER_GENRES = ['userGenre1', 'userGenre2', 'userGenre3', 'userGenre4', 'userGenre5']
+MOVIE_GENRES = ['movieGenre1', 'movieGenre2', 'movieGenre3']
+RATED_MOVIES = ['userRatedMovie1', 'userRatedMovie2', 'userRatedMovie3', 'userRatedMovie4', 'userRatedMovie5']
+MOVIE_NUMERIC = ['releaseYear', 'movieRatingCount', 'movieAvgRating', 'movieRatingStddev']
+USER_NUMERIC = ['userRatingCount', 'userAvgRating', 'userRatingStddev']
+
+# movie and user ids are used as embedding indexes directly, like categorical_column_with_identity
+MOVIE_ID_BUCKETS = 1001
+USER_ID_BUCKETS = 30001
+# genre lookup indexes: 0 for the empty string of a missing genre, 1 for unknown genres, then GENRE_VOCAB
+GENRE_BUCKETS = len(GENRE_VOCAB) + 2
+FIRST_GENRE_INDEX = 2
+# embedding dimension of the movie, user and genre tables of the attention models
+EMBEDDING_SIZE = 10
+
+
+def sample_inputs(names, schema_path=SAMPLE_SCHEMA_PATH):
+    # keras inputs of sample columns with the dtypes get_dataset yields for the samples of that _schema.json
+    field_types = dict(load_schema(schema_path)[0])
+    return {name: tf.keras.layers.Input(name=name, shape=(), dtype=FIELD_DTYPES[field_types[name]]) for name in names}
+
+
+def genre_lookup():
+    # one string -> index table for every genre column, mask_token is set so all tf versions use the same layout
+    return StringLookup(vocabulary=GENRE_VOCAB, mask_token='', num_oov_indices=1)
+
+
+def stack_columns(inputs, names, dtype=None):
+    # [batch, len(names)] tensor of scalar input columns
+    columns = [inputs[name] if dtype is None else tf.cast(inputs[name], dtype) for name in names]
+    return tf.stack(columns, axis=1)
+
+
+def numeric_features(inputs, names):
+    # numeric_column: every column as one float32 dimension
+    return stack_columns(inputs, names, tf.float32)
+
+
+def pooled_embedding(ids, embedding, min_id=0):
+    """
+    mean of the embeddings of the ids >= min_id in every row of a [batch, n] id tensor, rows without such an id
+    give a zero vector, the combiner='mean' of embedding_column that skipped missing and unknown values
+    a single column is the n=1 case, so one embedding layer serves single and multi valued fields
+    """
+    vectors = embedding(ids)
+    weights = tf.expand_dims(tf.cast(ids >= min_id, vectors.dtype), -1)
+    return tf.reduce_sum(vectors * weights, axis=1) / tf.maximum(tf.reduce_sum(weights, axis=1), 1.0)
+
+
+def genre_embedding(inputs, names, lookup, embedding):
+    # genre columns pooled into one vector by a single lookup over all of them
+    return pooled_embedding(lookup(stack_columns(inputs, names)), embedding, FIRST_GENRE_INDEX)
+
+
+def crossed_ids(inputs, names, num_bins):
+    # hashed cross of id columns, the bucket of crossed_column([...], num_bins)
+    keys = tf.strings.join([tf.strings.as_string(inputs[name]) for name in names], separator='_')
+    return Hashing(num_bins=num_bins)(keys)
+
+
+def first_order_weight(ids, embedding, min_id=0):
+    # one learned weight per id summed over the [batch, n] ids, what a dense unit on an indicator_column computes
+    # without building the one-hot vector, ids below min_id have no weight
+    weights = tf.squeeze(embedding(ids), axis=-1) * tf.cast(ids >= min_id, tf.float32)
+    return tf.reduce_sum(weights, axis=1, keepdims=True)
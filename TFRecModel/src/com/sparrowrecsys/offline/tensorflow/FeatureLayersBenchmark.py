@@ -0,0 +1,198 @@
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+import DIEN
+import DIN
+from DeepFM_v2 import ReduceLayer
+from NeuralCF import neural_cf_model_1
+from ModelZoo import MODEL_NAMES, SAMPLE_DATA_DIR, build_model, load_dataset, evaluate_model, check_samples
+from FeatureLayers import sample_inputs, GENRE_VOCAB, MOVIE_ID_BUCKETS, USER_ID_BUCKETS, EMBEDDING_SIZE, \
+    USER_GENRES, MOVIE_GENRES, MOVIE_NUMERIC, USER_NUMERIC
+
+# the feature_column / DenseFeatures versions of the model scripts before FeatureLayers, the architectures on top
+# of the features are the same as the build_model() of every model script
+
+
+def compile_model(model):
+    model.compile(
+        loss='binary_crossentropy',
+        optimizer='adam',
+        metrics=['accuracy', tf.keras.metrics.AUC(curve='ROC'), tf.keras.metrics.AUC(curve='PR')])
+    return model
+
+
+def id_column(name, num_buckets):
+    return tf.feature_column.categorical_column_with_identity(key=name, num_buckets=num_buckets)
+
+
+def genre_column(name):
+    return tf.feature_column.categorical_column_with_vocabulary_list(key=name, vocabulary_list=GENRE_VOCAB)
+
+
+def numeric_columns(names):
+    return [tf.feature_column.numeric_column(name) for name in names]
+
+
+def deep_columns():
+    # numeric features, one embedding per genre column and the movie and user id embeddings
+    return numeric_columns(MOVIE_NUMERIC + USER_NUMERIC) + \
+        [tf.feature_column.embedding_column(genre_column(name), 10) for name in USER_GENRES + MOVIE_GENRES] + \
+        [tf.feature_column.embedding_column(id_column('movieId', MOVIE_ID_BUCKETS), 10),
+         tf.feature_column.embedding_column(id_column('userId', USER_ID_BUCKETS), 10)]
+
+
+def legacy_embedding_mlp():
+    inputs = sample_inputs(MOVIE_NUMERIC + USER_NUMERIC + ['movieId', 'userId'] + USER_GENRES + MOVIE_GENRES)
+    deep = tf.keras.layers.DenseFeatures(deep_columns())(inputs)
+    deep = tf.keras.layers.Dense(128, activation='relu')(deep)
+    deep = tf.keras.layers.Dense(128, activation='relu')(deep)
+    return compile_model(tf.keras.Model(inputs, tf.keras.layers.Dense(1, activation='sigmoid')(deep)))
+
+
+def legacy_wide_n_deep():
+    inputs = sample_inputs(MOVIE_NUMERIC + USER_NUMERIC + ['movieId', 'userId', 'userRatedMovie1'] + USER_GENRES +
+                           MOVIE_GENRES)
+    crossed = tf.feature_column.crossed_column([id_column('movieId', MOVIE_ID_BUCKETS),
+                                                id_column('userRatedMovie1', MOVIE_ID_BUCKETS)], 10000)
+    deep = tf.keras.layers.DenseFeatures(deep_columns())(inputs)
+    deep = tf.keras.layers.Dense(128, activation='relu')(deep)
+    deep = tf.keras.layers.Dense(128, activation='relu')(deep)
+    wide = tf.keras.layers.DenseFeatures(tf.feature_column.indicator_column(crossed))(inputs)
+    both = tf.keras.layers.concatenate([deep, wide])
+    return compile_model(tf.keras.Model(inputs, tf.keras.layers.Dense(1, activation='sigmoid')(both)))
+
+
+def legacy_neural_cf():
+    inputs = sample_inputs(['movieId', 'userId'])
+    movie_emb = tf.keras.layers.DenseFeatures(
+        [tf.feature_column.embedding_column(id_column('movieId', MOVIE_ID_BUCKETS), 10)])(inputs)
+    user_emb = tf.keras.layers.DenseFeatures(
+        [tf.feature_column.embedding_column(id_column('userId', USER_ID_BUCKETS), 10)])(inputs)
+    return compile_model(neural_cf_model_1(inputs, movie_emb, user_emb, [10, 10]))
+
+
+def fm_columns():
+    # (id and genre categorical columns, their embedding columns) of the DeepFM models
+    columns = [id_column('movieId', MOVIE_ID_BUCKETS), id_column('userId', USER_ID_BUCKETS),
+               genre_column('userGenre1'), genre_column('movieGenre1')]
+    return columns, [tf.feature_column.embedding_column(column, 10) for column in columns]
+
+
+def legacy_deep_fm():
+    inputs = sample_inputs(MOVIE_NUMERIC + USER_NUMERIC + ['movieId', 'userId', 'userRatedMovie1'] + USER_GENRES +
+                           MOVIE_GENRES)
+    columns, (movie_emb_col, user_emb_col, user_genre_emb_col, item_genre_emb_col) = fm_columns()
+    item_emb, user_emb, item_genre_emb, user_genre_emb = [
+        tf.keras.layers.DenseFeatures([column])(inputs)
+        for column in [movie_emb_col, user_emb_col, item_genre_emb_col, user_genre_emb_col]]
+    fm_first_order = tf.keras.layers.DenseFeatures(
+        [tf.feature_column.indicator_column(column) for column in columns])(inputs)
+    products = [tf.keras.layers.Dot(axes=1)([item_emb, user_emb]),
+                tf.keras.layers.Dot(axes=1)([item_genre_emb, user_genre_emb]),
+                tf.keras.layers.Dot(axes=1)([item_genre_emb, user_emb]),
+                tf.keras.layers.Dot(axes=1)([item_emb, user_genre_emb])]
+    deep = tf.keras.layers.DenseFeatures(numeric_columns(MOVIE_NUMERIC + USER_NUMERIC) +
+                                         [movie_emb_col, user_emb_col])(inputs)
+    deep = tf.keras.layers.Dense(64, activation='relu')(deep)
+    deep = tf.keras.layers.Dense(64, activation='relu')(deep)
+    concat_layer = tf.keras.layers.concatenate([fm_first_order] + products + [deep], axis=1)
+    return compile_model(tf.keras.Model(inputs, tf.keras.layers.Dense(1, activation='sigmoid')(concat_layer)))
+
+
+def legacy_deep_fm_v2():
+    inputs = sample_inputs(MOVIE_NUMERIC + USER_NUMERIC + ['movieId', 'userId', 'userRatedMovie1'] + USER_GENRES +
+                           MOVIE_GENRES)
+    columns, (movie_emb_col, user_emb_col, user_genre_emb_col, item_genre_emb_col) = fm_columns()
+    numeric = numeric_columns(MOVIE_NUMERIC + USER_NUMERIC)
+    first_order_cat = tf.keras.layers.Dense(1)(tf.keras.layers.DenseFeatures(
+        [tf.feature_column.indicator_column(column) for column in columns])(inputs))
+    first_order_deep = tf.keras.layers.Dense(1)(tf.keras.layers.DenseFeatures(numeric)(inputs))
+    first_order = tf.keras.layers.Add()([first_order_cat, first_order_deep])
+    second_order = [tf.keras.layers.Reshape((-1, 64))(tf.keras.layers.Dense(64)(
+        tf.keras.layers.DenseFeatures([column])(inputs)))
+        for column in [item_genre_emb_col, movie_emb_col, user_genre_emb_col, user_emb_col]]
+    second_order.append(tf.keras.layers.Reshape((-1, 64))(tf.keras.layers.Dense(64)(
+        tf.keras.layers.DenseFeatures(numeric)(inputs))))
+    second_order_fm = tf.keras.layers.Concatenate(axis=1)(second_order)
+    deep = tf.keras.layers.Flatten()(second_order_fm)
+    deep = tf.keras.layers.Dense(32, activation='relu')(deep)
+    deep = tf.keras.layers.Dense(16, activation='relu')(deep)
+    sum_square = tf.keras.layers.multiply([ReduceLayer(1)(second_order_fm), ReduceLayer(1)(second_order_fm)])
+    square_sum = ReduceLayer(1)(tf.keras.layers.multiply([second_order_fm, second_order_fm]))
+    fm = tf.keras.layers.subtract([sum_square, square_sum])
+    concatenated = tf.keras.layers.Concatenate(axis=1)([first_order, fm, deep])
+    return compile_model(tf.keras.Model(inputs, tf.keras.layers.Dense(1, activation='sigmoid')(concatenated)))
+
+
+def legacy_profile_and_context(inputs):
+    # the DenseFeatures user profile and context of DIN and DIEN, one embedding table per genre column
+    user_profile = [tf.feature_column.embedding_column(id_column('userId', USER_ID_BUCKETS), EMBEDDING_SIZE),
+                    tf.feature_column.embedding_column(genre_column('userGenre1'), EMBEDDING_SIZE)] + \
+        numeric_columns(USER_NUMERIC)
+    context = [tf.feature_column.embedding_column(genre_column('movieGenre1'), EMBEDDING_SIZE)] + \
+        numeric_columns(MOVIE_NUMERIC)
+    return tf.keras.layers.DenseFeatures(user_profile)(inputs), tf.keras.layers.DenseFeatures(context)(inputs)
+
+
+LEGACY_BUILDERS = {
+    'EmbeddingMLP': legacy_embedding_mlp,
+    'WideNDeep': legacy_wide_n_deep,
+    'NeuralCF': legacy_neural_cf,
+    'DeepFM': legacy_deep_fm,
+    'DeepFM_v2': legacy_deep_fm_v2,
+    'DIN': lambda: DIN.build_model(profile_features=legacy_profile_and_context),
+    'DIEN': lambda: DIEN.build_model(profile_features=legacy_profile_and_context),
+}
+
+
+class StepTimer(tf.keras.callbacks.Callback):
+    def __init__(self):
+        super().__init__()
+        self.step_times = []
+        self.start = None
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.start = time.time()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.step_times.append(time.time() - self.start)
+
+
+def test_auc(metrics):
+    # the ROC AUC of a compiled model, DIEN reports its own auc_value
+    return next(value for metric, value in metrics.items() if 'auc' in metric)
+
+
+def benchmark_feature_layers(train_path, test_path, batch_size=12, epochs=2, model_names=MODEL_NAMES, seed=2020):
+    """
+    median train step time and test roc auc of every ModelZoo model, the shipped build_model() on FeatureLayers
+    against the same architecture on feature_column / DenseFeatures, trained on the same ModelZoo datasets
+    """
+    print("{:<14s} {:<22s} {:>10s} {:>10s} {:>10s}".format('model', 'features', 'ms/step', 'speedup', 'test auc'))
+    for name in model_names:
+        train_dataset = load_dataset(name, train_path, batch_size, training=True)
+        test_dataset = load_dataset(name, test_path, batch_size, training=False)
+        baseline = None
+        for features_name, build in [('feature_column', LEGACY_BUILDERS[name]),
+                                     ('preprocessing layers', lambda: build_model(name))]:
+            tf.random.set_seed(seed)
+            model = build()
+            timer = StepTimer()
+            model.fit(train_dataset, epochs=epochs, callbacks=[timer], verbose=0)
+            # the first steps include tracing and are left out of the median
+            step_time = float(np.median(timer.step_times[10:] or timer.step_times))
+            baseline = baseline or step_time
+            auc = test_auc(evaluate_model(model, test_dataset))
+            print("{:<14s} {:<22s} {:10.3f} {:10.2f} {:10.4f}".format(name, features_name, step_time * 1000,
+                                                                     baseline / step_time, auc))
+
+
+if __name__ == '__main__':
+    # usage: FeatureLayersBenchmark.py [training samples] [test samples] [batch size] [epochs]
+    train_path = sys.argv[1] if len(sys.argv) > 1 else SAMPLE_DATA_DIR + '/trainingSamples'
+    test_path = sys.argv[2] if len(sys.argv) > 2 else SAMPLE_DATA_DIR + '/testSamples'
+    check_samples(train_path, 'argument 1')
+    check_samples(test_path, 'argument 2')
+    benchmark_feature_layers(train_path, test_path, int(sys.argv[3]) if len(sys.argv) > 3 else 12,
+                             int(sys.argv[4]) if len(sys.argv) > 4 else 2)
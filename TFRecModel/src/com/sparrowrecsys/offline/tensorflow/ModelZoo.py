@@ -0,0 +1,201 @@
+import argparse
+import importlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# repository webroot, the default sample input and model output of every model
+WEBROOT_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../../../../..',
+                                            'src/main/resources/webroot'))
+SAMPLE_DATA_DIR = WEBROOT_DIR + '/sampledata'
+MODEL_DATA_DIR = WEBROOT_DIR + '/modeldata'
+
+# every model script of this directory exposes build_model(), the modules are only imported when a model is built,
+# so tensorflow is not loaded before the command line is parsed
+MODEL_NAMES = ['EmbeddingMLP', 'WideNDeep', 'DeepFM', 'DeepFM_v2', 'NeuralCF', 'DIN', 'DIEN']
+LATENCY_BATCH_SIZES = '1,16,128,1024'
+
+
+def model_module(name):
+    if name not in MODEL_NAMES:
+        raise ValueError("unknown model: {}, one of {}".format(name, ', '.join(MODEL_NAMES)))
+    return importlib.import_module(name)
+
+
+def build_model(name, **kwargs):
+    # a new compiled keras model of the named architecture
+    return model_module(name).build_model(**kwargs)
+
+
+def load_dataset(name, file_path, batch_size=12, training=True):
+    # the shared SampleDataset pipeline unless the model script brings its own, like DIEN's negative sampling
+    module = model_module(name)
+    if hasattr(module, 'load_dataset'):
+        return module.load_dataset(file_path, batch_size, training)
+    from SampleDataset import get_dataset
+    return get_dataset(file_path, batch_size, shuffle_buffer_size=10000 if training else 0)
+
+
+def check_samples(file_path, option):
+    # fail with the option to fix instead of a tf.data error deep in the first epoch
+    from SampleDataset import sample_files
+    try:
+        sample_files(file_path)
+    except ValueError:
+        raise SystemExit("no samples at {}, write them with FeatureEngForRecModel or pass another path as {}"
+                         .format(file_path, option))
+
+
+def split_batch(batch):
+    # (features, labels) of a batch, datasets without a separate label carry it as the 'label' feature
+    if isinstance(batch, tuple):
+        return batch[0], batch[1]
+    return batch, batch['label']
+
+
+def batch_length(batch):
+    features, _ = split_batch(batch)
+    return int(next(iter(features.values())).shape[0])
+
+
+def train_model(model, train_dataset, epochs):
+    """
+    fit the model and return its training samples/sec over all epochs
+    the dataset is read once before the clock starts, so the cached pipelines measure the model, not csv parsing
+    """
+    samples = sum(batch_length(batch) for batch in train_dataset)
+    start = time.time()
+    model.fit(train_dataset, epochs=epochs)
+    return samples * epochs / (time.time() - start)
+
+
+def evaluate_model(model, test_dataset):
+    results = model.evaluate(test_dataset)
+    results = results if isinstance(results, list) else [results]
+    return dict(zip(model.metrics_names, results))
+
+
+def predict_latency(model, test_dataset, batch_sizes, repeats=100):
+    """
+    p50 / p99 milliseconds of one forward pass per batch size, through a tf.function like a serving signature
+    return: [(batch size, p50, p99)]
+    """
+    import numpy as np
+    import tensorflow as tf
+    serve = tf.function(lambda features: model(features, training=False))
+    latencies = []
+    for batch_size in batch_sizes:
+        features, _ = split_batch(next(iter(test_dataset.unbatch().batch(batch_size))))
+        for _ in range(5):
+            serve(features)
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            serve(features)
+            times.append(time.perf_counter() - start)
+        latencies.append((batch_size, float(np.percentile(times, 50)) * 1000, float(np.percentile(times, 99)) * 1000))
+    return latencies
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(directory, file_name))
+               for directory, _, file_names in os.walk(path) for file_name in file_names)
+
+
+def saved_model_size(model, export_path=None):
+    # bytes of the SavedModel directory, exported to export_path or to a temporary directory that is removed
+    import tensorflow as tf
+    path = export_path or tempfile.mkdtemp()
+    tf.keras.models.save_model(model, path, overwrite=True, include_optimizer=True)
+    size = directory_size(path)
+    if export_path is None:
+        shutil.rmtree(path)
+    return size
+
+
+def print_predictions(model, test_dataset, count=12):
+    # print some predict results
+    features, labels = split_batch(next(iter(test_dataset)))
+    predictions = model.predict_on_batch(features)
+    predictions = predictions[0] if isinstance(predictions, list) else predictions
+    for prediction, goodRating in zip(predictions[:count], labels[:count]):
+        print("Predicted good rating: {:.2%}".format(float(prediction[0])),
+              " | Actual rating label: ",
+              ("Good Rating" if bool(goodRating) else "Bad Rating"))
+
+
+def print_report(name, report):
+    print('\n\n{} parameters {:,d}, SavedModel {:.2f} MB'.format(name, report['parameters'],
+                                                                 report['savedModelBytes'] / 1024 / 1024))
+    if 'trainSamplesPerSecond' in report:
+        print('training {:.0f} samples/s'.format(report['trainSamplesPerSecond']))
+    print('test ' + ', '.join('{} {:.4f}'.format(metric, value) for metric, value in report['metrics'].items()))
+    for batch_size, p50, p99 in report['latency']:
+        print('predict batch {:5d}: p50 {:8.3f} ms, p99 {:8.3f} ms'.format(batch_size, p50, p99))
+
+
+def run_train(name, args):
+    model = build_model(name)
+    train_dataset = load_dataset(name, args.train, args.batch_size, training=True)
+    test_dataset = load_dataset(name, args.test, args.batch_size, training=False)
+    report = {'trainSamplesPerSecond': train_model(model, train_dataset, args.epochs),
+              'metrics': evaluate_model(model, test_dataset)}
+    print_predictions(model, test_dataset)
+    export_path = args.export + '/' + name if args.export and args.model == 'all' else args.export
+    report['parameters'] = model.count_params()
+    report['savedModelBytes'] = saved_model_size(model, export_path)
+    report['latency'] = predict_latency(model, test_dataset, args.latency_batch_sizes)
+    return report
+
+
+def run_evaluate(name, args):
+    import tensorflow as tf
+    model = tf.keras.models.load_model(args.model_path)
+    test_dataset = load_dataset(name, args.test, args.batch_size, training=False)
+    return {'metrics': evaluate_model(model, test_dataset), 'parameters': model.count_params(),
+            'savedModelBytes': directory_size(args.model_path),
+            'latency': predict_latency(model, test_dataset, args.latency_batch_sizes)}
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='train, evaluate and benchmark the SparrowRecSys tensorflow models')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    commands.add_parser('list', help='list the models')
+    for command in ['train', 'evaluate']:
+        subparser = commands.add_parser(command, help=command + ' a model')
+        subparser.add_argument('model', choices=MODEL_NAMES + (['all'] if command == 'train' else []))
+        subparser.add_argument('--test', default=SAMPLE_DATA_DIR + '/testSamples',
+                               help='test samples, a csv file, a csv glob or a csv / tfrecord sample directory')
+        subparser.add_argument('--batch-size', type=int, default=12)
+        subparser.add_argument('--latency-batch-sizes', default=LATENCY_BATCH_SIZES,
+                               type=lambda value: [int(size) for size in value.split(',')])
+    train_parser = commands.choices['train']
+    train_parser.add_argument('--train', default=SAMPLE_DATA_DIR + '/trainingSamples',
+                              help='training samples, a csv file, a csv glob or a csv / tfrecord sample directory')
+    train_parser.add_argument('--epochs', type=int, default=5)
+    train_parser.add_argument('--export', help='SavedModel directory, one sub directory per model for all')
+    commands.choices['evaluate'].add_argument('--model-path', required=True, help='SavedModel directory')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    if args.command == 'list':
+        print('\n'.join(MODEL_NAMES))
+        return
+    if args.command == 'train':
+        check_samples(args.train, '--train')
+    check_samples(args.test, '--test')
+    names = MODEL_NAMES if args.model == 'all' else [args.model]
+    reports = [(name, run_train(name, args) if args.command == 'train' else run_evaluate(name, args))
+               for name in names]
+    for name, report in reports:
+        print_report(name, report)
+
+
+if __name__ == '__main__':
+    # usage: ModelZoo.py list | train <model|all> [options] | evaluate <model> --model-path <dir> [options]
+    main(sys.argv[1:])
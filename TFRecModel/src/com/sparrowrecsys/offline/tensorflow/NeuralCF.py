@@ -1,51 +1,11 @@
+import sys
 import tensorflow as tf
-
-# Training samples path, change to your local path
-training_samples_file_path = tf.keras.utils.get_file("trainingSamples.csv",
-                                                     "file:///Users/zhewang/Workspace/SparrowRecSys/src/main"
-                                                     "/resources/webroot/sampledata/trainingSamples.csv")
-# Test samples path, change to your local path
-test_samples_file_path = tf.keras.utils.get_file("testSamples.csv",
-                                                 "file:///Users/zhewang/Workspace/SparrowRecSys/src/main"
-                                                 "/resources/webroot/sampledata/testSamples.csv")
-
-
-# load sample as tf dataset
-def get_dataset(file_path):
-    dataset = tf.data.experimental.make_csv_dataset(
-        file_path,
-        batch_size=12,
-        label_name='label',
-        na_value="0",
-        num_epochs=1,
-        ignore_errors=True)
-    return dataset
-
-
-# split as test dataset and training dataset
-train_dataset = get_dataset(training_samples_file_path)
-test_dataset = get_dataset(test_samples_file_path)
-
-# movie id embedding feature
-movie_col = tf.feature_column.categorical_column_with_identity(key='movieId', num_buckets=1001)
-movie_emb_col = tf.feature_column.embedding_column(movie_col, 10)
-
-# user id embedding feature
-user_col = tf.feature_column.categorical_column_with_identity(key='userId', num_buckets=30001)
-user_emb_col = tf.feature_column.embedding_column(user_col, 10)
-
-# define input for keras model
-inputs = {
-    'movieId': tf.keras.layers.Input(name='movieId', shape=(), dtype='int32'),
-    'userId': tf.keras.layers.Input(name='userId', shape=(), dtype='int32'),
-}
+from FeatureLayers import MOVIE_ID_BUCKETS, USER_ID_BUCKETS
 
 
 # neural cf model arch two. only embedding in each tower, then MLP as the interaction layers
-def neural_cf_model_1(feature_inputs, item_feature_columns, user_feature_columns, hidden_units):
-    item_tower = tf.keras.layers.DenseFeatures(item_feature_columns)(feature_inputs)
-    user_tower = tf.keras.layers.DenseFeatures(user_feature_columns)(feature_inputs)
-    interact_layer = tf.keras.layers.concatenate([item_tower, user_tower])
+def neural_cf_model_1(feature_inputs, item_embedding, user_embedding, hidden_units):
+    interact_layer = tf.keras.layers.concatenate([item_embedding, user_embedding])
     for num_nodes in hidden_units:
         interact_layer = tf.keras.layers.Dense(num_nodes, activation='relu')(interact_layer)
     output_layer = tf.keras.layers.Dense(1, activation='sigmoid')(interact_layer)
@@ -54,12 +14,12 @@ def neural_cf_model_1(feature_inputs, item_feature_columns, user_feature_columns
 
 
 # neural cf model arch one. embedding+MLP in each tower, then dot product layer as the output
-def neural_cf_model_2(feature_inputs, item_feature_columns, user_feature_columns, hidden_units):
-    item_tower = tf.keras.layers.DenseFeatures(item_feature_columns)(feature_inputs)
+def neural_cf_model_2(feature_inputs, item_embedding, user_embedding, hidden_units):
+    item_tower = item_embedding
     for num_nodes in hidden_units:
         item_tower = tf.keras.layers.Dense(num_nodes, activation='relu')(item_tower)
 
-    user_tower = tf.keras.layers.DenseFeatures(user_feature_columns)(feature_inputs)
+    user_tower = user_embedding
     for num_nodes in hidden_units:
         user_tower = tf.keras.layers.Dense(num_nodes, activation='relu')(user_tower)
 
@@ -70,36 +30,37 @@ def neural_cf_model_2(feature_inputs, item_feature_columns, user_feature_columns
     return neural_cf_model
 
 
-# neural cf model architecture
-model = neural_cf_model_1(inputs, [movie_emb_col], [user_emb_col], [10, 10])
-
-# compile the model, set loss function, optimizer and evaluation metrics
-model.compile(
-    loss='binary_crossentropy',
-    optimizer='adam',
-    metrics=['accuracy', tf.keras.metrics.AUC(curve='ROC'), tf.keras.metrics.AUC(curve='PR')])
-
-# train the model
-model.fit(train_dataset, epochs=5)
-
-# evaluate the model
-test_loss, test_accuracy, test_roc_auc, test_pr_auc = model.evaluate(test_dataset)
-print('\n\nTest Loss {}, Test Accuracy {}, Test ROC AUC {}, Test PR AUC {}'.format(test_loss, test_accuracy,
-                                                                                   test_roc_auc, test_pr_auc))
-
-# print some predict results
-predictions = model.predict(test_dataset)
-for prediction, goodRating in zip(predictions[:12], list(test_dataset)[0][1][:12]):
-    print("Predicted good rating: {:.2%}".format(prediction[0]),
-          " | Actual rating label: ",
-          ("Good Rating" if bool(goodRating) else "Bad Rating"))
-
-tf.keras.models.save_model(
-    model,
-    "file:///Users/zhewang/Workspace/SparrowRecSys/src/main/resources/webroot/modeldata/neuralcf/002",
-    overwrite=True,
-    include_optimizer=True,
-    save_format=None,
-    signatures=None,
-    options=None
-)
+def build_model(arch=1, hidden_units=(10, 10)):
+    """
+    neural cf over movie id and user id embeddings, arch 1 interacts them with an MLP, arch 2 with a dot product
+    of two MLP towers
+    """
+    # define input for keras model
+    inputs = {
+        'movieId': tf.keras.layers.Input(name='movieId', shape=(), dtype='int32'),
+        'userId': tf.keras.layers.Input(name='userId', shape=(), dtype='int32'),
+    }
+
+    # movie id embedding feature
+    movie_emb = tf.keras.layers.Embedding(MOVIE_ID_BUCKETS, 10)(inputs['movieId'])
+
+    # user id embedding feature
+    user_emb = tf.keras.layers.Embedding(USER_ID_BUCKETS, 10)(inputs['userId'])
+
+    # neural cf model architecture
+    neural_cf_model = neural_cf_model_1 if arch == 1 else neural_cf_model_2
+    model = neural_cf_model(inputs, movie_emb, user_emb, list(hidden_units))
+
+    # compile the model, set loss function, optimizer and evaluation metrics
+    model.compile(
+        loss='binary_crossentropy',
+        optimizer='adam',
+        metrics=['accuracy', tf.keras.metrics.AUC(curve='ROC'), tf.keras.metrics.AUC(curve='PR')])
+    return model
+
+
+if __name__ == '__main__':
+    # usage: NeuralCF.py [--train samples] [--test samples] [--epochs n] ..., see ModelZoo.py
+    # the trained model is exported to the modeldata directory the online neural cf service loads by default
+    from ModelZoo import main, MODEL_DATA_DIR
+    main(['train', 'NeuralCF', '--export', MODEL_DATA_DIR + '/neuralcf/002'] + sys.argv[1:])
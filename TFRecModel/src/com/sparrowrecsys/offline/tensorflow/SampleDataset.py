@@ -0,0 +1,168 @@
+import json
+import os
+import sys
+import tensorflow as tf
+from ModelZoo import SAMPLE_DATA_DIR
+
+AUTOTUNE = tf.data.experimental.AUTOTUNE
+
+# SampleOutput of the spark FeatureEngForRecModel job writes the (name, type) sample fields as _schema.json next to
+# every csv, parquet and tfrecord output, the schema of the sample data shipped in the webroot is the default
+SCHEMA_FILE = '_schema.json'
+SAMPLE_SCHEMA_PATH = SAMPLE_DATA_DIR + '/' + SCHEMA_FILE
+# missing values of the csv files and the tfrecord shards, the na_value="0" fallback of the old get_dataset
+MISSING_VALUES = {'int': 0, 'float': 0.0, 'string': ''}
+# batches carry the dtypes make_csv_dataset inferred, so the int32 keras inputs of the models stay unchanged
+FIELD_DTYPES = {'int': tf.int32, 'float': tf.float32, 'string': tf.string}
+
+
+def load_schema(schema_path=SAMPLE_SCHEMA_PATH):
+    # ([(name, type)], compression) of a _schema.json file
+    with tf.io.gfile.GFile(schema_path) as f:
+        schema = json.loads(f.read())
+    return [tuple(field) for field in schema['fields']], schema['compression']
+
+
+def sample_files(file_pattern):
+    """
+    (format, files) of a csv file, a glob of csv files or a sample directory written by saveSamples /
+    csv_to_tfrecord, a directory holds either part-xxxxx.tfrecord[.gz] shards or spark's part-xxxxx.csv files
+    """
+    if tf.io.gfile.isdir(file_pattern):
+        files = sorted(tf.io.gfile.glob(file_pattern + '/part-*'))
+        sample_format = 'tfrecord' if files and '.tfrecord' in files[0] else 'csv'
+    else:
+        files = sorted(tf.io.gfile.glob(file_pattern))
+        sample_format = 'csv'
+    if not files:
+        raise ValueError("no sample files match " + file_pattern)
+    return sample_format, files
+
+
+def sample_schema(files):
+    # the _schema.json next to the sample files, csv files without one use the schema of the shipped sample data
+    schema_path = os.path.dirname(files[0]) + '/' + SCHEMA_FILE
+    return load_schema(schema_path if tf.io.gfile.exists(schema_path) else SAMPLE_SCHEMA_PATH)
+
+
+def csv_fields(csv_file, schema_fields):
+    # (name, type) of every column in the header, columns unknown to the schema are read as strings
+    with tf.io.gfile.GFile(csv_file) as f:
+        header = f.readline().strip().split(',')
+    field_types = dict(schema_fields)
+    return [(name, field_types.get(name, 'string')) for name in header]
+
+
+def csv_batches(files, fields, batch_size, num_parallel_reads):
+    # lines of all files interleaved, each batch of lines is parsed by one vectorized decode_csv call
+    record_defaults = [tf.constant(MISSING_VALUES[field_type], dtype=FIELD_DTYPES[field_type])
+                       for _, field_type in fields]
+    names = [name for name, _ in fields]
+
+    def parse(lines):
+        return dict(zip(names, tf.io.decode_csv(lines, record_defaults)))
+
+    lines = tf.data.Dataset.from_tensor_slices(files).interleave(
+        lambda csv_file: tf.data.TextLineDataset(csv_file).skip(1),
+        cycle_length=num_parallel_reads, num_parallel_calls=AUTOTUNE)
+    # a malformed line fails its whole batch, which is skipped like ignore_errors=True of make_csv_dataset
+    return lines.batch(batch_size).map(parse, num_parallel_calls=AUTOTUNE) \
+        .apply(tf.data.experimental.ignore_errors())
+
+
+def tfrecord_batches(files, fields, compression, batch_size, num_parallel_reads):
+    description = {name: tf.io.FixedLenFeature([], tf.int64 if field_type == 'int' else FIELD_DTYPES[field_type],
+                                               default_value=MISSING_VALUES[field_type])
+                   for name, field_type in fields}
+
+    def parse(examples):
+        features = tf.io.parse_example(examples, description)
+        return {name: tf.cast(value, tf.int32) if value.dtype == tf.int64 else value
+                for name, value in features.items()}
+
+    records = tf.data.Dataset.from_tensor_slices(files).interleave(
+        lambda shard: tf.data.TFRecordDataset(shard, compression_type=compression),
+        cycle_length=num_parallel_reads, num_parallel_calls=AUTOTUNE)
+    return records.batch(batch_size).map(parse, num_parallel_calls=AUTOTUNE)
+
+
+def parsed_batches(file_pattern, batch_size=12, num_parallel_reads=4):
+    # (dataset of parsed feature dict batches, fields) of a csv or tfrecord sample path, label still included
+    sample_format, files = sample_files(file_pattern)
+    fields, compression = sample_schema(files)
+    if sample_format == 'tfrecord':
+        return tfrecord_batches(files, fields, compression, batch_size, num_parallel_reads), fields
+    fields = csv_fields(files[0], fields)
+    return csv_batches(files, fields, batch_size, num_parallel_reads), fields
+
+
+# load sample as tf dataset
+def get_dataset(file_pattern, batch_size=12, label_name='label', shuffle_buffer_size=10000, cache=True,
+                cache_path='', num_parallel_reads=4, seed=None):
+    """
+    (features dict, label) batches of the samples at file_pattern, the shape make_csv_dataset produced
+    files are read in parallel and parsed a batch at a time, the parsed batches are cached so later epochs skip
+    the text or proto decoding (cache_path='' keeps them in memory, a file path caches them on disk)
+    the cached rows are reshuffled every epoch like make_csv_dataset did by default, evaluation datasets pass
+    shuffle_buffer_size=0 to keep the file order
+    """
+    dataset, _ = parsed_batches(file_pattern, batch_size, num_parallel_reads)
+    if cache:
+        dataset = dataset.cache(cache_path)
+    if shuffle_buffer_size:
+        dataset = dataset.unbatch().shuffle(shuffle_buffer_size, seed=seed).batch(batch_size)
+
+    def split_label(features):
+        features = dict(features)
+        label = features.pop(label_name)
+        return features, label
+
+    return dataset.map(split_label, num_parallel_calls=AUTOTUNE).prefetch(AUTOTUNE)
+
+
+def encode_example(fields, row):
+    # the tf.train.Example encoding of SampleOutput.encodeExample, ints as int64, floats as float, strings as bytes
+    features = {}
+    for name, field_type in fields:
+        value = row[name]
+        if field_type == 'int':
+            features[name] = tf.train.Feature(int64_list=tf.train.Int64List(value=[int(value)]))
+        elif field_type == 'float':
+            features[name] = tf.train.Feature(float_list=tf.train.FloatList(value=[float(value)]))
+        else:
+            features[name] = tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
+    return tf.train.Example(features=tf.train.Features(feature=features)).SerializeToString()
+
+
+def csv_to_tfrecord(file_pattern, save_path, num_shards=4, compression=None, batch_size=1024):
+    """
+    offline conversion of sample csv files to tfrecord shards laid out like saveSamplesAsTFRecord,
+    part-xxxxx.tfrecord[.gz] files plus the _schema.json the readers build their parse specs from
+    batches are assigned to the shards round robin, so each shard keeps the file order of its rows
+    return: number of written examples
+    """
+    dataset, fields = parsed_batches(file_pattern, batch_size, num_parallel_reads=1)
+    if tf.io.gfile.exists(save_path):
+        tf.io.gfile.rmtree(save_path)
+    tf.io.gfile.makedirs(save_path)
+    with tf.io.gfile.GFile(save_path + '/' + SCHEMA_FILE, 'w') as f:
+        f.write(json.dumps({'fields': fields, 'compression': compression or ''}))
+    suffix = '.gz' if compression == 'GZIP' else ''
+    writers = [tf.io.TFRecordWriter(save_path + '/part-{:05d}.tfrecord{}'.format(shard, suffix), options=compression)
+               for shard in range(num_shards)]
+    written = 0
+    for batch_index, batch in enumerate(dataset.as_numpy_iterator()):
+        writer = writers[batch_index % num_shards]
+        for row_index in range(len(batch[fields[0][0]])):
+            writer.write(encode_example(fields, {name: values[row_index] for name, values in batch.items()}))
+            written += 1
+    for writer in writers:
+        writer.close()
+    return written
+
+
+if __name__ == '__main__':
+    # usage: SampleDataset.py <csv file or glob> <tfrecord directory> [num shards] [GZIP]
+    written = csv_to_tfrecord(sys.argv[1], sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 4,
+                              sys.argv[4] if len(sys.argv) > 4 else None)
+    print("wrote {} examples to {}".format(written, sys.argv[2]))
@@ -0,0 +1,78 @@
+import sys
+import tempfile
+import time
+import numpy as np
+import tensorflow as tf
+from SampleDataset import get_dataset, csv_to_tfrecord
+
+
+# the get_dataset every model script used to define
+def legacy_dataset(file_path, batch_size=12, shuffle=True):
+    return tf.data.experimental.make_csv_dataset(
+        file_path,
+        batch_size=batch_size,
+        label_name='label',
+        na_value="0",
+        num_epochs=1,
+        shuffle=shuffle,
+        ignore_errors=True)
+
+
+def samples_per_second(dataset, epochs):
+    # samples/sec of every epoch, a full pass over the dataset without a model so only the input pipeline is timed
+    rates = []
+    for _ in range(epochs):
+        start = time.time()
+        samples = 0
+        for _, label in dataset:
+            samples += int(label.shape[0])
+        rates.append(samples / (time.time() - start))
+    return rates
+
+
+def benchmark_input_pipelines(csv_path, tfrecord_path, batch_sizes=(12, 256, 1024), epochs=3):
+    """
+    samples/sec of the old make_csv_dataset against the shared pipeline on the csv and on tfrecord shards,
+    the first epoch parses the files, the later ones read the parsed batches from the cache
+    """
+    print("{:<32s} {:>6s} {:>12s} {:>12s}".format('pipeline', 'batch', 'epoch 1/s', 'cached/s'))
+    for batch_size in batch_sizes:
+        candidates = [('make_csv_dataset', legacy_dataset(csv_path, batch_size)),
+                      ('shared csv', get_dataset(csv_path, batch_size)),
+                      ('shared csv without cache', get_dataset(csv_path, batch_size, cache=False)),
+                      ('shared tfrecord', get_dataset(tfrecord_path, batch_size))]
+        for name, dataset in candidates:
+            rates = samples_per_second(dataset, epochs)
+            print("{:<32s} {:6d} {:12.0f} {:12.0f}".format(name, batch_size, rates[0], np.mean(rates[1:])))
+
+
+def check_dataset_parity(csv_path, batch_size=12):
+    # unshuffled, the csv and tfrecord pipelines must return the values make_csv_dataset parses from the csv,
+    # the tfrecord copy has a single shard so its rows keep the csv order
+    tfrecord_path = tempfile.mkdtemp() + '/parity'
+    csv_to_tfrecord(csv_path, tfrecord_path, num_shards=1)
+    batches = [list(legacy_dataset(csv_path, batch_size, shuffle=False).as_numpy_iterator()),
+               list(get_dataset(csv_path, batch_size, shuffle_buffer_size=0).as_numpy_iterator()),
+               list(get_dataset(tfrecord_path, batch_size, shuffle_buffer_size=0).as_numpy_iterator())]
+    assert len(batches[0]) == len(batches[1]) == len(batches[2]), "datasets have different batch counts"
+    for (expected_features, expected_label), *others in zip(*batches):
+        for features, label in others:
+            assert np.array_equal(expected_label, label), "labels differ"
+            for name, expected in expected_features.items():
+                if expected.dtype.kind in 'SO':
+                    assert np.array_equal(expected, features[name]), name + " differs"
+                else:
+                    assert np.allclose(expected, features[name]), name + " differs"
+                    assert expected.dtype == features[name].dtype, name + " has a different dtype"
+    print("csv and tfrecord pipelines match make_csv_dataset on {} batches".format(len(batches[0])))
+
+
+if __name__ == '__main__':
+    # usage: SampleDatasetBenchmark.py <samples csv>
+    csv_path = sys.argv[1]
+    tfrecord_path = tempfile.mkdtemp() + '/samples'
+    start = time.time()
+    written = csv_to_tfrecord(csv_path, tfrecord_path)
+    print("converted {} samples to tfrecord in {:.2f}s".format(written, time.time() - start))
+    check_dataset_parity(csv_path)
+    benchmark_input_pipelines(csv_path, tfrecord_path)
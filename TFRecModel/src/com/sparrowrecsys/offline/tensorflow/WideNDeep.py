@@ -1,129 +1,54 @@
+import sys
 import tensorflow as tf
-
-# Training samples path, change to your local path
-training_samples_file_path = tf.keras.utils.get_file("trainingSamples.csv",
-                                                     "file:///Users/zhewang/Workspace/SparrowRecSys/src/main"
-                                                     "/resources/webroot/sampledata/trainingSamples.csv")
-# Test samples path, change to your local path
-test_samples_file_path = tf.keras.utils.get_file("testSamples.csv",
-                                                 "file:///Users/zhewang/Workspace/SparrowRecSys/src/main"
-                                                 "/resources/webroot/sampledata/testSamples.csv")
-
-
-# load sample as tf dataset
-def get_dataset(file_path):
-    dataset = tf.data.experimental.make_csv_dataset(
-        file_path,
-        batch_size=12,
-        label_name='label',
-        na_value="0",
-        num_epochs=1,
-        ignore_errors=True)
-    return dataset
-
-
-# split as test dataset and training dataset
-train_dataset = get_dataset(training_samples_file_path)
-test_dataset = get_dataset(test_samples_file_path)
-
-# genre features vocabulary
-genre_vocab = ['Film-Noir', 'Action', 'Adventure', 'Horror', 'Romance', 'War', 'Comedy', 'Western', 'Documentary',
-               'Sci-Fi', 'Drama', 'Thriller',
-               'Crime', 'Fantasy', 'Animation', 'IMAX', 'Mystery', 'Children', 'Musical']
-
-GENRE_FEATURES = {
-    'userGenre1': genre_vocab,
-    'userGenre2': genre_vocab,
-    'userGenre3': genre_vocab,
-    'userGenre4': genre_vocab,
-    'userGenre5': genre_vocab,
-    'movieGenre1': genre_vocab,
-    'movieGenre2': genre_vocab,
-    'movieGenre3': genre_vocab
-}
-
-# all categorical features
-categorical_columns = []
-for feature, vocab in GENRE_FEATURES.items():
-    cat_col = tf.feature_column.categorical_column_with_vocabulary_list(
-        key=feature, vocabulary_list=vocab)
-    emb_col = tf.feature_column.embedding_column(cat_col, 10)
-    categorical_columns.append(emb_col)
-# movie id embedding feature
-movie_col = tf.feature_column.categorical_column_with_identity(key='movieId', num_buckets=1001)
-movie_emb_col = tf.feature_column.embedding_column(movie_col, 10)
-categorical_columns.append(movie_emb_col)
-
-# user id embedding feature
-user_col = tf.feature_column.categorical_column_with_identity(key='userId', num_buckets=30001)
-user_emb_col = tf.feature_column.embedding_column(user_col, 10)
-categorical_columns.append(user_emb_col)
-
-# all numerical features
-numerical_columns = [tf.feature_column.numeric_column('releaseYear'),
-                     tf.feature_column.numeric_column('movieRatingCount'),
-                     tf.feature_column.numeric_column('movieAvgRating'),
-                     tf.feature_column.numeric_column('movieRatingStddev'),
-                     tf.feature_column.numeric_column('userRatingCount'),
-                     tf.feature_column.numeric_column('userAvgRating'),
-                     tf.feature_column.numeric_column('userRatingStddev')]
-
-# cross feature between current movie and user historical movie
-rated_movie = tf.feature_column.categorical_column_with_identity(key='userRatedMovie1', num_buckets=1001)
-crossed_feature = tf.feature_column.indicator_column(tf.feature_column.crossed_column([movie_col, rated_movie], 10000))
-
-# define input for keras model
-inputs = {
-    'movieAvgRating': tf.keras.layers.Input(name='movieAvgRating', shape=(), dtype='float32'),
-    'movieRatingStddev': tf.keras.layers.Input(name='movieRatingStddev', shape=(), dtype='float32'),
-    'movieRatingCount': tf.keras.layers.Input(name='movieRatingCount', shape=(), dtype='int32'),
-    'userAvgRating': tf.keras.layers.Input(name='userAvgRating', shape=(), dtype='float32'),
-    'userRatingStddev': tf.keras.layers.Input(name='userRatingStddev', shape=(), dtype='float32'),
-    'userRatingCount': tf.keras.layers.Input(name='userRatingCount', shape=(), dtype='int32'),
-    'releaseYear': tf.keras.layers.Input(name='releaseYear', shape=(), dtype='int32'),
-
-    'movieId': tf.keras.layers.Input(name='movieId', shape=(), dtype='int32'),
-    'userId': tf.keras.layers.Input(name='userId', shape=(), dtype='int32'),
-    'userRatedMovie1': tf.keras.layers.Input(name='userRatedMovie1', shape=(), dtype='int32'),
-
-    'userGenre1': tf.keras.layers.Input(name='userGenre1', shape=(), dtype='string'),
-    'userGenre2': tf.keras.layers.Input(name='userGenre2', shape=(), dtype='string'),
-    'userGenre3': tf.keras.layers.Input(name='userGenre3', shape=(), dtype='string'),
-    'userGenre4': tf.keras.layers.Input(name='userGenre4', shape=(), dtype='string'),
-    'userGenre5': tf.keras.layers.Input(name='userGenre5', shape=(), dtype='string'),
-    'movieGenre1': tf.keras.layers.Input(name='movieGenre1', shape=(), dtype='string'),
-    'movieGenre2': tf.keras.layers.Input(name='movieGenre2', shape=(), dtype='string'),
-    'movieGenre3': tf.keras.layers.Input(name='movieGenre3', shape=(), dtype='string'),
-}
-
-# wide and deep model architecture
-# deep part for all input features
-deep = tf.keras.layers.DenseFeatures(numerical_columns + categorical_columns)(inputs)
-deep = tf.keras.layers.Dense(128, activation='relu')(deep)
-deep = tf.keras.layers.Dense(128, activation='relu')(deep)
-# wide part for cross feature
-wide = tf.keras.layers.DenseFeatures(crossed_feature)(inputs)
-both = tf.keras.layers.concatenate([deep, wide])
-output_layer = tf.keras.layers.Dense(1, activation='sigmoid')(both)
-model = tf.keras.Model(inputs, output_layer)
-
-# compile the model, set loss function, optimizer and evaluation metrics
-model.compile(
-    loss='binary_crossentropy',
-    optimizer='adam',
-    metrics=['accuracy', tf.keras.metrics.AUC(curve='ROC'), tf.keras.metrics.AUC(curve='PR')])
-
-# train the model
-model.fit(train_dataset, epochs=5)
-
-# evaluate the model
-test_loss, test_accuracy, test_roc_auc, test_pr_auc = model.evaluate(test_dataset)
-print('\n\nTest Loss {}, Test Accuracy {}, Test ROC AUC {}, Test PR AUC {}'.format(test_loss, test_accuracy,
-                                                                                   test_roc_auc, test_pr_auc))
-
-# print some predict results
-predictions = model.predict(test_dataset)
-for prediction, goodRating in zip(predictions[:12], list(test_dataset)[0][1][:12]):
-    print("Predicted good rating: {:.2%}".format(prediction[0]),
-          " | Actual rating label: ",
-          ("Good Rating" if bool(goodRating) else "Bad Rating"))
+from FeatureLayers import sample_inputs, genre_lookup, genre_embedding, numeric_features, crossed_ids, \
+    first_order_weight, GENRE_BUCKETS, MOVIE_ID_BUCKETS, USER_ID_BUCKETS, USER_GENRES, MOVIE_GENRES, MOVIE_NUMERIC, \
+    USER_NUMERIC
+
+
+def build_model():
+    """
+    wide and deep: the deep part is an MLP over numeric features, id and pooled genre embeddings, the wide part
+    is the hashed movieId x userRatedMovie1 cross
+    """
+    # define input for keras model
+    inputs = sample_inputs(MOVIE_NUMERIC + USER_NUMERIC + ['movieId', 'userId', 'userRatedMovie1'] + USER_GENRES +
+                           MOVIE_GENRES)
+
+    # one genre lookup and embedding table shared by all genre features, user genres and movie genres are each
+    # pooled into a single vector
+    genre_index = genre_lookup()
+    genre_emb_layer = tf.keras.layers.Embedding(GENRE_BUCKETS, 10)
+    user_genre_emb = genre_embedding(inputs, USER_GENRES, genre_index, genre_emb_layer)
+    movie_genre_emb = genre_embedding(inputs, MOVIE_GENRES, genre_index, genre_emb_layer)
+
+    # movie id and user id embedding features
+    movie_emb = tf.keras.layers.Embedding(MOVIE_ID_BUCKETS, 10)(inputs['movieId'])
+    user_emb = tf.keras.layers.Embedding(USER_ID_BUCKETS, 10)(inputs['userId'])
+
+    # cross feature between current movie and user historical movie, one weight per hashed cross bucket
+    crossed_feature = crossed_ids(inputs, ['movieId', 'userRatedMovie1'], 10000)
+    crossed_weight = first_order_weight(tf.expand_dims(crossed_feature, 1), tf.keras.layers.Embedding(10000, 1))
+
+    # wide and deep model architecture
+    # deep part for all input features
+    deep = tf.keras.layers.concatenate([numeric_features(inputs, MOVIE_NUMERIC + USER_NUMERIC),
+                                        movie_emb, user_emb, user_genre_emb, movie_genre_emb])
+    deep = tf.keras.layers.Dense(128, activation='relu')(deep)
+    deep = tf.keras.layers.Dense(128, activation='relu')(deep)
+    # wide part for cross feature
+    both = tf.keras.layers.concatenate([deep, crossed_weight])
+    output_layer = tf.keras.layers.Dense(1, activation='sigmoid')(both)
+    model = tf.keras.Model(inputs, output_layer)
+
+    # compile the model, set loss function, optimizer and evaluation metrics
+    model.compile(
+        loss='binary_crossentropy',
+        optimizer='adam',
+        metrics=['accuracy', tf.keras.metrics.AUC(curve='ROC'), tf.keras.metrics.AUC(curve='PR')])
+    return model
+
+
+if __name__ == '__main__':
+    # usage: WideNDeep.py [--train samples] [--test samples] [--epochs n] ..., see ModelZoo.py
+    from ModelZoo import main
+    main(['train', 'WideNDeep'] + sys.argv[1:])